@@ -1,49 +1,93 @@
 #! /usr/bin/env python
 
+import argparse
 import logging
 import time
 
-import config
 import executor
-
-config = config.Config()
+import ingester
+import profiling
 
 
 class Announcer(executor.Executor):
-    def __init__(self, logger=None, slackbot_injected=None, slacker_injected=None):
-        super(Announcer, self).__init__(slackbot_injected=slackbot_injected, slacker_injected=slacker_injected)
+    def __init__(self, logger=None, slackbot_injected=None, slacker_injected=None, state_injected=None,
+                 config_injected=None, session=None, warm_injected=None):
+        super(Announcer, self).__init__(slackbot_injected=slackbot_injected, slacker_injected=slacker_injected,
+                                        state_injected=state_injected, config_injected=config_injected, session=session,
+                                        warm_injected=warm_injected)
         self.logger = logger or logging.getLogger(__name__)
 
-    def get_new_channels(self):
+    @profiling.in_phase('listing')
+    def get_new_channel_objects(self):
         """
-        returns [(channel_name, creator, purpose)] created in the last 24 hours
+        returns public channel objects created since the newest channel we've already announced
+        (or in the last 24 hours, if we haven't announced any), oldest first
         """
 
-        now = int(time.time())
+        now = self.ds.now
         dayago = now - 86400
-        channels = self.slacker.get_all_channel_objects()
-        new_channels = [channel for channel in channels if channel['created'] > dayago]
-        new = []
-        for new_channel in new_channels:
-            purpose = self.slacker.asciify(new_channel['purpose']['value'])
-            creator = new_channel['creator']
-            friendly = self.slacker.asciify(self.slacker.users_by_id[creator])
-            name = self.slacker.asciify(new_channel['name'])
-            new.append((name, friendly, purpose))
-        return new
+        since = self.state.section('announcer').get('high_water_mark', dayago)
+        if since >= dayago and ingester.covers(self.state, dayago, now):
+            self.logger.debug("Using new channels recorded by the event ingester")
+            with self.state.lock:
+                # another stage's save may rewrite the section in place, so iterate over a copy
+                channels = list(self.state.section('new_channels').values())
+        else:
+            channels = self.slacker.iter_channel_objects()
+        # private channels are only listed with include_private_channels, and never announced
+        new_channels = [channel for channel in channels if channel['created'] > since and not channel.get('is_private')]
+        new_channels.sort(key=lambda channel: channel['created'])
+        return new_channels
+
+    def describe_channel(self, channel):
+        """
+        returns (channel_name, creator, purpose) for a channel object
+        """
+        purpose = self.slacker.asciify(channel['purpose']['value'])
+        creator = channel['creator']
+        friendly = self.slacker.asciify(self.slacker.get_user_name(creator))
+        name = self.slacker.asciify(channel['name'])
+        return (name, friendly, purpose)
+
+    def get_new_channels(self):
+        """
+        returns [(channel_name, creator, purpose)] created since the last announcement (or in the last 24 hours)
+        """
+        return [self.describe_channel(channel) for channel in self.get_new_channel_objects()]
 
     def announce(self):
-        new = self.get_new_channels()
-        for cname, creator, purpose in new:
+        new_channels = self.get_new_channel_objects()
+        # after an outage, the backlog is announced over several runs rather than in one burst
+        limit = self.config.get('announce_max_per_run', 20)
+        if len(new_channels) > limit:
+            # channels created in the same second as the last one announced go too, or the high-water mark skips them
+            while limit < len(new_channels) and new_channels[limit]['created'] == new_channels[limit - 1]['created']:
+                limit += 1
+            self.logger.info("Announcing %s of %s new channels; the rest wait for the next run", limit, len(new_channels))
+            new_channels = new_channels[:limit]
+        for i, new_channel in enumerate(new_channels):
+            cname, creator, purpose = self.describe_channel(new_channel)
             m = "Channel #{} was created by @{} with purpose: {}".format(cname, creator, purpose)
             if self.destalinator_activated:
-                if self.slacker.channel_exists(config.announce_channel):
-                    self.slackbot.say(config.announce_channel, m)
+                if self.slacker.channel_exists(self.config.announce_channel):
+                    self.slackbot.say(self.config.announce_channel, m)
                 else:
-                    self.ds.logger.warning("Attempted to announce in %s, but channel does not exist.", config.announce_channel)
+                    self.ds.logger.warning("Attempted to announce in %s, but channel does not exist.", self.config.announce_channel)
+                # saved as each announcement is made, so a run that dies partway doesn't announce it again; but only
+                # once every channel created in the same second is announced, as the mark would skip the rest
+                if i + 1 == len(new_channels) or new_channels[i + 1]['created'] != new_channel['created']:
+                    with self.state.lock:
+                        self.state.section('announcer')['high_water_mark'] = new_channel['created']
+                    self.state.save()
             self.logger.info("ANNOUNCE: %s", m)
 
 
 if __name__ == "__main__":
-    announcer = Announcer()
-    announcer.announce()
+    parser = argparse.ArgumentParser(description='Announce newly created channels.')
+    profiling.add_argument(parser)
+    args = parser.parse_args()
+
+    with profiling.profiled("announcer", args.profile):
+        announcer = Announcer()
+        announcer.announce()
+    announcer.emit_report()
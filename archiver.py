@@ -1,6 +1,10 @@
 #! /usr/bin/env python
 
+import argparse
+
 import executor
+import profiling
+import sharding
 
 
 class Archiver(executor.Executor):
@@ -10,5 +14,15 @@ class Archiver(executor.Executor):
 
 
 if __name__ == "__main__":
-    archiver = Archiver()
-    archiver.archive()
+    parser = argparse.ArgumentParser(description='Archive channels that have been stale for a while.')
+    profiling.add_argument(parser)
+    sharding.add_argument(parser)
+    args = parser.parse_args()
+
+    if sharding.requested(args.shards):
+        sharding.run("archiver", args.shards)
+    else:
+        with profiling.profiled("archiver", args.profile):
+            archiver = Archiver()
+            archiver.archive()
+        archiver.emit_report()
@@ -0,0 +1,99 @@
+"""
+Benchmark decoding a large channels.history page with each installed JSON decoder and
+with the streaming parser (which keeps only the messages a filter accepts).
+
+Run from the repository root, e.g.:
+
+    python -m benchmarks.decoding --messages 20000
+"""
+
+import argparse
+import json
+import random
+import time
+import tracemalloc
+
+import decoding
+from benchmarks import workspace
+
+
+WORDS = ("the", "channel", "deploy", "lunch", "meeting", "review", "release", "bug", "fix", "thanks",
+         "tomorrow", "standup", "design", "docs", "ticket", "merge", "build", "\u00fcber", "caf\u00e9", ":tada:")
+
+
+def history_page(messages, seed=0):
+    """Return a channels.history payload of `messages` messages, encoded as bytes."""
+    rnd = random.Random(seed)
+    now = time.time()
+    page = []
+    for i in range(messages):
+        extra = {}
+        if rnd.random() < 0.1:
+            extra['subtype'] = rnd.choice(['channel_join', 'bot_message'])
+        if rnd.random() < 0.2:
+            extra['attachments'] = [{'fallback': "attachment {}".format(i), 'text': "x" * rnd.randint(10, 400)}]
+        if rnd.random() < 0.1:
+            extra['reactions'] = [{'name': "+1", 'count': 2, 'users': ["U0001", "U0002"]}]
+        text = " ".join(rnd.choice(WORDS) for _ in range(rnd.randint(3, 60)))
+        page.append(workspace.message("U{:04d}".format(rnd.randint(0, 999)), text, now - i * 60, **extra))
+    return json.dumps({'ok': True, 'messages': page, 'has_more': False}).encode('utf-8')
+
+
+FILTERS = {
+    'all': lambda message: True,
+    'human': lambda message: message.get('subtype') is None,
+    'none': lambda message: False,
+}
+
+
+def measure(decode, data, repeat):
+    """Return (best seconds over `repeat` runs, peak KB allocated) of decode(data); memory is traced in a separate run."""
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        decode(data)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    tracemalloc.start()
+    decode(data)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak // 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark decoding a large channels.history page.")
+    parser.add_argument("--messages", type=int, default=20000, help="messages in the page")
+    parser.add_argument("--chunk-size", type=int, default=65536, help="bytes per chunk when streaming")
+    parser.add_argument("--keep", choices=sorted(FILTERS), default="human",
+                        help="which messages to keep: all, those without a subtype, or none")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", default=False, help="print results as JSON")
+    args = parser.parse_args()
+
+    data = history_page(args.messages, args.seed)
+    chunks = [data[i:i + args.chunk_size] for i in range(0, len(data), args.chunk_size)]
+
+    keep = FILTERS[args.keep]
+    cases = []
+    for name in sorted(decoding.DECODERS):
+        loads = decoding.DECODERS[name]
+        cases.append((name, lambda data, loads=loads: [m for m in loads(data)['messages'] if keep(m)]))
+    cases.append(('streaming', lambda data: [m for m in decoding.StreamingObject(iter(chunks), 'messages') if keep(m)]))
+
+    results = []
+    for name, decode in cases:
+        seconds, peak = measure(decode, data, args.repeat)
+        results.append({'decoder': name, 'bytes': len(data), 'seconds': round(seconds, 4), 'peak_memory_kb': peak})
+    if args.json:
+        print(json.dumps(results, indent=4))
+        return
+    print("{} messages, {} bytes".format(args.messages, len(data)))
+    print("{:<10} {:>10} {:>10}".format("decoder", "time (s)", "peak KB"))
+    for result in results:
+        print("{decoder:<10} {seconds:>10} {peak_memory_kb:>10}".format(**result))
+
+
+if __name__ == "__main__":
+    main()
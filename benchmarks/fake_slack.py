@@ -0,0 +1,412 @@
+"""
+A local stand-in for the parts of the Slack Web API destalinator uses, serving a
+benchmarks.workspace.Workspace over HTTP with configurable latency and rate limits.
+"""
+
+import argparse
+import bisect
+import collections
+import json
+import multiprocessing
+import random
+import threading
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs, urlparse
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import parse_qs, urlparse
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class FakeSlack(object):
+    """
+    Serves `workspace` on localhost until `stop()` is called.
+
+    * `latency` seconds (plus up to `jitter` more, at random) are added to every request
+    * `rate_limit` caps requests per second per API method; requests over it get a 429
+    * `throttle_rate` and `error_rate` are the fractions of requests answered with a 429 or a 500 regardless
+    * throttled requests are told to retry after `retry_after` seconds
+    * `inject(method, status)` makes the next request(s) for a method fail deterministically
+    """
+
+    def __init__(self, workspace, latency=0.0, jitter=0.0, rate_limit=None, throttle_rate=0.0, error_rate=0.0,
+                 retry_after=1, seed=0, port=0):
+        self.workspace = workspace
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit = rate_limit
+        self.throttle_rate = throttle_rate
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = collections.Counter()
+        self.throttled = collections.Counter()
+        self.errors = collections.Counter()
+        self.injected = collections.defaultdict(list)
+        self.bytes_sent = 0
+        self.windows = {}
+        self.methods = {
+            'channels.list': self.channels_list,
+            'channels.info': self.channels_info,
+            'channels.history': self.channels_history,
+            'channels.archive': self.channels_archive,
+            'conversations.list': self.conversations_list,
+            'conversations.info': self.conversations_info,
+            'conversations.history': self.conversations_history,
+            'conversations.archive': self.channels_archive,
+            'conversations.members': self.conversations_members,
+            'users.list': self.users_list,
+            'users.info': self.users_info,
+            'emoji.list': self.emoji_list,
+            'chat.postMessage': self.chat_post_message,
+            'chat.delete': self.chat_delete,
+        }
+
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                fake.handle(self, b"")
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                fake.handle(self, self.rfile.read(length))
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    @property
+    def url(self):
+        """Base URL to hand to slacker.Slacker(api_url=...)."""
+        return "http://127.0.0.1:{}/api/".format(self.port)
+
+    @property
+    def slackbot_url(self):
+        """URL to hand to slackbot.Slackbot(url=...)."""
+        return "http://127.0.0.1:{}/services/hooks/slackbot".format(self.port)
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def counters(self):
+        """Return what has been counted so far, as also served at /_counters."""
+        with self.lock:
+            return {'calls': dict(self.calls), 'throttled': dict(self.throttled), 'errors': dict(self.errors),
+                    'bytes_sent': self.bytes_sent}
+
+    def reset_counters(self):
+        with self.lock:
+            self.calls.clear()
+            self.throttled.clear()
+            self.errors.clear()
+            self.bytes_sent = 0
+
+    def inject(self, method, status, times=1):
+        """Answer the next `times` requests for `method` (e.g. 'channels.history' or 'slackbot') with HTTP `status`."""
+        with self.lock:
+            self.injected[method].extend([status] * times)
+
+    # request plumbing
+
+    def over_rate_limit(self, method):
+        """Return True if `method` has already been called `rate_limit` times in the current second."""
+        if not self.rate_limit:
+            return False
+        second = int(time.time())
+        with self.lock:
+            window_second, count = self.windows.get(method, (second, 0))
+            if window_second != second:
+                window_second, count = second, 0
+            self.windows[method] = (window_second, count + 1)
+            return count >= self.rate_limit
+
+    def handle(self, request, body):
+        parsed = urlparse(request.path)
+        if parsed.path == '/_counters':
+            self.respond(request, 200, self.counters())
+            return
+        params = {k: v[0] for k, v in parse_qs(parsed.query).items()}
+        if parsed.path.startswith('/api/'):
+            method = parsed.path[len('/api/'):]
+            params.update({k: v[0] for k, v in parse_qs(body.decode('utf-8')).items()})
+        elif parsed.path == '/services/hooks/slackbot':
+            method = 'slackbot'
+        else:
+            method = None
+        with self.lock:
+            self.calls[method] += 1
+            status = self.injected[method].pop(0) if self.injected[method] else None
+            roll = self.random.random()
+            delay = self.latency + self.random.uniform(0, self.jitter)
+        if status is None and roll < self.throttle_rate:
+            status = 429
+        elif status is None and roll < self.throttle_rate + self.error_rate:
+            status = 500
+
+        if delay:
+            time.sleep(delay)
+
+        if status == 429 or (status is None and self.over_rate_limit(method)):
+            with self.lock:
+                self.throttled[method] += 1
+            self.respond(request, 429, {'ok': False, 'error': 'ratelimited'}, {'Retry-After': str(self.retry_after)})
+        elif status is not None:
+            with self.lock:
+                self.errors[method] += 1
+            self.respond(request, status, {'ok': False, 'error': 'fatal_error'})
+        elif method == 'slackbot':
+            self.slackbot_say(params, body)
+            self.respond(request, 200, None)
+        elif method in self.methods:
+            self.respond(request, 200, self.methods[method](params))
+        else:
+            self.respond(request, 404, {'ok': False, 'error': 'unknown_method'})
+
+    def respond(self, request, status, payload, headers=None):
+        body = json.dumps(payload).encode('utf-8') if payload is not None else b"ok"
+        request.send_response(status)
+        request.send_header('Content-Type', 'application/json')
+        request.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            request.send_header(name, value)
+        request.end_headers()
+        request.wfile.write(body)
+        with self.lock:
+            self.bytes_sent += len(body)
+
+    # helpers
+
+    def find_channel(self, channel):
+        """Look a channel up by ID, name or #name."""
+        channel = channel or ''
+        if channel.startswith('#'):
+            channel = channel[1:]
+        return self.workspace.channels_by_id.get(channel) or self.workspace.channels_by_name.get(channel)
+
+    def post(self, channel, text, **kwargs):
+        message = {"type": "message", "subtype": "bot_message", "text": text, "ts": "{:.6f}".format(time.time())}
+        message.update(kwargs)
+        with self.lock:
+            self.workspace.history[channel['id']].append(message)
+        return message
+
+    # API methods
+
+    def list_channels(self, params, private):
+        exclude_archived = params.get('exclude_archived') in ('1', 'true')
+        channels = [c for c in self.workspace.channels
+                    if not (exclude_archived and c['is_archived']) and (private or not c.get('is_private'))]
+        limit = int(params.get('limit') or 0)
+        if not limit:
+            return {'ok': True, 'channels': channels}
+        start = int(params.get('cursor') or 0)
+        page = channels[start:start + limit]
+        next_cursor = str(start + limit) if start + limit < len(channels) else ""
+        return {'ok': True, 'channels': page, 'response_metadata': {'next_cursor': next_cursor}}
+
+    def channels_list(self, params):
+        # the legacy API only lists public channels
+        return self.list_channels(params, private=False)
+
+    def channels_info(self, params):
+        channel = self.find_channel(params.get('channel'))
+        if channel is None:
+            return {'ok': False, 'error': 'channel_not_found'}
+        info = dict(channel)
+        info['members'] = list(self.workspace.members[channel['id']])
+        return {'ok': True, 'channel': info}
+
+    def channels_history(self, params):
+        channel = self.find_channel(params.get('channel'))
+        if channel is None:
+            return {'ok': False, 'error': 'channel_not_found'}
+        oldest = float(params.get('oldest') or 0)
+        latest = float(params.get('latest') or time.time())
+        inclusive = params.get('inclusive') == '1'
+        count = int(params.get('count') or 100)
+        messages = self.workspace.history[channel['id']]
+        timestamps = [float(m['ts']) for m in messages]
+        if inclusive:
+            lo, hi = bisect.bisect_left(timestamps, oldest), bisect.bisect_right(timestamps, latest)
+        else:
+            lo, hi = bisect.bisect_right(timestamps, oldest), bisect.bisect_left(timestamps, latest)
+        window = messages[lo:hi]
+        page = list(reversed(window[-count:]))
+        return {'ok': True, 'messages': page, 'has_more': len(window) > count}
+
+    def conversations_list(self, params):
+        types = (params.get('types') or 'public_channel').split(',')
+        ret = self.list_channels(params, private='private_channel' in types)
+        if 'public_channel' not in types:
+            ret['channels'] = [c for c in ret['channels'] if c.get('is_private')]
+        return ret
+
+    def conversations_info(self, params):
+        channel = self.find_channel(params.get('channel'))
+        if channel is None:
+            return {'ok': False, 'error': 'channel_not_found'}
+        return {'ok': True, 'channel': dict(channel)}
+
+    def conversations_history(self, params):
+        channel = self.find_channel(params.get('channel'))
+        if channel is None:
+            return {'ok': False, 'error': 'channel_not_found'}
+        oldest = float(params.get('oldest') or 0)
+        latest = float(params.get('latest') or time.time())
+        inclusive = params.get('inclusive') in ('1', 'true')
+        limit = int(params.get('limit') or 100)
+        messages = self.workspace.history[channel['id']]
+        timestamps = [float(m['ts']) for m in messages]
+        if inclusive:
+            lo, hi = bisect.bisect_left(timestamps, oldest), bisect.bisect_right(timestamps, latest)
+        else:
+            lo, hi = bisect.bisect_right(timestamps, oldest), bisect.bisect_left(timestamps, latest)
+        # newest first; the cursor is how many of the window's newest messages have been returned
+        window = list(reversed(messages[lo:hi]))
+        start = int(params.get('cursor') or 0)
+        page = window[start:start + limit]
+        has_more = start + limit < len(window)
+        return {'ok': True, 'messages': page, 'has_more': has_more,
+                'response_metadata': {'next_cursor': str(start + limit) if has_more else ""}}
+
+    def channels_archive(self, params):
+        channel = self.find_channel(params.get('channel'))
+        if channel is None:
+            return {'ok': False, 'error': 'channel_not_found'}
+        if channel['is_archived']:
+            return {'ok': False, 'error': 'already_archived'}
+        channel['is_archived'] = True
+        return {'ok': True}
+
+    def conversations_members(self, params):
+        channel = self.find_channel(params.get('channel'))
+        if channel is None:
+            return {'ok': False, 'error': 'channel_not_found'}
+        members = list(self.workspace.members[channel['id']])
+        limit = int(params.get('limit') or 100)
+        start = int(params.get('cursor') or 0)
+        next_cursor = str(start + limit) if start + limit < len(members) else ""
+        return {'ok': True, 'members': members[start:start + limit], 'response_metadata': {'next_cursor': next_cursor}}
+
+    def users_list(self, params):
+        return {'ok': True, 'members': self.workspace.users}
+
+    def users_info(self, params):
+        for user in self.workspace.users:
+            if user['id'] == params.get('user'):
+                return {'ok': True, 'user': user}
+        return {'ok': False, 'error': 'user_not_found'}
+
+    def emoji_list(self, params):
+        return {'ok': True, 'emoji': self.workspace.emoji}
+
+    def chat_post_message(self, params):
+        channel = self.find_channel(params.get('channel'))
+        if channel is None:
+            return {'ok': False, 'error': 'channel_not_found'}
+        kwargs = {'username': params.get('username', 'bot')}
+        if params.get('attachments'):
+            kwargs['attachments'] = json.loads(params['attachments'])
+        message = self.post(channel, params.get('text', ''), **kwargs)
+        return {'ok': True, 'channel': channel['id'], 'ts': message['ts'], 'message': message}
+
+    def chat_delete(self, params):
+        channel = self.find_channel(params.get('channel'))
+        if channel is None:
+            return {'ok': False, 'error': 'channel_not_found'}
+        with self.lock:
+            messages = self.workspace.history[channel['id']]
+            messages[:] = [m for m in messages if m['ts'] != params.get('ts')]
+        return {'ok': True}
+
+    def slackbot_say(self, params, body):
+        channel = self.find_channel(params.get('channel'))
+        if channel is not None:
+            self.post(channel, body.decode('utf-8'), username='slackbot', user='USLACKBOT')
+
+
+def serve(conn, workspace_kwargs, fake_kwargs):
+    """Serve a workspace generated from `workspace_kwargs` until anything arrives on `conn`; see Subprocess."""
+    from benchmarks import workspace
+
+    fake = FakeSlack(workspace.generate(**workspace_kwargs), **fake_kwargs)
+    conn.send(fake.port)
+    conn.recv()
+    fake.stop()
+
+
+class Subprocess(object):
+    """
+    A FakeSlack generating and serving its workspace in a child process, so that the memory
+    and CPU it uses don't count towards what a benchmark measures of the code it serves.
+    """
+
+    def __init__(self, workspace_kwargs, **fake_kwargs):
+        self.conn, child_conn = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=serve, args=(child_conn, workspace_kwargs, fake_kwargs))
+        self.process.daemon = True
+        self.process.start()
+        self.port = self.conn.recv()
+
+    url = FakeSlack.url
+    slackbot_url = FakeSlack.slackbot_url
+
+    def counters(self):
+        import requests
+        return requests.get("http://127.0.0.1:{}/_counters".format(self.port)).json()
+
+    def stop(self):
+        self.conn.send(None)
+        self.process.join()
+
+
+def main():
+    from benchmarks import workspace
+
+    parser = argparse.ArgumentParser(description="Serve a synthetic workspace from a local fake Slack API.")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--channels", type=int, default=200)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--messages", type=int, default=50, help="messages per channel")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every request")
+    parser.add_argument("--jitter", type=float, default=0.0, help="up to this many more seconds, at random")
+    parser.add_argument("--rate-limit", type=int, default=None, help="requests per second per API method")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="fraction of requests answered with a 429")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with a 500")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    ws = workspace.generate(channels=args.channels, users=args.users, messages_per_channel=args.messages, seed=args.seed)
+    fake = FakeSlack(ws, latency=args.latency, jitter=args.jitter, rate_limit=args.rate_limit,
+                     throttle_rate=args.throttle_rate, error_rate=args.error_rate, seed=args.seed, port=args.port)
+    print("Serving the Slack API at {} and the Slackbot hook at {}".format(fake.url, fake.slackbot_url))
+    try:
+        while True:
+            time.sleep(60)
+            print("Calls: {}; throttled: {}; errors: {}".format(
+                sum(fake.calls.values()), sum(fake.throttled.values()), sum(fake.errors.values())))
+    except KeyboardInterrupt:
+        fake.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Benchmark destalinator's entry points against a synthetic workspace served by a local fake Slack API.
+
+Run from the repository root, e.g.:
+
+    python -m benchmarks.run --channels 1000 --messages 100 --latency 0.01
+"""
+
+import argparse
+import json
+import logging
+import os
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    # Python 2: peak memory isn't measured
+    tracemalloc = None
+
+import announcer
+import archiver
+import flagger
+import slackbot
+import slacker
+import state
+import warner
+from benchmarks import fake_slack
+
+
+ENTRY_POINTS = {
+    'warn': (warner.Warner, lambda executor: executor.warn()),
+    'archive': (archiver.Archiver, lambda executor: executor.archive()),
+    'announce': (announcer.Announcer, lambda executor: executor.announce()),
+    'flag': (flagger.Flagger, lambda executor: executor.flag()),
+}
+
+
+def run_entry_point(name, args):
+    """Run entry point `name` once against a freshly generated workspace and return its measurements."""
+    executor_class, run = ENTRY_POINTS[name]
+    workspace_kwargs = dict(channels=args.channels, users=args.users, messages_per_channel=args.messages,
+                            reactions=args.reactions, emoji_aliases=args.emoji_aliases,
+                            private_fraction=args.private_fraction, seed=args.seed)
+    # the fake runs in its own process, so building its responses doesn't count towards peak memory
+    fake = fake_slack.Subprocess(workspace_kwargs, latency=args.latency, rate_limit=args.rate_limit,
+                                 throttle_rate=args.throttle_rate, error_rate=args.error_rate, seed=args.seed)
+    try:
+        if tracemalloc:
+            tracemalloc.start()
+        start = time.time()
+        slacker_obj = slacker.Slacker("bench", token="token", api_url=fake.url)
+        slacker_obj.api = args.slack_api
+        slacker_obj.include_private = args.slack_api == 'conversations' and args.private_fraction > 0
+        slackbot_obj = slackbot.Slackbot("bench", token="token", url=fake.slackbot_url)
+        # an in-memory state store, so the run neither reads nor writes the real state file
+        executor = executor_class(slacker_injected=slacker_obj, slackbot_injected=slackbot_obj,
+                                  state_injected=state.State())
+        run(executor)
+        wall_time = time.time() - start
+        peak_memory_kb = "n/a"
+        if tracemalloc:
+            peak_memory_kb = tracemalloc.get_traced_memory()[1] // 1024
+            tracemalloc.stop()
+        counters = fake.counters()
+        return {
+            'entry_point': name,
+            'wall_time': round(wall_time, 3),
+            'api_calls': sum(counters['calls'].values()),
+            'api_calls_by_method': counters['calls'],
+            'throttled': sum(counters['throttled'].values()),
+            'errors': sum(counters['errors'].values()),
+            'bytes_received': counters['bytes_sent'],
+            'peak_memory_kb': peak_memory_kb,
+        }
+    finally:
+        fake.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark destalinator against a simulated Slack workspace.")
+    parser.add_argument("--channels", type=int, default=200)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--messages", type=int, default=50, help="messages per channel")
+    parser.add_argument("--reactions", type=float, default=0.1,
+                        help="probability that a message from the last day has reactions")
+    parser.add_argument("--emoji-aliases", type=int, default=10)
+    parser.add_argument("--private-fraction", type=float, default=0.0, help="fraction of channels that are private")
+    parser.add_argument("--slack-api", choices=["channels", "conversations"], default="channels",
+                        help="family of API methods to use for channels")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every API request")
+    parser.add_argument("--rate-limit", type=int, default=None, help="requests per second per API method")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="fraction of requests answered with a 429")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with a 500")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--entry-point", action="append", choices=sorted(ENTRY_POINTS),
+                        help="entry point to run (may be repeated; default: all)")
+    parser.add_argument("--json", action="store_true", default=False, help="print results as JSON")
+    args = parser.parse_args()
+
+    os.environ.setdefault('DESTALINATOR_ACTIVATED', 'true')
+    os.environ.setdefault('DESTALINATOR_LOG_LEVEL', 'WARNING')
+    logging.disable(logging.INFO)
+
+    results = [run_entry_point(name, args) for name in args.entry_point or sorted(ENTRY_POINTS)]
+    if args.json:
+        print(json.dumps(results, indent=4))
+        return
+    print("{:<10} {:>10} {:>10} {:>10} {:>12} {:>10}".format(
+        "entry", "wall (s)", "API calls", "throttled", "bytes in", "peak KB"))
+    for result in results:
+        print("{entry_point:<10} {wall_time:>10} {api_calls:>10} {throttled:>10} {bytes_received:>12} {peak_memory_kb:>10}".format(**result))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Synthetic Slack workspaces for benchmarking.
+"""
+
+import random
+import time
+
+
+class Workspace(object):
+    """
+    Everything a fake Slack API needs to serve a workspace:
+    channel objects, user objects, custom emoji, per-channel history (oldest first)
+    and per-channel member IDs.
+    """
+
+    def __init__(self, channels, users, emoji, history, members):
+        self.channels = channels
+        self.users = users
+        self.emoji = emoji
+        self.history = history
+        self.members = members
+        self.channels_by_id = {c['id']: c for c in channels}
+        self.channels_by_name = {c['name']: c for c in channels}
+
+
+def message(user, text, ts, **kwargs):
+    ret = {"type": "message", "user": user, "text": text, "ts": "{:.6f}".format(ts)}
+    ret.update(kwargs)
+    return ret
+
+
+def generate(channels=100, users=50, messages_per_channel=50, reactions=0.1, emoji_aliases=10,
+             stale_fraction=0.3, new_fraction=0.02, private_fraction=0.0, seed=0, now=None):
+    """
+    Return a Workspace with `channels` ordinary channels (plus the ones configuration.yaml names),
+    `users` users and `messages_per_channel` messages per channel.
+
+    * `stale_fraction` of channels have been silent for 30 days or more (half of those for 60 days or more)
+    * `new_fraction` of channels were created in the last day
+    * `reactions` is the probability that a message from the last day has reactions
+    * `emoji_aliases` custom emoji are aliases of :floppy_disk:, which the flagger rule watches
+    * `private_fraction` of the ordinary channels are private
+    """
+    rnd = random.Random(seed)
+    now = now or time.time()
+    day = 86400
+
+    user_objects = []
+    for i in range(users):
+        user = {"id": "U{:08d}".format(i), "name": "user{}".format(i), "real_name": "User {}".format(i)}
+        if rnd.random() < 0.05:
+            user["is_restricted"] = True
+        user_objects.append(user)
+    user_ids = [u["id"] for u in user_objects]
+
+    emoji = {"custom{}".format(i): "https://example.com/custom{}.png".format(i) for i in range(emoji_aliases)}
+    aliases = ["save{}".format(i) for i in range(emoji_aliases)]
+    for alias in aliases:
+        emoji[alias] = "alias:floppy_disk"
+    reaction_names = ["floppy_disk", "thumbsup"] + aliases
+
+    channel_objects = []
+    history = {}
+    members = {}
+
+    def add_channel(name, created, messages, private=False):
+        cid = "C{:08d}".format(len(channel_objects))
+        channel_members = rnd.sample(user_ids, min(len(user_ids), rnd.randint(2, 30)))
+        channel_objects.append({
+            "id": cid,
+            "name": name,
+            "created": int(created),
+            "creator": rnd.choice(user_ids),
+            "is_archived": False,
+            "is_private": private,
+            "num_members": len(channel_members),
+            "purpose": {"value": "Talk about {}".format(name)},
+        })
+        history[cid] = messages
+        members[cid] = channel_members
+        return cid
+
+    general = add_channel("general", now - 400 * day, [])
+    for name in ("zmeta-new-channels", "zmeta-control", "destalinator-log"):
+        add_channel(name, now - 400 * day, [])
+    history[channel_objects[2]["id"]].append(
+        message(user_ids[0], "flag content rule bench >=3 :floppy_disk: <#{}|general>".format(general), now - 300 * day))
+
+    for i in range(channels):
+        roll = rnd.random()
+        if roll < new_fraction:
+            created = now - rnd.uniform(0, day)
+            last = now
+        else:
+            created = now - rnd.uniform(90, 400) * day
+            if roll < new_fraction + stale_fraction / 2:
+                last = now - rnd.uniform(60, 85) * day
+            elif roll < new_fraction + stale_fraction:
+                last = now - rnd.uniform(30, 59) * day
+            else:
+                last = now - rnd.uniform(0, 10) * day
+        messages = []
+        for ts in sorted(rnd.uniform(created, last) for _ in range(messages_per_channel)):
+            m = message(rnd.choice(user_ids), "message at {:.0f}".format(ts), ts)
+            if ts > now - day and rnd.random() < reactions:
+                names = rnd.sample(reaction_names, rnd.randint(1, 3))
+                m["reactions"] = [{"name": n, "count": rnd.randint(1, 5)} for n in names]
+            messages.append(m)
+        private = bool(private_fraction) and rnd.random() < private_fraction
+        add_channel("channel-{}".format(i), created, messages, private)
+
+    return Workspace(channel_objects, user_objects, emoji, history, members)
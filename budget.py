@@ -0,0 +1,42 @@
+#! /usr/bin/env python
+
+import time
+
+import metrics
+
+
+class Budget(object):
+    """
+    A limit on how long a run may take and/or how many API calls it may make,
+    counted from when the Budget is created. Only the calls made with the labels
+    the Budget was created with count: those for its workspace in a multi-workspace
+    run, and those of its stage when the scheduler runs stages at once.
+    """
+
+    def __init__(self, seconds=None, api_calls=None):
+        self.started = time.time()
+        self.seconds = seconds
+        self.api_calls = api_calls
+        self.labels = metrics.registry.context_labels()
+        self.api_calls_at_start = metrics.registry.total('api_calls', **self.labels)
+
+    def used_api_calls(self):
+        return metrics.registry.total('api_calls', **self.labels) - self.api_calls_at_start
+
+    def exhausted(self):
+        """Return True once the time or the API calls allowed have been used up."""
+        if self.seconds is not None and time.time() - self.started >= self.seconds:
+            return True
+        return self.api_calls is not None and self.used_api_calls() >= self.api_calls
+
+    def __str__(self):
+        return "{:.0f}s and {} API calls".format(time.time() - self.started, self.used_api_calls())
+
+
+def from_config(config):
+    """Return a Budget from `budget_seconds` and `budget_api_calls` in `config`, or None if neither is set."""
+    seconds = config.get('budget_seconds')
+    api_calls = config.get('budget_api_calls')
+    if seconds is None and api_calls is None:
+        return None
+    return Budget(seconds=seconds, api_calls=api_calls)
@@ -0,0 +1,70 @@
+#! /usr/bin/env python
+
+import contextlib
+import threading
+
+
+class AdaptiveLimiter(object):
+    """
+    Limits how many requests for one API method are in flight at once, adjusting the
+    limit AIMD-style: it grows by about one per round of successful, fast responses,
+    halves when Slack throttles us (HTTP 429) and shrinks a little when responses
+    take longer than `latency_target` seconds. It starts at one request at a time and
+    opens up as the warner's history prefetch (see Destalinator.prefetched) and other
+    overlapping work show Slack keeps up.
+    """
+
+    def __init__(self, initial=1, minimum=1, maximum=32, latency_target=2.0):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.latency_target = latency_target
+        self.in_flight = 0
+        self.throttled = 0
+        self.condition = threading.Condition()
+
+    @contextlib.contextmanager
+    def slot(self):
+        """Wait for a free slot under the limit and hold it for the `with` block."""
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.in_flight += 1
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.in_flight -= 1
+                self.condition.notify_all()
+
+    def record(self, status_code, latency):
+        """Adjust the limit after a response with `status_code` that took `latency` seconds."""
+        with self.condition:
+            if status_code == 429:
+                self.throttled += 1
+                self.limit = max(self.minimum, self.limit / 2)
+            elif latency > self.latency_target:
+                self.limit = max(self.minimum, self.limit * 0.9)
+            elif status_code < 500:
+                self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+            self.condition.notify_all()
+
+
+class AdaptiveConcurrency(object):
+    """An AdaptiveLimiter per API method, each created with `settings` the first time it's needed."""
+
+    def __init__(self, **settings):
+        self.settings = settings
+        self.limiters = {}
+        self.lock = threading.Lock()
+
+    def limiter(self, method):
+        with self.lock:
+            if method not in self.limiters:
+                self.limiters[method] = AdaptiveLimiter(**self.settings)
+            return self.limiters[method]
+
+    def limits(self):
+        """Return {method: current concurrency limit}."""
+        with self.lock:
+            return dict((method, round(limiter.limit, 2)) for method, limiter in self.limiters.items())
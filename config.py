@@ -1,19 +1,34 @@
 #! /usr/bin/env python
 
+import copy
 import os
 import warnings
 import yaml
 
+# The C loader is much faster, but only there if PyYAML was built against libyaml
+Loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+# {filename: parsed configuration}, so each file is only read once per process
+_cache = {}
+
+
+def load(config_fname):
+    """Return the parsed contents of `config_fname`, reading it only the first time."""
+    if config_fname not in _cache:
+        with open(config_fname, "r") as fo:
+            _cache[config_fname] = yaml.load(fo.read(), Loader=Loader)
+    return _cache[config_fname]
+
 
 class Config(object):
     config_fname = "configuration.yaml"
 
-    def __init__(self, config_fname=None):
+    def __init__(self, config_fname=None, overrides=None):
+        """`overrides` replaces top-level settings, e.g. with those of one of several `workspaces`."""
         config_fname = config_fname or self.config_fname
-        fo = open(config_fname, "r")
-        blob = fo.read()
-        fo.close()
-        self.config = yaml.load(blob)
+        # a copy, so changing one Config's settings doesn't change every other's
+        self.config = copy.deepcopy(load(config_fname))
+        self.config.update(copy.deepcopy(overrides or {}))
 
     def __getattr__(self, attrname):
         if attrname == "slack_name":
@@ -29,7 +44,26 @@ class Config(object):
             return fallback
 
 
-# This deliberately isn't a `getenv` default so `.slack_name` isn't tried if there's a SLACK_NAME
-SLACK_NAME = os.getenv("SLACK_NAME")
-if SLACK_NAME is None:
-    SLACK_NAME = Config().slack_name
+def workspaces(config_fname=None):
+    """
+    Return a Config for each entry of `workspaces` in the configuration: the top-level
+    settings with the entry's in their place. Each entry must have a `slack_name`.
+    """
+    base = Config(config_fname)
+    ret = []
+    for overrides in base.get('workspaces') or []:
+        assert overrides.get('slack_name'), "Every workspace in `workspaces` needs a slack_name"
+        ret.append(Config(config_fname, overrides=overrides))
+    return ret
+
+
+def slack_name():
+    """
+    Return the name of the Slack to use: the SLACK_NAME environment variable, or else the deprecated
+    `slack_name` key. Resolved when asked for, so importing this module doesn't read the configuration.
+    """
+    # This deliberately isn't a `getenv` default so `.slack_name` isn't tried if there's a SLACK_NAME
+    name = os.getenv("SLACK_NAME")
+    if name is None:
+        name = Config().slack_name
+    return name
@@ -0,0 +1,141 @@
+#! /usr/bin/env python
+"""
+Decoding Slack API responses.
+
+`get()` picks the fastest JSON decoder installed (orjson, then ujson, then the standard
+library's json), and `StreamingObject` parses a large response as it arrives, yielding the
+elements of one of its lists (e.g. a channels.history page's messages) one at a time.
+"""
+
+import codecs
+import json
+import re
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+
+def stdlib_loads(data):
+    if isinstance(data, bytes):
+        data = data.decode('utf-8')
+    return json.loads(data)
+
+
+# name: function decoding a JSON document from bytes or text, for the decoders that are installed
+DECODERS = {'json': stdlib_loads}
+if ujson is not None:
+    DECODERS['ujson'] = ujson.loads
+if orjson is not None:
+    DECODERS['orjson'] = orjson.loads
+
+PREFERENCE = ('orjson', 'ujson', 'json')
+
+
+def get(name=None):
+    """Return the decoder called `name`, or the fastest installed if `name` is None or "auto"."""
+    if name in (None, 'auto'):
+        name = [x for x in PREFERENCE if x in DECODERS][0]
+    assert name in DECODERS, "JSON decoder {} isn't installed (have: {})".format(name, ", ".join(sorted(DECODERS)))
+    return DECODERS[name]
+
+
+WHITESPACE = re.compile(r'[ \t\r\n]*')
+
+
+class StreamingObject(object):
+    """
+    Parses a JSON object from an iterable of byte `chunks` (e.g. a streamed response's
+    `iter_content()`). Iterating yields the elements of the object's list `key` as soon as
+    each has arrived; its other members are collected in `fields`, which is complete once
+    iteration is. Only the unparsed part of the response is kept in memory.
+    """
+
+    def __init__(self, chunks, key):
+        self.chunks = iter(chunks)
+        self.key = key
+        self.fields = {}
+        self.bytes_read = 0
+        self.text = codecs.getincrementaldecoder('utf-8')()
+        self.decoder = json.JSONDecoder()
+        self.buffer = u''
+        self.pos = 0
+
+    def fill(self):
+        """Append the next chunk to the buffer, dropping what's been parsed; return False at the end of the stream."""
+        for chunk in self.chunks:
+            if not chunk:
+                continue
+            self.bytes_read += len(chunk)
+            self.buffer = self.buffer[self.pos:] + self.text.decode(chunk)
+            self.pos = 0
+            return True
+        return False
+
+    def peek(self):
+        """Skip whitespace and return the next character, without consuming it."""
+        while True:
+            self.pos = WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill():
+                raise ValueError("Unexpected end of JSON document")
+
+    def expect(self, chars):
+        char = self.peek()
+        if char not in chars:
+            raise ValueError("Expected one of {!r} but found {!r}".format(chars, char))
+        self.pos += 1
+        return char
+
+    def value(self):
+        """Decode the next complete JSON value."""
+        self.peek()
+        raw_decode = self.decoder.raw_decode
+        while True:
+            try:
+                value, end = raw_decode(self.buffer, self.pos)
+            except ValueError:
+                # the value is incomplete so far, unless there's nothing more to come
+                if not self.fill():
+                    raise
+                continue
+            # a number right at the end of the buffer may continue in the next chunk
+            if end == len(self.buffer) and self.fill():
+                continue
+            self.pos = end
+            return value
+
+    def __iter__(self):
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            name = self.value()
+            self.expect(':')
+            if name == self.key and self.peek() == '[':
+                self.pos += 1
+                if self.peek() == ']':
+                    self.pos += 1
+                else:
+                    while True:
+                        yield self.value()
+                        # usually the separator is right there; otherwise skip whitespace or read more
+                        char = self.buffer[self.pos] if self.pos < len(self.buffer) else self.peek()
+                        if char not in ',]':
+                            char = self.expect(',]')
+                        else:
+                            self.pos += 1
+                        if char == ']':
+                            break
+            else:
+                self.fields[name] = self.value()
+            if self.expect(',}') == '}':
+                return
@@ -0,0 +1,108 @@
+#! /usr/bin/env python
+
+import base64
+import hashlib
+import time
+
+
+class BloomFilter(object):
+    """A fixed-size Bloom filter over strings."""
+
+    def __init__(self, num_bits, num_hashes, bits=None):
+        self.num_bits = num_bits
+        self.num_hashes = num_hashes
+        self.bits = bits if bits is not None else bytearray((num_bits + 7) // 8)
+
+    def positions(self, key):
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        h1 = int(digest[:16], 16)
+        h2 = int(digest[16:32], 16) | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, key):
+        for position in self.positions(key):
+            self.bits[position // 8] |= 1 << (position % 8)
+
+    def __contains__(self, key):
+        return all(self.bits[position // 8] & (1 << (position % 8)) for position in self.positions(key))
+
+    def encode(self):
+        return base64.b64encode(bytes(self.bits)).decode('ascii')
+
+    @classmethod
+    def decode(cls, num_bits, num_hashes, blob):
+        return cls(num_bits, num_hashes, bytearray(base64.b64decode(blob)))
+
+
+class AnnouncementLog(object):
+    """
+    Remembers which announcements have already been made, keyed by strings such as
+    "channel_id:ts:rule_uuid", in a section of a state.State() store.
+
+    Every key goes into a compact Bloom filter, so most never-seen keys are rejected
+    without touching the exact store; keys from the last `retention` seconds are also
+    kept exactly.  Once the filter has taken as many keys as it was sized for it is
+    rebuilt from the exact store, which keeps its false positive rate near 1 in a
+    million.  It's sized for `capacity` keys, or twice as many as the exact store
+    holds if that's more, so it's rebuilt at most once per that many additions.
+    """
+
+    num_hashes = 20
+    # ~29 bits per key gives a false positive rate of ~1e-6 with 20 hashes
+    bits_per_key = 29
+
+    def __init__(self, state_store, section='announced', capacity=10000, retention=7 * 86400):
+        self.data = state_store.section(section)
+        # changes to the section are made under the store's lock, so it's never saved half-changed
+        self.lock = state_store.lock
+        self.capacity = capacity
+        self.retention = retention
+        with self.lock:
+            self.data.setdefault('recent', {})
+            if self.data.get('bloom') and self.data.get('num_bits', 0) >= capacity * self.bits_per_key:
+                self.bloom = BloomFilter.decode(self.data['num_bits'], self.num_hashes, self.data['bloom'])
+                # keys added since the filter was last flushed are only in the exact store
+                for key in self.data['recent']:
+                    self.bloom.add(key)
+            else:
+                self.rebuild()
+            self.expire()
+
+    def rebuild(self):
+        num_bits = max(self.capacity, 2 * len(self.data['recent'])) * self.bits_per_key
+        self.bloom = BloomFilter(num_bits, self.num_hashes)
+        for key in self.data['recent']:
+            self.bloom.add(key)
+        self.data['count'] = len(self.data['recent'])
+        self.data['num_bits'] = num_bits
+
+    def expire(self):
+        """Drop exact keys older than the retention period; the Bloom filter still remembers them."""
+        cutoff = time.time() - self.retention
+        recent = self.data['recent']
+        for key in [k for k in recent if recent[k] < cutoff]:
+            del recent[key]
+
+    def seen(self, key):
+        """Return True if `key` has (almost certainly) been announced before."""
+        if key in self.data['recent']:
+            return True
+        if key not in self.bloom:
+            return False
+        return self.data['count'] > len(self.data['recent'])
+
+    def add(self, key):
+        """Record that `key` has been announced."""
+        with self.lock:
+            self.data['recent'][key] = int(time.time())
+            self.data['count'] += 1
+            if self.data['count'] > self.bloom.num_bits // self.bits_per_key:
+                self.expire()
+                self.rebuild()
+            else:
+                self.bloom.add(key)
+
+    def flush(self):
+        """Write the Bloom filter into the state section; call before saving the state store."""
+        with self.lock:
+            self.data['bloom'] = self.bloom.encode()
@@ -1,13 +1,21 @@
 #! /usr/bin/env python
 
 from datetime import datetime, date
+import itertools
+import multiprocessing.pool
 import os
 import re
 import time
 import logging
 import json
 
+import activity
+import budget
 import config
+import metrics
+import profiling
+import sharding
+import state
 import utils
 
 
@@ -19,24 +27,35 @@ class Destalinator(object):
 
     closure_text_fname = "closure.txt"
     warning_text_fname = "warning.txt"
-
-    def __init__(self, slacker, slackbot, activated, logger=None):
+    # how many members to list per message when announcing who was in a channel being archived
+    roster_chunk_size = 100
+    # an interrupted warning or archiving run is resumed if restarted within this many seconds
+    checkpoint_max_age = 6 * 3600
+    # how often (in seconds) a run's progress is saved
+    checkpoint_interval = 30
+    # how many channels' history warning fetches at once, unless `history_prefetch` is configured
+    history_prefetch = 8
+
+    def __init__(self, slacker, slackbot, activated, logger=None, state_store=None, configuration=None):
         """
         slacker is a Slacker() object
         slackbot should be an initialized slackbot.Slackbot() object
         activated is a boolean indicating whether destalinator should do dry runs or real runs
+        state_store is a state.State() object for data kept between runs (by default, built from config)
+        configuration is a config.Config() (by default, the one in configuration.yaml)
         """
         self.closure_text = utils.get_local_file_content(self.closure_text_fname)
         self.warning_text = utils.get_local_file_content(self.warning_text_fname)
         self.slacker = slacker
         self.slackbot = slackbot
         self.user = os.getenv("USER")
-        self.config = config.Config()
+        self.config = configuration or config.Config()
         self.output_debug_to_slack_flag = False
         if os.getenv(self.config.output_debug_env_varname):
             self.output_debug_to_slack_flag = True
 
         self.logger = logger or logging.getLogger(__name__)
+        self.state = state_store or state.from_config(self.config, logger=self.logger)
 
         self.destalinator_activated = activated
         self.logger.debug("destalinator_activated is %s", self.destalinator_activated)
@@ -45,6 +64,11 @@ class Destalinator(object):
 
         self.cache = {}
         self.now = int(time.time())
+        self.compiled_activity_rule = None
+        self.stopped_early = False
+        self.last_checkpoint = 0
+        # (index, count) when this run only covers one shard of the channels (see sharding.py)
+        self.shard = None
 
     # utility & data fetch methods
 
@@ -61,11 +85,100 @@ class Destalinator(object):
 
     def channel_minimum_age(self, channel_name, days):
         """Return True if channel represented by `channel_name` is at least `days` old, otherwise False."""
-        info = self.slacker.get_channel_info(channel_name)
-        age = info['age']
+        cid = self.slacker.get_channelid(channel_name)
+        created = self.state.section('created').get(cid)
+        if created is None:
+            info = self.slacker.get_channel_info(channel_name)
+            age = info['age']
+            if 'created' in info:
+                with self.state.lock:
+                    self.state.section('created')[cid] = info['created']
+        else:
+            age = self.now - created
         age = age / 86400
         return age > days
 
+    def channel_names(self):
+        """Return the sorted names of the channels this run covers: all of them, or just those in `self.shard`."""
+        names = sorted(self.slacker.channels_by_name.keys())
+        if self.shard:
+            names = [x for x in names if sharding.in_shard(self.slacker.get_channelid(x), self.shard)]
+        return names
+
+    def prioritized_channel_names(self):
+        """
+        Return `channel_names()` with the channels most likely to be stale first, going by the activity index:
+        channels it knows nothing about, then those with no activity in the window it covers, then the rest
+        by how long ago they were last active.  With nothing indexed, that's alphabetical order.
+        """
+        activity_index = self.get_activity_index()
+
+        def priority(channel_name):
+            entry = activity_index.get(self.slacker.get_channelid(channel_name))
+            if entry is None:
+                return (0, 0)
+            if entry['last'] is None:
+                return (1, 0)
+            return (2, entry['last'])
+        return sorted(self.channel_names(), key=priority)
+
+    def channels_within_budget(self, run_budget):
+        """
+        Yield the channels to evaluate: in `channel_names()` order without a budget, otherwise
+        in `prioritized_channel_names()` order until `run_budget` (a budget.Budget) runs out.
+        """
+        if run_budget is None:
+            for channel in self.channel_names():
+                yield channel
+            return
+        channels = self.prioritized_channel_names()
+        for i, channel in enumerate(channels):
+            if run_budget.exhausted():
+                metrics.registry.incr('channels_skipped', len(channels) - i, reason='budget')
+                self.logger.warning("Budget used up after %s; skipping %s of %s channels", run_budget, len(channels) - i, len(channels))
+                self.stopped_early = True
+                return
+            yield channel
+
+    def start_checkpoint(self, job):
+        """
+        Return the progress record of the `job` ('warn' or 'archive') run to carry on with:
+        {'started': ts, 'done': {channel name: decision}, 'warned': [channel names]}.
+        That's the record of an unfinished run started less than `checkpoint_max_age` ago, if any, or a new one.
+        """
+        with self.state.lock:
+            checkpoints = self.state.section('checkpoints')
+            checkpoint = checkpoints.get(job)
+            if checkpoint and self.now - checkpoint['started'] <= self.checkpoint_max_age:
+                self.logger.info("Resuming the %s run started at %s, which had done %s channels",
+                                 job, time.strftime("%H:%M:%S", time.localtime(checkpoint['started'])), len(checkpoint['done']))
+            else:
+                checkpoint = checkpoints[job] = {'started': self.now, 'done': {}, 'warned': []}
+        self.stopped_early = False
+        self.last_checkpoint = time.time()
+        return checkpoint
+
+    def checkpoint(self, checkpoint, channel_name, decision, acted=False):
+        """
+        Record that `channel_name` is done, with `decision`. Progress is saved right away if `acted`
+        (something was posted or archived), so a restart never does it again, and otherwise every
+        `checkpoint_interval` seconds.
+        """
+        with self.state.lock:
+            checkpoint['done'][channel_name] = decision
+            if decision == 'warned':
+                checkpoint['warned'].append(channel_name)
+        if acted or time.time() - self.last_checkpoint >= self.checkpoint_interval:
+            self.state.save()
+            self.last_checkpoint = time.time()
+
+    def finish_checkpoint(self, job):
+        """Drop the progress record of the `job` run, unless it stopped before covering every channel."""
+        if not self.stopped_early:
+            with self.state.lock:
+                self.state.section('checkpoints').pop(job, None)
+        self.state.save()
+
     def debug(self, message):
         self.logger.debug(message)
         message = "DEBUG: " + message
@@ -79,6 +192,14 @@ class Destalinator(object):
             self.debug("Purging cache for {}".format(channel_name))
             del self.cache[cid]
 
+    def forget_channel(self, channel_name):
+        """Drop everything the state store remembers about `channel_name` (once it's archived), and save."""
+        cid = self.slacker.get_channelid(channel_name)
+        with self.state.lock:
+            for section in ('activity', 'created', 'warnings'):
+                self.state.section(section).pop(cid, None)
+        self.state.save()
+
     def get_earliest_archive_date(self):
         """Return a datetime.date object representing the earliest archive date."""
         date_string = os.getenv(self.config.get('earliest_archive_date_env_varname') or '') \
@@ -92,13 +213,15 @@ class Destalinator(object):
         cid = self.slacker.get_channelid(channel_name)
 
         if oldest in self.cache.get(cid, {}):
+            metrics.registry.incr('cache_hits', cache='messages')
             self.debug("Returning {} cached messages for #{} over {} days".format(len(self.cache[cid][oldest]), channel_name, days))
             return self.cache[cid][oldest]
 
+        metrics.registry.incr('cache_misses', cache='messages')
         messages = self.slacker.get_messages_in_time_range(oldest, cid)
         self.debug("Fetched {} messages for #{} over {} days".format(len(messages), channel_name, days))
 
-        messages = [x for x in messages if x.get("subtype") is None or x.get("subtype") in self.config.included_subtypes]
+        messages = [x for x in messages if self.activity_rule().subtype_included(x)]
         self.debug("Filtered down to {} messages based on included_subtypes: {}".format(len(messages), ", ".join(self.config.included_subtypes)))
 
         if cid not in self.cache:
@@ -107,12 +230,54 @@ class Destalinator(object):
 
         return messages
 
+    def get_prior_warning(self, channel_name, days):
+        """
+        Return the timestamp of the last warning posted to `channel_name` within `days`, or None.
+        Uses the warning index, reconciling it against channel history the first time a channel is seen.
+        Only activated runs record what they reconcile, so a dry run or plan never leaves an entry
+        that hides a warning a live run posts meanwhile.
+        """
+        cid = self.slacker.get_channelid(channel_name)
+        warnings = self.state.section('warnings')
+        if cid not in warnings:
+            metrics.registry.incr('cache_misses', cache='warning_index')
+            warned = self.find_warning_in_history(channel_name, days)
+            if self.destalinator_activated:
+                with self.state.lock:
+                    warnings[cid] = warned
+        else:
+            metrics.registry.incr('cache_hits', cache='warning_index')
+            warned = warnings[cid]
+        if warned is not None and warned >= self.now - days * 86400:
+            return warned
+        return None
+
+    def find_warning_in_history(self, channel_name, days):
+        """Scan `days` of history in `channel_name` and return the timestamp of the latest warning, or None."""
+        warning_text = self.add_slack_channel_markup(self.warning_text)
+        warned = None
+        for message in self.get_messages(channel_name, days):
+            if ((message.get("text") or "").strip() == warning_text or
+                    any(a.get('fallback') == 'channel_warning' for a in message.get('attachments', []))):
+                ts = float(message.get("ts") or self.now)
+                warned = max(warned, ts) if warned is not None else ts
+        self.debug("Reconciled warning index for #{} from history: {}".format(channel_name, warned))
+        return warned
+
+    def record_warning(self, channel_name):
+        """Record in the warning index that `channel_name` was warned now, saving it at once."""
+        cid = self.slacker.get_channelid(channel_name)
+        with self.state.lock:
+            self.state.section('warnings')[cid] = self.now
+        self.state.save()
+
     def get_stale_channels(self, days):
         """Return a list of channel names that have been stale for `days`."""
         ret = []
-        for channel in sorted(self.slacker.channels_by_name.keys()):
+        for channel in self.channel_names():
             if self.stale(channel, days):
                 ret.append(channel)
+        self.state.save()
         self.debug("{} channels quiet for {} days: {}".format(len(ret), days, ret))
         return ret
 
@@ -133,6 +298,8 @@ class Destalinator(object):
     def post_marked_up_message(self, channel_name, message, **kwargs):
         self.slacker.post_message(channel_name, self.add_slack_channel_markup(message), **kwargs)
 
+    @metrics.timed('stale_seconds', per_channel=True)
+    @profiling.in_phase('evaluation')
     def stale(self, channel_name, days):
         """
         Return True if channel represented by `channel_name` is stale.
@@ -142,23 +309,122 @@ class Destalinator(object):
             self.debug("Channel #{} is not yet of minimum_age; skipping stale messages check".format(channel_name))
             return False
 
-        messages = self.get_messages(channel_name, days)
-
-        # return True (stale) if none of the messages match the criteria below
-        return not any(
-            # the message is not from an ignored user
-            x.get("user") not in self.config.ignore_users
-            and (
-                # the message must have text that doesn't include ignored words
-                (x.get("text") and b":dolphin:" not in x.get("text").encode('utf-8', 'ignore'))
-                # or the message must have attachments
-                or x.get("attachments")
-            )
-            for x in messages
-        )
+        last_activity = self.get_last_activity(channel_name, days)
+        return last_activity is None or last_activity < self.now - days * 86400
+
+    def activity_rule(self):
+        """Return the activity.ActivityRule for this run's settings, compiled the first time it's needed."""
+        if self.compiled_activity_rule is None:
+            self.compiled_activity_rule = activity.from_config(self.config)
+        return self.compiled_activity_rule
+
+    def is_activity(self, message):
+        """Return True if `message` counts as activity when deciding whether a channel is stale."""
+        return self.activity_rule()(message)
+
+    def latest_activity(self, messages, oldest):
+        """
+        Return the timestamp of the latest message in `messages` that counts as activity, or None.
+        `messages` were fetched for a window starting at `oldest`, so no timestamp is taken to be older than that.
+        """
+        is_activity = self.activity_rule()
+        latest = None
+        for message in messages:
+            if is_activity(message):
+                ts = max(float(message.get("ts") or self.now), oldest)
+                if latest is None or ts > latest:
+                    latest = ts
+        return latest
+
+    def prefetched(self, channels, days):
+        """
+        Yield `channels` in order, having first brought the activity index up to date for the next
+        `history_prefetch` of them at once, so their history requests overlap as far as the adaptive
+        concurrency limit for the history method lets them. 1 fetches each channel's history in turn.
+        """
+        window = self.config.get('history_prefetch', self.history_prefetch)
+        labels = metrics.registry.context_labels()
+
+        def sync(channel_name):
+            with metrics.registry.labelled(**labels):
+                if not self.ignore_channel(channel_name) and self.channel_minimum_age(channel_name, days):
+                    self.get_last_activity(channel_name, days)
+
+        channels = iter(channels)
+        pool = multiprocessing.pool.ThreadPool(window) if window > 1 else None
+        try:
+            while True:
+                batch = list(itertools.islice(channels, window))
+                if not batch:
+                    return
+                if pool:
+                    pool.map(sync, batch)
+                for channel in batch:
+                    yield channel
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+
+    def get_activity_index(self):
+        """
+        Return the activity index: {channel_id: {'last': ts, 'floor': ts, 'synced': ts}}.
+        'last' is the latest qualifying message seen between 'floor' and 'synced' (or None if there was none).
+        The index is reset if the settings deciding what counts as activity have changed.
+        """
+        included_subtypes, ignore_users, ignore_markers = activity.settings(self.config)
+        rules = sorted(ignore_users) + ['|'] + sorted(included_subtypes) + ['|'] + sorted(ignore_markers)
+        with self.state.lock:
+            meta = self.state.section('activity_rules')
+            if meta.get('rules') != rules:
+                meta['rules'] = rules
+                self.state.data['activity'] = {}
+            return self.state.section('activity')
+
+    def get_last_activity(self, channel_name, days):
+        """
+        Return the timestamp of the last qualifying message in `channel_name`, as far back as `days`.
+        Returns None if there is no such message in that window.
+        Answers from the activity index, fetching only the history it hasn't seen yet.
+        """
+        oldest = self.now - days * 86400
+        cid = self.slacker.get_channelid(channel_name)
+        activity = self.get_activity_index()
+        # updated on a copy, which replaces the entry under the store's lock
+        entry = activity.get(cid)
+        entry = dict(entry) if entry is not None else None
+
+        if entry is None or entry['synced'] < self.now or (entry['last'] is None and entry['floor'] > oldest):
+            metrics.registry.incr('cache_misses', cache='activity_index')
+        else:
+            metrics.registry.incr('cache_hits', cache='activity_index')
+
+        if entry is None:
+            entry = {'last': self.latest_activity(self.get_messages(channel_name, days), oldest),
+                     'floor': oldest,
+                     'synced': self.now}
+        else:
+            if entry['synced'] < self.now:
+                messages = self.slacker.get_messages_in_time_range(entry['synced'], cid, self.now, keep=self.activity_rule())
+                newest = self.latest_activity(messages, entry['synced'])
+                self.debug("Synced activity index for #{} with {} new messages".format(channel_name, len(messages)))
+                if newest is not None and (entry['last'] is None or newest > entry['last']):
+                    entry['last'] = newest
+                entry['synced'] = self.now
+            if entry['last'] is None and entry['floor'] > oldest:
+                messages = self.slacker.get_messages_in_time_range(oldest, cid, entry['floor'], keep=self.activity_rule())
+                entry['last'] = self.latest_activity(messages, oldest)
+                entry['floor'] = oldest
+        with self.state.lock:
+            activity[cid] = entry
+
+        if entry['last'] is not None and entry['last'] >= oldest:
+            return entry['last']
+        return None
 
     # channel actions
 
+    @metrics.timed('archive_seconds', per_channel=True)
     def archive(self, channel_name):
         """Archive the given channel name, returning the Slack API response as a JSON string."""
         if self.ignore_channel(channel_name):
@@ -169,14 +435,19 @@ class Destalinator(object):
             self.debug("Announcing channel closure in #{}".format(channel_name))
             self.post_marked_up_message(channel_name, self.closure_text, message_type='channel_archive')
 
+            # the roster goes out in chunks as the members are fetched, in the order Slack lists them,
+            # so huge channels are never listed in full in memory or in one message
             members = self.slacker.get_channel_member_names(channel_name)
-            say = "Members at archiving are {}".format(", ".join(sorted(members)))
-            self.debug("Telling channel #{}: {}".format(channel_name, say))
-            self.post_marked_up_message(channel_name, say, message_type='channel_archive_members')
+            for i, chunk in enumerate(utils.chunks(members, self.roster_chunk_size)):
+                say = "{} {}".format("Members at archiving are" if i == 0 else "More members at archiving:",
+                                     ", ".join(chunk))
+                self.debug("Telling channel #{}: {}".format(channel_name, say))
+                self.post_marked_up_message(channel_name, say, message_type='channel_archive_members')
 
             self.action("Archiving channel #{}".format(channel_name))
             payload = self.slacker.archive(channel_name)
             if payload['ok']:
+                self.forget_channel(channel_name)
                 self.debug("Slack API response to archive: {}".format(json.dumps(payload, indent=4)))
                 self.logger.info("Archived %s", channel_name)
             else:
@@ -205,12 +476,20 @@ class Destalinator(object):
     def safe_archive_all(self, days):
         """Safe archive all channels stale longer than `days`."""
         self.action("Safe-archiving all channels stale for more than {} days".format(days))
-        for channel in sorted(self.slacker.channels_by_name.keys()):
+        checkpoint = self.start_checkpoint('archive')
+        for channel in self.channels_within_budget(budget.from_config(self.config)):
+            if channel in checkpoint['done']:
+                continue
             if self.stale(channel, days):
                 self.debug("Attempting to safe-archive #{}".format(channel))
                 self.safe_archive(channel)
+                self.checkpoint(checkpoint, channel, 'stale', acted=self.destalinator_activated)
+            else:
+                self.checkpoint(checkpoint, channel, 'active')
             self.flush_channel_cache(channel)
+        self.finish_checkpoint('archive')
 
+    @metrics.timed('warn_seconds', per_channel=True)
     def warn(self, channel_name, days, force_warn=False):
         """
         Send warning text to channel_name, if it has not been sent already in the last `days`.
@@ -225,42 +504,55 @@ class Destalinator(object):
             self.debug("Not warning #{} because it's in ignore_channels".format(channel_name))
             return False
 
-        messages = self.get_messages(channel_name, days)
-        texts = [x.get("text").strip() for x in messages if x.get("text")]
-        if (not force_warn and
-                (self.add_slack_channel_markup(self.warning_text) in texts or
-                 any(any(a.get('fallback') == 'channel_warning' for a in m.get('attachments', [])) for m in messages))):
+        if not force_warn and self.get_prior_warning(channel_name, days) is not None:
             self.debug("Not warning #{} because we found a prior warning".format(channel_name))
             return False
 
         if self.destalinator_activated:
             self.post_marked_up_message(channel_name, self.warning_text, message_type='channel_warning')
+            self.record_warning(channel_name)
             self.action("Warned #{}".format(channel_name))
 
         return True
 
-    def warn_all(self, days, force_warn=False):
-        """Warn all channels which are `days` idle; if `force_warn`, will warn even if we already have."""
+    def warn_all(self, days, force_warn=False, notify=True):
+        """
+        Warn all channels which are `days` idle; if `force_warn`, will warn even if we already have.
+        Unless `notify` is False, also tell the general channel which channels were warned.
+        Returns the names of the warned channels.
+        """
         if not self.destalinator_activated:
             self.logger.info("Note, destalinator is not activated and is in a dry-run mode. For help, see the "
                              "documentation on the DESTALINATOR_ACTIVATED environment variable.")
         self.action("Warning all channels stale for more than {} days".format(days))
 
-        stale = []
-        for channel in sorted(self.slacker.channels_by_name.keys()):
+        checkpoint = self.start_checkpoint('warn')
+        # channels warned before the run was interrupted still belong in the general notice
+        stale = list(checkpoint['warned'])
+        channels = (x for x in self.channels_within_budget(budget.from_config(self.config)) if x not in checkpoint['done'])
+        for channel in self.prefetched(channels, days):
             if self.ignore_channel(channel):
                 self.debug("Not warning #{} because it's in ignore_channels".format(channel))
                 continue
             if self.stale(channel, days):
                 if self.warn(channel, days, force_warn):
                     stale.append(channel)
+                    self.checkpoint(checkpoint, channel, 'warned', acted=self.destalinator_activated)
+                else:
+                    self.checkpoint(checkpoint, channel, 'not warned')
+            else:
+                self.checkpoint(checkpoint, channel, 'active')
             self.flush_channel_cache(channel)
+        self.finish_checkpoint('warn')
 
-        if stale and self.config.general_message_channel:
+        if notify and stale and self.config.general_message_channel:
             self.debug("Notifying #{} of warned channels".format(self.config.general_message_channel))
             self.warn_in_general(stale)
+        return stale
 
     def warn_in_general(self, stale_channels):
+        # private channels are warned in the channel itself but not named in public
+        stale_channels = [x for x in stale_channels if not self.slacker.is_private(x)]
         if not stale_channels:
             return
         if len(stale_channels) > 1:
@@ -278,3 +570,77 @@ class Destalinator(object):
         if self.destalinator_activated:
             self.post_marked_up_message(self.config.general_message_channel, message, message_type='warn_in_general')
         self.debug("Notified #{} with: {}".format(self.config.general_message_channel, message))
+
+    # planning
+
+    def plan_channel(self, channel_name, warn_days, archive_days, force_warn=False):
+        """
+        Decide what warning and archiving would do to `channel_name`, without doing anything.
+        Returns {'channel', 'id', 'action': 'warn'|'archive'|'skip', 'reason', 'last_activity'}.
+        A channel stale for `archive_days` is planned for archiving rather than warning first.
+        """
+        entry = {'channel': channel_name, 'id': self.slacker.get_channelid(channel_name),
+                 'action': 'skip', 'reason': None, 'last_activity': None}
+        if self.ignore_channel(channel_name):
+            entry['reason'] = "in ignore_channels"
+            return entry
+        if not self.channel_minimum_age(channel_name, warn_days):
+            entry['reason'] = "younger than {} days".format(warn_days)
+            return entry
+
+        last = self.get_last_activity(channel_name, max(warn_days, archive_days))
+        entry['last_activity'] = last
+        if last is not None and last >= self.now - warn_days * 86400:
+            entry['reason'] = "active in the last {} days".format(warn_days)
+        elif self.slacker.channel_has_only_restricted_members(channel_name):
+            entry['reason'] = "only restricted members"
+        elif (last is None or last < self.now - archive_days * 86400) and \
+                self.channel_minimum_age(channel_name, archive_days) and date.today() >= self.earliest_archive_date:
+            entry['action'] = 'archive'
+            entry['reason'] = "no activity in {} days".format(archive_days)
+        elif not force_warn and self.get_prior_warning(channel_name, warn_days) is not None:
+            entry['reason'] = "already warned in the last {} days".format(warn_days)
+        else:
+            entry['action'] = 'warn'
+            entry['reason'] = "no activity in {} days".format(warn_days)
+        return entry
+
+    def plan_all(self, warn_days, archive_days, force_warn=False):
+        """
+        Evaluate every channel once and return the plan of what to do to each, for `apply_plan()`:
+        {'created': ts, 'warn_threshold': days, 'archive_threshold': days, 'actions': [plan_channel() entries]}
+        """
+        actions = []
+        for channel in self.channel_names():
+            actions.append(self.plan_channel(channel, warn_days, archive_days, force_warn))
+            self.flush_channel_cache(channel)
+        self.state.save()
+        planned = [x for x in actions if x['action'] != 'skip']
+        self.debug("Planned {} actions for {} channels".format(len(planned), len(actions)))
+        return {'created': self.now, 'warn_threshold': warn_days, 'archive_threshold': archive_days, 'actions': actions}
+
+    def apply_plan(self, plan):
+        """Carry out the warnings and archivals in a plan from `plan_all()`; return the names of the warned channels."""
+        warned = []
+        for entry in plan['actions']:
+            if entry['action'] == 'skip':
+                continue
+            channel_name = entry['channel']
+            if self.slacker.get_channelid(channel_name) != entry['id']:
+                self.logger.warning("Not carrying out planned %s of #%s, which no longer exists", entry['action'], channel_name)
+                continue
+            if entry['action'] == 'archive':
+                self.archive(channel_name)
+                continue
+            if self.destalinator_activated:
+                self.post_marked_up_message(channel_name, self.warning_text, message_type='channel_warning')
+                self.record_warning(channel_name)
+                self.action("Warned #{}".format(channel_name))
+            else:
+                self.debug("Would have warned #{}".format(channel_name))
+            warned.append(channel_name)
+        self.state.save()
+
+        if warned and self.config.general_message_channel:
+            self.warn_in_general(warned)
+        return warned
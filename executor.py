@@ -1,27 +1,40 @@
 #! /usr/bin/env python
 
+import json
 import logging
 import os
 
 import config
 import destalinator
+import metrics
 import slackbot
 import slacker
+import state
 import utils
+import warm
 
 
 class Executor(object):
 
-    def __init__(self, debug=False, verbose=False, slackbot_injected=None, slacker_injected=None):
+    def __init__(self, debug=False, verbose=False, slackbot_injected=None, slacker_injected=None, state_injected=None,
+                 config_injected=None, session=None, warm_injected=None):
+        """
+        config_injected is a config.Config() for one of several workspaces (see workspaces.py),
+        whose `slack_name` is used rather than SLACK_NAME; session is a requests.Session to share;
+        warm_injected is a warm.Cache kept between runs (by default, nothing is kept)
+        """
         self.debug = debug
         self.verbose = verbose
-        self.config = config.Config()
+        self.config = config_injected or config.Config()
+        slack_name = config_injected.get('slack_name') if config_injected else config.slack_name()
         slackbot_token = os.getenv(self.config.slackbot_api_token_env_varname)
         api_token = os.getenv(self.config.api_token_env_varname)
 
-        self.slackbot = slackbot_injected or slackbot.Slackbot(config.SLACK_NAME, token=slackbot_token)
+        self.slackbot = slackbot_injected or slackbot.Slackbot(slack_name, token=slackbot_token,
+                                                               url=self.config.get('slackbot_url'), session=session)
 
-        self.logger = logging.getLogger(__name__)
+        # each workspace of a multi-workspace run logs to its own log channel
+        self.logger = logging.getLogger("{}.{}".format(__name__, slack_name) if config_injected else __name__)
         utils.set_up_logger(self.logger,
                             log_level_env_var='DESTALINATOR_LOG_LEVEL',
                             log_to_slack_env_var='DESTALINATOR_LOG_TO_CHANNEL',
@@ -33,9 +46,41 @@ class Executor(object):
             self.destalinator_activated = True
         self.logger.debug("destalinator_activated is %s", self.destalinator_activated)
 
-        self.slacker = slacker_injected or slacker.Slacker(config.SLACK_NAME, token=api_token, logger=self.logger)
+        self.slacker = slacker_injected or slacker.Slacker(slack_name, token=api_token, logger=self.logger,
+                                                           api_url=self.config.get('api_url'),
+                                                           configuration=self.config, session=session)
+        self.state = state_injected or state.from_config(self.config, logger=self.logger)
+        self.warm = warm_injected or warm.Cache()
 
         self.ds = destalinator.Destalinator(slacker=self.slacker,
                                             slackbot=self.slackbot,
                                             activated=self.destalinator_activated,
-                                            logger=self.logger)
+                                            logger=self.logger,
+                                            state_store=self.state,
+                                            configuration=self.config)
+
+    def emit_report(self):
+        """
+        Log a summary of the run's metrics and the full report (as one line of JSON) at INFO, and write
+        the report to the configured files. This goes to the executor's logger even where a job, like
+        the flagger, logs to a quieter one of its own.
+        """
+        logger = self.ds.logger
+        report = metrics.registry.report()
+        api_calls = sum(x['value'] for x in report['counters'].get('api_calls', []))
+        throttled = sum(x['value'] for x in report['counters'].get('api_throttled', []))
+        logger.info("Run took %ss and made %s API calls (%s throttled)", report['duration'], api_calls, throttled)
+        limits = dict((x['labels']['method'], x['value']) for x in report['gauges'].get('api_concurrency_limit', []))
+        if limits:
+            logger.info("API concurrency limits at the end of the run: %s",
+                        ", ".join("{} {}".format(method, limit) for method, limit in sorted(limits.items())))
+        logger.info("Run report: %s", json.dumps(report, sort_keys=True))
+
+        metrics_file = os.getenv(self.config.get('metrics_file_env_varname') or '')
+        if metrics_file:
+            with open(metrics_file, "w") as fo:
+                fo.write(metrics.registry.to_json())
+        prometheus_file = os.getenv(self.config.get('prometheus_file_env_varname') or '')
+        if prometheus_file:
+            with open(prometheus_file, "w") as fo:
+                fo.write(metrics.registry.to_prometheus())
@@ -1,7 +1,6 @@
 #! /usr/bin/env python
 
 import argparse
-import copy
 import json
 import logging
 import operator
@@ -9,16 +8,20 @@ import re
 import time
 import traceback
 
-# support Python 2 and 3's versions of this module
+# support Python 2 and 3's versions of this function
 try:
-    import html.parser as HTMLParser
+    from html import unescape
 except ImportError:
     import HTMLParser
+    unescape = HTMLParser.HTMLParser().unescape
 
-import config as _config
+import config
+import dedup
 import executor
-
-config = _config.Config()
+import ingester
+import metrics
+import profiling
+import sharding
 
 
 class Flagger(executor.Executor):
@@ -27,13 +30,17 @@ class Flagger(executor.Executor):
                  '>=': operator.ge, '<=': operator.le}
 
     def __init__(self, *args, **kwargs):
-        self.htmlparser = HTMLParser.HTMLParser()
         super(Flagger, self).__init__(*args, **kwargs)
         self.logger = logging.getLogger(__name__)
         self.logger.setLevel((self.debug or self.verbose) and logging.DEBUG or logging.ERROR)
         logging.basicConfig()
 
         self.now = int(time.time())
+        self.control_channel_id = None
+        self.control = {}
+        self.emoji = []
+        self.emoji_equivalents = {}
+        self.announced = dedup.AnnouncementLog(self.state)
 
     def extract_threshold(self, token):
         """
@@ -51,7 +58,7 @@ class Flagger(executor.Executor):
         if comparator == '':  # no comparator specified
             comparator = '>='
 
-        comparator = self.htmlparser.unescape(comparator)
+        comparator = unescape(comparator)
         self.logger.debug("token: {} comparator: {} value: {}".format(token, comparator, value))
 
         assert comparator in self.operators
@@ -61,12 +68,22 @@ class Flagger(executor.Executor):
         """
         sets up known control configuration based on control channel messages
         """
-        channel = config.control_channel
+        channel = self.config.control_channel
         if not self.slacker.channel_exists(channel):
             self.ds.logger.warning("Flagger control channel does not exist, cannot run. Please create #%s.", channel)
             return False
         cid = self.slacker.get_channelid(channel)
-        messages = self.slacker.get_messages_in_time_range(0, cid, self.now)
+        self.control_channel_id = cid
+        messages = self.warm.history(self.slacker, cid, self.now)
+        self.emoji_equivalents = self.warm.get('emoji', self.load_emoji_aliases)
+        # the rules only change when a rule is posted, so they're parsed again only then
+        version = (cid, len(messages), messages[-1]['ts'] if messages else None)
+        self.control = self.warm.get('flag_rules', lambda: self.parse_rules(messages), version)
+        self.emoji = [x['emoji'] for x in self.control.values()]
+        return True
+
+    def parse_rules(self, messages):
+        """Return the flag rules set by the control channel's `messages`, by UUID."""
         control = {}
         for message in messages:
             text = message['text']
@@ -92,7 +109,7 @@ class Flagger(executor.Executor):
                     cid, cname = output_channel_id.split("|")
                     output_channel_id = cid
                 output_channel_name = self.slacker.replace_id(output_channel_id)
-                control[uuid] = {'threshold': threshold, "comparator": comparator,
+                control[uuid] = {'uuid': uuid, 'threshold': threshold, "comparator": comparator,
                                  'emoji': emoji, 'output': output_channel_name}
             except Exception as e:
                 tb = traceback.format_exc()
@@ -101,13 +118,10 @@ class Flagger(executor.Executor):
                 self.logger.debug(tb)
                 if not self.debug:
                     self.ds.logger.warning(m)
-        self.control = control
-        self.logger.debug("control: {}".format(json.dumps(self.control, indent=4)))
-        self.emoji = [x['emoji'] for x in self.control.values()]
-        self.initialize_emoji_aliases()
-        return True
+        self.logger.debug("control: {}".format(json.dumps(control, indent=4)))
+        return control
 
-    def initialize_emoji_aliases(self):
+    def load_emoji_aliases(self):
         """
         In some cases, emojiA might be an alias of emojiB
         The problem is that if we say that 2xemojiB should be
@@ -115,7 +129,7 @@ class Flagger(executor.Executor):
         2 x emojiB
         1 x emojiA, 1 x emojiB
         2 x emojiA
-        This method grabs the emoji list from the Slack and creates the equivalence
+        This method grabs the emoji list from the Slack and returns the equivalence
         structure
         """
         self.logger.debug("Starting emoji alias list")
@@ -135,60 +149,47 @@ class Flagger(executor.Executor):
                 equivalents[target_value] = []
             equivalents[emoji].append(target_value)
             equivalents[target_value].append(emoji)
-        self.emoji_equivalents = equivalents
-        self.logger.debug("equivalents: {}".format(json.dumps(self.emoji_equivalents, indent=4)))
-        if "floppy_disk" in self.emoji_equivalents.keys():
-            self.logger.debug("floppy_disk: {}".format(self.emoji_equivalents['floppy_disk']))
+        self.logger.debug("equivalents: {}".format(json.dumps(equivalents, indent=4)))
+        if "floppy_disk" in equivalents.keys():
+            self.logger.debug("floppy_disk: {}".format(equivalents['floppy_disk']))
+        return equivalents
+
+    def counts_emoji(self, emoji):
+        """Return True if reactions with `emoji` count towards some rule (it or an equivalent is a rule's emoji)."""
+        return bool(set(self.emoji_equivalents.get(emoji, []) + [emoji]).intersection(self.emoji))
+
+    def reaction_counts(self, reactions):
+        """
+        Return {emoji: count} for the rules to compare with their thresholds, given a message's
+        `reactions` ([{'name': emoji, 'count': n}, ...]): each reaction counts for its emoji and their equivalents.
+        """
+        counts = {}
+        for reaction in reactions:
+            if not self.counts_emoji(reaction['name']):
+                continue
+            for emoji in self.emoji_equivalents.get(reaction['name'], []) + [reaction['name']]:
+                counts[emoji] = counts.get(emoji, 0) + reaction['count']
+        return counts
 
+    def matching_rules(self, reactions):
+        """Return the rules a message with `reactions` satisfies."""
+        counts = self.reaction_counts(reactions)
+        return [rule for rule in self.control.values() if self.rule_matches(rule, counts.get(rule['emoji'], 0))]
+
+    def rule_matches(self, rule, count):
+        """Return True if `count` reactions satisfy `rule`; a message without reactions never does."""
+        return count > 0 and self.operators[rule['comparator']](count, rule['threshold'])
+
+    @metrics.timed('message_destination_seconds')
+    @profiling.in_phase('evaluation')
     def message_destination(self, message):
         """
         if interesting, returns channel name[s] in which to announce
         otherwise, returns []
         """
-        channels = []
         if message.get("reactions") is None:
             return False
-        reactions = message.get("reactions")
-        emoji_set = set(self.emoji)
-        current_reactions = {}
-        t = message.get("text")
-        if t.find("SVP") != -1:
-            def d(p):
-                pass
-        else:
-            def d(p):
-                pass
-        d("reactions: {}".format(reactions))
-        d("emoji_equivalents:\n{}".format(json.dumps(self.emoji_equivalents, indent=4)))
-        if "floppy_disk" in self.emoji_equivalents.keys():
-            d("floppy_disk: {}".format(self.emoji_equivalents['floppy_disk']))
-        for reaction in reactions:
-            count = reaction['count']
-            current_emoji = reaction['name']
-            d("current_emoji: {}".format(current_emoji))
-            equivalents = copy.copy(self.emoji_equivalents.get(current_emoji, []))
-            d("equivalents = {}".format(equivalents))
-            equivalents.append(current_emoji)
-            d("equivalents = {}".format(equivalents))
-            current_set = set(equivalents)
-            i = current_set.intersection(emoji_set)
-            if not i:
-                continue
-            for ce in equivalents:
-                current_reactions[ce] = current_reactions.get(ce, 0) + count
-            # if we're here, at least one emoji matches (but count may still not be right)
-        d("Current reactions: {}".format(current_reactions))
-        for uuid in self.control:
-            rule = self.control[uuid]
-            for ce in current_reactions:
-                if ce == rule['emoji']:
-                    count = current_reactions[ce]
-                    threshold = rule['threshold']
-                    comparator = rule['comparator']
-                    op = self.operators[comparator]
-                    if op(count, threshold):
-                        channels.append(rule)
-        return channels
+        return self.matching_rules(message["reactions"])
 
     def get_interesting_messages(self):
         """
@@ -196,8 +197,19 @@ class Flagger(executor.Executor):
         """
         dayago = self.now - 86400
 
+        # private channels' messages are never reposted to the (public) output channels
+        channels = [channel for channel in self.ds.channel_names() if not self.slacker.is_private(channel)]
+        if ingester.covers(self.state, dayago, self.now):
+            # only channels with reactions recorded by the event ingester can have interesting messages
+            with self.state.lock:
+                # another stage's save may rewrite the section in place, so copy its keys before iterating
+                keys = list(self.state.section('reactions'))
+            reacted = set(key.split(':', 1)[0] for key in keys)
+            channels = [channel for channel in channels if self.slacker.get_channelid(channel) in reacted]
+            self.logger.debug("Event ingester recorded reactions in {} channels".format(len(channels)))
+
         messages = []
-        for channel in self.slacker.channels_by_name:
+        for channel in channels:
             cid = self.slacker.get_channelid(channel)
             cur_messages = self.slacker.get_messages_in_time_range(dayago, cid, self.now)
             for message in cur_messages:
@@ -206,42 +218,154 @@ class Flagger(executor.Executor):
                     messages.append([message, announce])
         return messages
 
+    def announcement_key(self, cid, ts, rule):
+        """Return the key under which announcing message `ts` in channel `cid` because of `rule` is recorded."""
+        return "{}:{}:{}".format(cid, ts, rule['uuid'])
+
     def announce_interesting_messages(self):
         messages = self.get_interesting_messages()
-        slack_name = _config.SLACK_NAME
         for message, channels in messages:
-            ts = message["ts"].replace(".", "")
-            channel = message["channel"]
-            author = message["user"]
-            author_name = self.slacker.users_by_id[author]
-            text = self.slacker.asciify(message["text"])
-            text = self.slacker.detokenize(text)
-            url = "http://{}.slack.com/archives/{}/p{}".format(slack_name, channel, ts)
-            m = "*@{}* said in *#{}* _'{}'_ ({})".format(author_name, channel, text, url)
-            for output_channel in channels:
-                if self.slacker.channel_exists(output_channel["output"]):
-                    md = "Saying {} to {}".format(m, output_channel["output"])
-                    self.logger.debug(md)
-                    if not self.debug and self.destalinator_activated:
-                        self.slackbot.say(output_channel["output"], m)
-                else:
-                    self.ds.logger.warning("Attempted to announce in {} because of rule :{}:{}{}, but channel does not exist.".format(
-                        output_channel["output"],
-                        output_channel["emoji"],
-                        output_channel["comparator"],
-                        output_channel["threshold"]
-                    ))
+            cid = self.slacker.get_channelid(message["channel"])
+            channels = [rule for rule in channels if not self.announced.seen(self.announcement_key(cid, message["ts"], rule))]
+            if channels:
+                self.announce_message(message, channels, cid)
+            else:
+                self.logger.debug("Already announced {} in #{}".format(message["ts"], message["channel"]))
+
+    def announce_message(self, message, channels, cid):
+        """Announce `message` (posted in channel `cid`) in the output channel of each rule in `channels`."""
+        slack_name = self.slacker.slack_name
+        ts = message["ts"].replace(".", "")
+        channel = message["channel"]
+        author = message["user"]
+        author_name = self.slacker.get_user_name(author)
+        text = self.slacker.asciify(message["text"])
+        text = self.slacker.detokenize(text)
+        url = "http://{}.slack.com/archives/{}/p{}".format(slack_name, channel, ts)
+        m = "*@{}* said in *#{}* _'{}'_ ({})".format(author_name, channel, text, url)
+        for output_channel in channels:
+            if self.slacker.channel_exists(output_channel["output"]):
+                md = "Saying {} to {}".format(m, output_channel["output"])
+                self.logger.debug(md)
+                if not self.debug and self.destalinator_activated:
+                    self.slackbot.say(output_channel["output"], m)
+                    self.announced.add(self.announcement_key(cid, message["ts"], output_channel))
+            else:
+                self.ds.logger.warning("Attempted to announce in {} because of rule :{}:{}{}, but channel does not exist.".format(
+                    output_channel["output"],
+                    output_channel["emoji"],
+                    output_channel["comparator"],
+                    output_channel["threshold"]
+                ))
+
+    def handle_event(self, event):
+        """
+        Update the running reaction counters from a `reaction_added` or `reaction_removed` event,
+        announcing the message the moment it crosses a rule's threshold (once per message and rule).
+        The counters of a message start from its reactions when its first event arrives.
+        Messages in the control channel reload the rules.
+        """
+        if event.get('type') == 'message' and event.get('channel') == self.control_channel_id:
+            self.now = int(time.time())
+            self.initialize_control()
+            return
+        if event.get('type') not in ('reaction_added', 'reaction_removed'):
+            return
+        item = event.get('item', {})
+        if item.get('type') != 'message':
+            return
+        if item['channel'] not in self.slacker.channels_by_id or item['channel'] in self.slacker.private_channel_ids:
+            # never repost private channels' messages, nor those of channels we can't tell aren't private
+            return
+        if not self.counts_emoji(event['reaction']):
+            # only emoji some rule cares about are counted
+            return
+
+        key = "{}:{}".format(item['channel'], item['ts'])
+        with self.state.lock:
+            counters = self.state.section('reaction_counters').get(key)
+            counters = dict(counters) if counters is not None else None
+        message = None
+        if counters is None:
+            # the first event for the message: start from the reactions it has now (this one included),
+            # since those added before we were listening count too
+            message = self.slacker.get_message(item['channel'], item['ts'])
+            if message is None:
+                self.logger.debug("Couldn't fetch flagged message {}".format(key))
+                return
+            after = dict((r['name'], r['count']) for r in message.get('reactions', []) if self.counts_emoji(r['name']))
+            before = {}
+        else:
+            before = counters
+            after = dict(counters)
+            after[event['reaction']] = max(after.get(event['reaction'], 0) +
+                                           (1 if event['type'] == 'reaction_added' else -1), 0)
+        with self.state.lock:
+            self.state.section('reaction_counters')[key] = after
+
+        # counted the same way as messages fetched by flag(), so both reach the same verdict
+        already = set(rule['uuid'] for rule in self.matching_rules(self.as_reactions(before)))
+        crossed = [rule for rule in self.matching_rules(self.as_reactions(after))
+                   if rule['uuid'] not in already
+                   and not self.announced.seen(self.announcement_key(item['channel'], item['ts'], rule))]
+        if not crossed:
+            return
+
+        if message is None:
+            message = self.slacker.get_message(item['channel'], item['ts'])
+        if message is None:
+            self.logger.debug("Couldn't fetch flagged message {}".format(key))
+            return
+        self.announce_message(message, crossed, item['channel'])
+
+    @staticmethod
+    def as_reactions(counters):
+        """Return reaction counters ({emoji: count}) in the form of a message's reactions."""
+        return [{'name': emoji, 'count': count} for emoji, count in sorted(counters.items()) if count > 0]
+
+    def prune_counters(self):
+        """Forget counters for messages older than a day."""
+        dayago = time.time() - 86400
+        with self.state.lock:
+            counters = self.state.section('reaction_counters')
+            for key in [k for k in counters if float(k.split(':')[1]) < dayago]:
+                del counters[key]
+
+    def save(self):
+        self.announced.flush()
+        self.state.save()
+
+    def consume(self, events):
+        """Handle every event in the iterable `events`, e.g. replayed from a file."""
+        if not self.initialize_control():
+            return
+        for event in events:
+            self.handle_event(event)
+        self.prune_counters()
+        self.save()
 
     def flag(self):
         if self.initialize_control():
             self.announce_interesting_messages()
+            self.save()
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Flag interesting Slack messages.')
     parser.add_argument("--debug", action="store_true", default=False)
     parser.add_argument("--verbose", action="store_true", default=False)
+    parser.add_argument("--replay", help="JSONL file of reaction events to flag incrementally")
+    profiling.add_argument(parser)
+    sharding.add_argument(parser)
     args = parser.parse_args()
 
-    flagger = Flagger(debug=args.debug, verbose=args.verbose)
-    flagger.flag()
+    if sharding.requested(args.shards) and not args.replay:
+        sharding.run("flagger", args.shards)
+    else:
+        with profiling.profiled("flagger", args.profile):
+            flagger = Flagger(debug=args.debug, verbose=args.verbose)
+            if args.replay:
+                flagger.consume(ingester.read_events(args.replay))
+            else:
+                flagger.flag()
+        flagger.emit_report()
@@ -0,0 +1,282 @@
+#! /usr/bin/env python
+
+import argparse
+import collections
+import hashlib
+import hmac
+import json
+import os
+import threading
+import time
+from wsgiref.simple_server import make_server
+
+import executor
+
+
+# How long ago the receiver may last have been known to be listening before we stop trusting ingested data
+INGESTION_MAX_LAG = 3600
+# How often (in seconds) a listening receiver records that it's still alive
+HEARTBEAT_INTERVAL = 60
+# How many recent event IDs are remembered to drop events Slack delivers again
+RECENT_EVENT_IDS = 10000
+
+
+def covers(state_store, since, now=None):
+    """
+    Return True if event ingestion has been running continuously since `since`,
+    so data recorded from events can be trusted instead of re-reading history.
+    The ingestion section holds when the receiver started listening ('started') and
+    when it was last known to be listening ('seen'), whether or not events arrived.
+    """
+    now = now or int(time.time())
+    ingestion = state_store.section('ingestion')
+    started = ingestion.get('started')
+    seen = ingestion.get('seen')
+    return started is not None and seen is not None and started <= since and seen >= now - INGESTION_MAX_LAG
+
+
+def read_events(fname):
+    """Yield events from a JSONL file, one event per line."""
+    with open(fname, "r") as fo:
+        for line in fo:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+class Ingester(executor.Executor):
+    """
+    Consumes Slack events (from the Events API, or replayed from a JSONL file)
+    and keeps the state store up to date: per-channel last activity for the
+    warner and archiver, reaction counts for the flagger and new channels for
+    the announcer.
+    """
+
+    save_interval = 10
+
+    def __init__(self, *args, **kwargs):
+        super(Ingester, self).__init__(*args, **kwargs)
+        # callables which are handed every event after it has been recorded
+        self.listeners = []
+        # a flagger.Flagger announcing from the events as they arrive (see --flag), saved along with the state
+        self.flagger = None
+        self.last_save = 0
+        # the IDs of the events received lately, oldest first
+        self.recent_event_ids = collections.OrderedDict()
+        self.handlers = {
+            'message': self.handle_message,
+            'reaction_added': self.handle_reaction,
+            'reaction_removed': self.handle_reaction,
+            'channel_created': self.handle_channel_created,
+            'channel_archive': self.handle_channel_gone,
+            'channel_deleted': self.handle_channel_gone,
+        }
+
+    def heartbeat(self, now=None):
+        """
+        Record that the receiver is listening at `now`. If it wasn't known to be listening in the
+        INGESTION_MAX_LAG before (it was down, or this is its first start), events sent meanwhile
+        may have been missed, so ingestion starts over from now.
+        """
+        now = now or time.time()
+        with self.state.lock:
+            ingestion = self.state.section('ingestion')
+            seen = ingestion.get('seen')
+            if ingestion.get('started') is None or seen is None or now - seen > INGESTION_MAX_LAG:
+                if seen is not None:
+                    self.logger.info("Not listening since %s; ingesting afresh", time.ctime(seen))
+                ingestion['started'] = now
+            ingestion['seen'] = max(seen or 0, now)
+
+    def duplicate(self, event_id):
+        """Return True if the event with `event_id` was received before (Slack retries deliveries it isn't sure of)."""
+        if not event_id:
+            return False
+        with self.state.lock:
+            if event_id in self.recent_event_ids:
+                return True
+            self.recent_event_ids[event_id] = True
+            if len(self.recent_event_ids) > RECENT_EVENT_IDS:
+                self.recent_event_ids.popitem(last=False)
+            return False
+
+    def handle(self, event, event_id=None, received=None):
+        """
+        Record a single event, given as a dict as delivered by Slack, with the `event_id` of its
+        delivery if known (events already received under that ID are dropped), `received` at that
+        time (default: now).
+        """
+        if self.duplicate(event_id):
+            self.logger.debug("Dropping event %s, which was delivered before", event_id)
+            return
+        with self.state.lock:
+            self.heartbeat(received)
+            handler = self.handlers.get(event.get('type'))
+            if handler:
+                handler(event)
+        for listener in self.listeners:
+            listener(event)
+
+        if time.time() - self.last_save >= self.save_interval:
+            self.save()
+
+    def handle_message(self, event):
+        cid = event.get('channel')
+        if not cid or not event.get('ts'):
+            return
+        if event.get('subtype') == 'channel_purpose' and cid in self.state.section('new_channels'):
+            self.state.section('new_channels')[cid]['purpose'] = {'value': event.get('purpose', '')}
+        if not self.ds.is_activity(event):
+            return
+        ts = float(event['ts'])
+        activity = self.ds.get_activity_index()
+        entry = activity.get(cid)
+        if entry is None:
+            activity[cid] = {'last': ts, 'floor': ts, 'synced': ts}
+            return
+        if entry['last'] is None or ts > entry['last']:
+            entry['last'] = ts
+        # only claim history as seen if we've been listening since the index last synced
+        if entry['synced'] >= self.state.section('ingestion')['started']:
+            entry['synced'] = max(entry['synced'], ts)
+
+    def handle_reaction(self, event):
+        item = event.get('item', {})
+        if item.get('type') != 'message':
+            return
+        key = "{}:{}".format(item['channel'], item['ts'])
+        emoji = event['reaction']
+        reactions = self.state.section('reactions')
+        counts = reactions.setdefault(key, {})
+        if event['type'] == 'reaction_added':
+            counts[emoji] = counts.get(emoji, 0) + 1
+        else:
+            counts[emoji] = counts.get(emoji, 0) - 1
+            if counts[emoji] <= 0:
+                del counts[emoji]
+            if not counts:
+                del reactions[key]
+
+    def handle_channel_created(self, event):
+        channel = event['channel']
+        self.state.section('new_channels')[channel['id']] = {
+            'id': channel['id'],
+            'name': channel['name'],
+            'created': channel['created'],
+            'creator': channel['creator'],
+            'purpose': {'value': ''},
+        }
+
+    def handle_channel_gone(self, event):
+        cid = event['channel']
+        for section in ('activity', 'created', 'warnings', 'new_channels'):
+            self.state.section(section).pop(cid, None)
+
+    def prune(self):
+        """Forget reaction counts (ours and the live flagger's) and new channels older than a day."""
+        dayago = time.time() - 86400
+        with self.state.lock:
+            for section in ('reactions', 'reaction_counters'):
+                reactions = self.state.section(section)
+                for key in [k for k in reactions if float(k.split(':', 1)[1]) < dayago]:
+                    del reactions[key]
+            new_channels = self.state.section('new_channels')
+            for cid in [c for c in new_channels if new_channels[c]['created'] < dayago]:
+                del new_channels[cid]
+
+    def save(self):
+        self.prune()
+        if self.flagger:
+            self.flagger.save()
+        else:
+            self.state.save()
+        self.last_save = time.time()
+
+    def ingest(self, events, replayed=False):
+        """
+        Record every event in the iterable `events`; if `replayed`, as received when they were
+        sent (e.g. events captured from a live workspace), rather than now.
+        """
+        for event in events:
+            received = float(event.get('event_ts') or event.get('ts') or time.time()) if replayed else None
+            self.handle(event, received=received)
+        self.save()
+
+    def replay(self, fname):
+        """Record the events in the JSONL file `fname`, e.g. one captured from a live workspace."""
+        self.logger.info("Replaying events from %s", fname)
+        self.ingest(read_events(fname), replayed=True)
+
+    def verify_signature(self, environ, body):
+        """Return True if the request carries a valid Slack signature (or no signing secret is configured)."""
+        secret = os.getenv(self.config.get('signing_secret_env_varname') or '')
+        if not secret:
+            return True
+        timestamp = environ.get('HTTP_X_SLACK_REQUEST_TIMESTAMP', '')
+        if not timestamp.isdigit() or abs(time.time() - int(timestamp)) > 300:
+            return False
+        basestring = b"v0:" + timestamp.encode('utf-8') + b":" + body
+        expected = "v0=" + hmac.new(secret.encode('utf-8'), basestring, hashlib.sha256).hexdigest()
+        return hmac.compare_digest(expected, environ.get('HTTP_X_SLACK_SIGNATURE', ''))
+
+    def application(self, environ, start_response):
+        """A WSGI application implementing a Slack Events API request URL."""
+        length = int(environ.get('CONTENT_LENGTH') or 0)
+        body = environ['wsgi.input'].read(length)
+        if not self.verify_signature(environ, body):
+            start_response('403 Forbidden', [('Content-Type', 'text/plain')])
+            return [b"bad signature"]
+        payload = json.loads(body.decode('utf-8'))
+        response = b""
+        if payload.get('type') == 'url_verification':
+            response = payload['challenge'].encode('utf-8')
+        elif payload.get('type') == 'event_callback':
+            self.handle(payload['event'], event_id=payload.get('event_id'))
+        start_response('200 OK', [('Content-Type', 'text/plain')])
+        return [response]
+
+    def beat(self, stopped):
+        """Record a heartbeat (and save) every HEARTBEAT_INTERVAL seconds until the event `stopped` is set."""
+        while not stopped.wait(HEARTBEAT_INTERVAL):
+            self.heartbeat()
+            self.save()
+
+    def serve(self, port):
+        """Receive events from the Slack Events API on `port` until interrupted."""
+        self.logger.info("Listening for Slack events on port %s", port)
+        self.heartbeat()
+        stopped = threading.Event()
+        # quiet workspaces send few events, so the receiver proves it's listening by itself
+        beater = threading.Thread(target=self.beat, args=(stopped,), name="heartbeat")
+        beater.daemon = True
+        beater.start()
+        server = make_server('', port, self.application)
+        try:
+            server.serve_forever()
+        finally:
+            stopped.set()
+            self.save()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Ingest Slack events into the destalinator state file.')
+    parser.add_argument("--replay", help="JSONL file of events to replay")
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "3000")),
+                        help="port on which to receive Events API requests")
+    parser.add_argument("--flag", action="store_true", default=False,
+                        help="also flag messages as soon as their reactions cross a flagger rule")
+    args = parser.parse_args()
+
+    ingester = Ingester()
+    if args.flag:
+        import flagger
+        event_flagger = flagger.Flagger(slackbot_injected=ingester.slackbot,
+                                        slacker_injected=ingester.slacker,
+                                        state_injected=ingester.state)
+        if event_flagger.initialize_control():
+            ingester.flagger = event_flagger
+            ingester.listeners.append(event_flagger.handle_event)
+    if args.replay:
+        ingester.replay(args.replay)
+    else:
+        ingester.serve(args.port)
@@ -0,0 +1,251 @@
+#! /usr/bin/env python
+
+import contextlib
+import functools
+import json
+import threading
+import time
+
+
+# Upper bounds (in seconds) of the latency histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+class Histogram(object):
+    """A cumulative histogram over `BUCKETS`, in the style of a Prometheus histogram."""
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self):
+        """Return [(upper bound, number of observations <= bound)], ending with ('+Inf', count)."""
+        ret = []
+        total = 0
+        for bound, count in zip(BUCKETS + ('+Inf',), self.counts):
+            total += count
+            ret.append((bound, total))
+        return ret
+
+    def as_dict(self):
+        return {'count': self.count, 'sum': round(self.sum, 6),
+                'buckets': {str(bound): count for bound, count in self.cumulative()}}
+
+
+class Metrics(object):
+    """
+    Counters, gauges, latency histograms and per-channel timings for a run.
+
+    Counters, gauges and histograms are named and may carry labels, e.g.
+    `metrics.registry.incr('api_calls', method='channels.history')`.
+    Inside `with metrics.registry.labelled(workspace=...)`, everything measured
+    in that thread carries the extra labels too.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.started = time.time()
+            self.counters = {}
+            self.gauges = {}
+            self.histograms = {}
+            self.channel_times = {}
+
+    @contextlib.contextmanager
+    def labelled(self, **labels):
+        """Add `labels` to everything measured in this thread in the body of the `with` block."""
+        previous = self.context_labels()
+        self.local.labels = dict(previous, **labels)
+        try:
+            yield
+        finally:
+            self.local.labels = previous
+
+    def context_labels(self):
+        """Return the labels `labelled()` is adding in this thread."""
+        return getattr(self.local, 'labels', {})
+
+    def key(self, name, labels):
+        context = self.context_labels()
+        return (name, label_key(dict(context, **labels) if context else labels))
+
+    def incr(self, name, value=1, **labels):
+        key = self.key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        """Record the current `value` of gauge `name`, replacing the last one."""
+        key = self.key(name, labels)
+        with self.lock:
+            self.gauges[key] = value
+
+    def observe(self, name, value, **labels):
+        key = self.key(name, labels)
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].observe(value)
+
+    def observe_channel(self, channel_name, seconds):
+        """Add `seconds` to the time spent evaluating `channel_name`."""
+        workspace = self.context_labels().get('workspace')
+        if workspace:
+            channel_name = "{}/{}".format(workspace, channel_name)
+        with self.lock:
+            self.channel_times[channel_name] = self.channel_times.get(channel_name, 0.0) + seconds
+
+    @contextlib.contextmanager
+    def timed(self, name, **labels):
+        """Observe how long the body of the `with` block takes in histogram `name`."""
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.observe(name, time.time() - start, **labels)
+
+    def snapshot(self):
+        """Return the raw measurements as a JSON-serialisable dict, for `merge()` in another process."""
+        with self.lock:
+            return {
+                'counters': [[name, dict(labels), value] for (name, labels), value in self.counters.items()],
+                'gauges': [[name, dict(labels), value] for (name, labels), value in self.gauges.items()],
+                'histograms': [[name, dict(labels), h.counts, h.count, h.sum] for (name, labels), h in self.histograms.items()],
+                'channel_times': dict(self.channel_times),
+            }
+
+    def merge(self, snapshot):
+        """Add the measurements in `snapshot` (from `snapshot()`, e.g. of a shard's run) to these."""
+        with self.lock:
+            for name, labels, value in snapshot['counters']:
+                key = (name, label_key(labels))
+                self.counters[key] = self.counters.get(key, 0) + value
+            for name, labels, value in snapshot.get('gauges', []):
+                self.gauges[(name, label_key(labels))] = value
+            for name, labels, counts, count, total in snapshot['histograms']:
+                key = (name, label_key(labels))
+                histogram = self.histograms.setdefault(key, Histogram())
+                histogram.counts = [a + b for a, b in zip(histogram.counts, counts)]
+                histogram.count += count
+                histogram.sum += total
+            for channel_name, seconds in snapshot['channel_times'].items():
+                self.channel_times[channel_name] = self.channel_times.get(channel_name, 0.0) + seconds
+
+    def counter(self, name, **labels):
+        return self.counters.get((name, label_key(labels)), 0)
+
+    def gauge(self, name, **labels):
+        return self.gauges.get((name, label_key(labels)))
+
+    def total(self, name, **labels):
+        """Return the sum of counter `name` across all its labels, or just those with `labels`."""
+        wanted = set(labels.items())
+        with self.lock:
+            return sum(value for (n, key), value in self.counters.items() if n == name and wanted.issubset(key))
+
+    def hit_rate(self, cache):
+        hits = self.total('cache_hits', cache=cache)
+        total = hits + self.total('cache_misses', cache=cache)
+        return round(float(hits) / total, 4) if total else None
+
+    def report(self):
+        """Return the run's measurements as a JSON-serialisable dict."""
+        with self.lock:
+            counters = {}
+            for (name, labels), value in sorted(self.counters.items()):
+                counters.setdefault(name, []).append({'labels': dict(labels), 'value': value})
+            gauges = {}
+            for (name, labels), value in sorted(self.gauges.items()):
+                gauges.setdefault(name, []).append({'labels': dict(labels), 'value': value})
+            histograms = {}
+            for (name, labels), histogram in sorted(self.histograms.items(), key=lambda x: x[0]):
+                entry = histogram.as_dict()
+                entry['labels'] = dict(labels)
+                histograms.setdefault(name, []).append(entry)
+            caches = set(dict(labels)['cache'] for (name, labels) in self.counters if name in ('cache_hits', 'cache_misses'))
+            slowest = sorted(self.channel_times.items(), key=lambda x: -x[1])
+        return {
+            'duration': round(time.time() - self.started, 3),
+            'counters': counters,
+            'gauges': gauges,
+            'histograms': histograms,
+            'cache_hit_rates': {cache: self.hit_rate(cache) for cache in sorted(caches)},
+            'channel_evaluation_seconds': dict((name, round(seconds, 6)) for name, seconds in slowest),
+        }
+
+    def to_json(self):
+        return json.dumps(self.report(), indent=4, sort_keys=True)
+
+    def to_prometheus(self, prefix="destalinator"):
+        """Return the counters, gauges and histograms in the Prometheus text exposition format."""
+        def fmt_labels(labels, extra=()):
+            items = list(labels) + list(extra)
+            if not items:
+                return ""
+            return "{" + ",".join('{}="{}"'.format(k, v) for k, v in items) + "}"
+
+        lines = []
+        with self.lock:
+            for name in sorted(set(n for n, _ in self.counters)):
+                lines.append("# TYPE {}_{}_total counter".format(prefix, name))
+                for (n, labels), value in sorted(self.counters.items()):
+                    if n == name:
+                        lines.append("{}_{}_total{} {}".format(prefix, name, fmt_labels(labels), value))
+            for name in sorted(set(n for n, _ in self.gauges)):
+                lines.append("# TYPE {}_{} gauge".format(prefix, name))
+                for (n, labels), value in sorted(self.gauges.items()):
+                    if n == name:
+                        lines.append("{}_{}{} {}".format(prefix, name, fmt_labels(labels), value))
+            for name in sorted(set(n for n, _ in self.histograms)):
+                lines.append("# TYPE {}_{} histogram".format(prefix, name))
+                for (n, labels), histogram in sorted(self.histograms.items(), key=lambda x: x[0]):
+                    if n != name:
+                        continue
+                    for bound, count in histogram.cumulative():
+                        lines.append("{}_{}_bucket{} {}".format(prefix, name, fmt_labels(labels, [('le', bound)]), count))
+                    lines.append("{}_{}_sum{} {}".format(prefix, name, fmt_labels(labels), histogram.sum))
+                    lines.append("{}_{}_count{} {}".format(prefix, name, fmt_labels(labels), histogram.count))
+        return "\n".join(lines) + "\n"
+
+
+# The registry everything in a process reports to
+registry = Metrics()
+
+
+def timed(name, per_channel=False):
+    """
+    Decorator observing how long each call of a method takes in histogram `name`.
+    If `per_channel`, the time is also added to the channel named by the method's first argument.
+    """
+    def decorator(f):
+        @functools.wraps(f)
+        def wrapper(self, *args, **kwargs):
+            start = time.time()
+            try:
+                return f(self, *args, **kwargs)
+            finally:
+                elapsed = time.time() - start
+                registry.observe(name, elapsed)
+                if per_channel and args:
+                    registry.observe_channel(args[0], elapsed)
+        return wrapper
+    return decorator
@@ -0,0 +1,106 @@
+#! /usr/bin/env python
+
+import logging
+import threading
+import time
+import traceback
+
+import metrics
+import profiling
+
+
+class Stage(object):
+    """
+    One step of a job: `func` is called with no arguments.
+    `timeout` is the number of seconds to wait for it before giving up on it.
+    """
+
+    def __init__(self, name, func, timeout=None):
+        self.name = name
+        self.func = func
+        self.timeout = timeout
+
+
+# {stage name: the thread of its last run}, so a stage that timed out isn't started again while it's still running
+running = {}
+running_lock = threading.Lock()
+
+
+def run_stage(stage, results, logger):
+    """
+    Run `stage` in its own thread, waiting at most `stage.timeout` seconds; record its outcome in `results`.
+    A stage whose previous run timed out and is still going is skipped rather than run twice at once.
+    """
+    with running_lock:
+        previous = running.get(stage.name)
+        if previous is not None and previous.is_alive():
+            logger.error("Skipping stage %s: its previous run, which timed out, is still running", stage.name)
+            results[stage.name] = {'status': 'still running', 'seconds': 0}
+            return False
+    outcome = {}
+    # measurements in the stage's thread carry the same labels as this one's (e.g. its workspace),
+    # plus the stage's name, so each stage's budget only counts its own API calls
+    labels = dict(metrics.registry.context_labels(), stage=stage.name)
+
+    def target():
+        try:
+            with metrics.registry.labelled(**labels), profiling.profiled(stage.name):
+                stage.func()
+            outcome['status'] = 'ok'
+        except Exception as e:
+            outcome['status'] = 'failed'
+            outcome['error'] = "{}: {}".format(e.__class__.__name__, e)
+            logger.error("Stage %s failed:\n%s", stage.name, traceback.format_exc())
+
+    start = time.time()
+    thread = threading.Thread(target=target, name=stage.name)
+    # a stage that times out can't be stopped, but mustn't keep the process alive either
+    thread.daemon = True
+    with running_lock:
+        running[stage.name] = thread
+    thread.start()
+    thread.join(stage.timeout)
+    result = {'status': outcome.get('status', 'timed out'), 'seconds': round(time.time() - start, 3)}
+    if 'error' in outcome:
+        result['error'] = outcome['error']
+    if result['status'] == 'timed out':
+        logger.error("Stage %s timed out after %s seconds", stage.name, stage.timeout)
+    results[stage.name] = result
+    return result['status'] == 'ok'
+
+
+def run_chain(chain, results, logger):
+    """Run the stages in `chain` one after another; once one doesn't succeed, the rest are skipped."""
+    for i, stage in enumerate(chain):
+        if not run_stage(stage, results, logger):
+            for skipped in chain[i + 1:]:
+                results[skipped.name] = {'status': 'skipped', 'seconds': 0}
+            return
+
+
+def run_stages(chains, logger=None):
+    """
+    Run each chain of stages in `chains` concurrently with the others, the stages within
+    a chain in order, e.g. `[[warn, archive], [announce], [flag]]`.
+    Returns {stage name: {'status': 'ok'|'failed'|'timed out'|'still running'|'skipped', 'seconds': float[, 'error': str]}}.
+    """
+    logger = logger or logging.getLogger(__name__)
+    results = {}
+    labels = metrics.registry.context_labels()
+
+    def target(chain):
+        with metrics.registry.labelled(**labels):
+            run_chain(chain, results, logger)
+
+    threads = [threading.Thread(target=target, args=(chain,)) for chain in chains]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def summarize(results):
+    """Return a one-line summary of `run_stages` results."""
+    return ", ".join("{} {} ({}s)".format(name, results[name]['status'], results[name]['seconds'])
+                     for name in sorted(results))
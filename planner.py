@@ -0,0 +1,56 @@
+#! /usr/bin/env python
+
+import argparse
+import json
+import sys
+import time
+
+import executor
+import profiling
+
+
+class Planner(executor.Executor):
+
+    def plan(self, force_warn=False):
+        """Return the plan of which channels to warn and archive (see Destalinator.plan_all)."""
+        return self.ds.plan_all(self.config.warn_threshold, self.config.archive_threshold, force_warn)
+
+    def apply(self, plan, max_age=None):
+        """
+        Carry out `plan`, unless it is more than `max_age` seconds old.
+        Returns the names of the warned channels, or None if the plan was too old.
+        """
+        age = time.time() - plan['created']
+        if max_age is not None and age > max_age:
+            self.logger.error("Not applying a plan made %d seconds ago; plans may be at most %d seconds old", age, max_age)
+            return None
+        return self.ds.apply_plan(plan)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Plan which channels to warn and archive, or carry out such a plan.')
+    subparsers = parser.add_subparsers(dest="command")
+    plan_parser = subparsers.add_parser("plan", help="evaluate every channel and write the plan as JSON")
+    plan_parser.add_argument("-o", "--output", help="file to write the plan to (default: stdout)")
+    plan_parser.add_argument("force", nargs="?", choices=["force"], help="plan warnings even for channels already warned")
+    apply_parser = subparsers.add_parser("apply", help="carry out a plan written by `plan`")
+    apply_parser.add_argument("plan", help="file holding the plan")
+    apply_parser.add_argument("--max-age", type=int, default=86400,
+                              help="refuse plans older than this many seconds (default: a day)")
+    profiling.add_argument(parser)
+    args = parser.parse_args()
+
+    with profiling.profiled("planner", args.profile):
+        planner = Planner()
+        if args.command == "apply":
+            with open(args.plan) as fo:
+                planner.apply(json.load(fo), max_age=args.max_age)
+        else:
+            plan = planner.plan(force_warn=getattr(args, 'force', None) == "force")
+            blob = json.dumps(plan, indent=4, sort_keys=True)
+            if getattr(args, 'output', None):
+                with open(args.output, "w") as fo:
+                    fo.write(blob + "\n")
+            else:
+                sys.stdout.write(blob + "\n")
+    planner.emit_report()
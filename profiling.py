@@ -0,0 +1,175 @@
+#! /usr/bin/env python
+
+import collections
+import contextlib
+import cProfile
+import functools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+
+MODES = ('cprofile', 'sample')
+
+# {thread ident: [phase, ...]} for threads inside a `phase()` block; only maintained while profiling
+_phases = {}
+# {thread ident: [profiler, ...]} for each thread being profiled, so jobs profiled at once don't see each other's phases
+_active = {}
+_active_lock = threading.Lock()
+
+
+@contextlib.contextmanager
+def phase(name):
+    """
+    Tag everything done in the `with` block as part of phase `name`
+    (e.g. 'listing', 'history fetch', 'evaluation', 'posting') for the profilers of the current thread.
+    """
+    ident = threading.current_thread().ident
+    profilers = _active.get(ident)
+    if not profilers:
+        yield
+        return
+    stack = _phases.setdefault(ident, [])
+    stack.append(name)
+    start = time.time()
+    try:
+        yield
+    finally:
+        stack.pop()
+        for profiler in profilers:
+            profiler.add_phase_time(name, time.time() - start)
+
+
+def in_phase(name):
+    """Decorator running every call of the function inside `phase(name)`."""
+    def decorator(f):
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            with phase(name):
+                return f(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def current_phase(ident):
+    stack = _phases.get(ident)
+    return stack[-1] if stack else 'other'
+
+
+class Sampler(threading.Thread):
+    """Samples the stack of thread `ident` every `interval` seconds, counting collapsed stacks tagged by phase."""
+
+    def __init__(self, ident, interval):
+        super(Sampler, self).__init__()
+        self.daemon = True
+        self.ident_to_sample = ident
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.ident_to_sample)
+            if frame is None:
+                continue
+            frames = []
+            while frame is not None:
+                frames.append("{}:{}".format(os.path.basename(frame.f_code.co_filename), frame.f_code.co_name))
+                frame = frame.f_back
+            frames.append("[{}]".format(current_phase(self.ident_to_sample)))
+            self.stacks[";".join(reversed(frames))] += 1
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+class Profiler(object):
+    """
+    Profiles one job, writing its results into `output_dir`:
+
+    * 'cprofile' mode writes `<job>-<time>.pstats` (for pstats, snakeviz, gprof2dot...)
+    * 'sample' mode writes `<job>-<time>.collapsed`, stacks in the collapsed format read by
+      flamegraph.pl and speedscope, each rooted at the phase it was sampled in
+
+    Both also write `<job>-<time>.phases.json` with the wall time spent in each phase
+    (including any phases nested inside it, e.g. history fetches during evaluation).
+    """
+
+    def __init__(self, job, mode, output_dir, interval=0.005, logger=None):
+        assert mode in MODES, "Unknown profiling mode {}".format(mode)
+        self.job = job
+        self.mode = mode
+        self.output_dir = output_dir
+        self.interval = interval
+        self.logger = logger or logging.getLogger(__name__)
+        self.phase_times = collections.Counter()
+        self.lock = threading.Lock()
+
+    def add_phase_time(self, name, seconds):
+        with self.lock:
+            self.phase_times[name] += seconds
+
+    def start(self):
+        if self.mode == 'cprofile':
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+        else:
+            self.sampler = Sampler(threading.current_thread().ident, self.interval)
+            self.sampler.start()
+        self.ident = threading.current_thread().ident
+        with _active_lock:
+            _active[self.ident] = _active.get(self.ident, []) + [self]
+
+    def stop(self):
+        with _active_lock:
+            profilers = [x for x in _active[self.ident] if x is not self]
+            if profilers:
+                _active[self.ident] = profilers
+            else:
+                del _active[self.ident]
+        if not os.path.isdir(self.output_dir):
+            os.makedirs(self.output_dir)
+        base = os.path.join(self.output_dir, "{}-{}".format(self.job, time.strftime("%Y%m%d-%H%M%S")))
+        if self.mode == 'cprofile':
+            self.profile.disable()
+            fname = base + ".pstats"
+            self.profile.dump_stats(fname)
+        else:
+            self.sampler.stop()
+            fname = base + ".collapsed"
+            with open(fname, "w") as fo:
+                for stack, count in sorted(self.sampler.stacks.items()):
+                    fo.write("{} {}\n".format(stack, count))
+        with open(base + ".phases.json", "w") as fo:
+            json.dump(dict(self.phase_times), fo, indent=4, sort_keys=True)
+        self.logger.info("Wrote %s profile of %s to %s", self.mode, self.job, fname)
+        return fname
+
+
+@contextlib.contextmanager
+def profiled(job, mode=None, output_dir=None, logger=None):
+    """
+    Profile the `with` block as job `job` in `mode` ('cprofile' or 'sample').
+    `mode` and `output_dir` default to the DESTALINATOR_PROFILE and DESTALINATOR_PROFILE_DIR
+    environment variables; if no mode is given either way, nothing is profiled.
+    """
+    mode = mode or os.getenv("DESTALINATOR_PROFILE")
+    if not mode:
+        yield
+        return
+    profiler = Profiler(job, mode, output_dir or os.getenv("DESTALINATOR_PROFILE_DIR", "profiles"), logger=logger)
+    profiler.start()
+    try:
+        yield profiler
+    finally:
+        profiler.stop()
+
+
+def add_argument(parser):
+    """Add a `--profile [MODE]` option to an argparse parser."""
+    parser.add_argument("--profile", nargs="?", const="cprofile", choices=MODES, default=None,
+                        help="profile the run (default mode: cprofile); output goes to $DESTALINATOR_PROFILE_DIR")
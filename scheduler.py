@@ -3,38 +3,134 @@ import logging
 import warner
 import archiver
 import announcer
+import config
 import flagger
+import metrics
+import multiprocessing.pool
+import pipeline
+import profiling
+import traceback
+import warm
+import workspaces
 import os
 
 
-# When testing changes, set the "TEST_SCHEDULE" envvar to run more often
-if os.getenv("TEST_SCHEDULE"):
-    schedule_kwargs = {"hour": "*", "minute": "*/10"}
-else:
-    schedule_kwargs = {"hour": "10"}
+# {workspace name (None without `workspaces`): the warm.Context of its runs}, so later runs only fetch what has changed
+warm_contexts = {}
+# the HTTP connection pool the workspaces listed under `workspaces` share between runs
+workspace_session = None
+
+
+def executors(cfg=None, session=None):
+    """
+    Return the warner, archiver, announcer and flagger for a run against the workspace configured by `cfg`
+    (one of config.workspaces(), or None for the only one), reusing the Slacker, Slackbot, State and
+    warm.Cache of the workspace's earlier runs.
+    """
+    name = cfg.get('slack_name') if cfg else None
+    settings = {'config_injected': cfg, 'session': session} if cfg else {}
+    context = warm_contexts.get(name)
+    if context is None:
+        scheduled_warner = warner.Warner(warm_injected=warm.from_config(cfg or config.Config()), **settings)
+        context = warm_contexts[name] = warm.Context(scheduled_warner)
+    else:
+        context.refresh()
+        scheduled_warner = warner.Warner(**dict(settings, **context.injected()))
+    # the stages run at the same time, so they share one state store rather than overwriting each other's,
+    # and one Slacker, so its directories are fetched once and its concurrency limits see all their requests
+    shared = dict(settings, **context.injected())
+    return scheduled_warner, archiver.Archiver(**shared), announcer.Announcer(**shared), flagger.Flagger(**shared)
+
+
+def chains(scheduled_warner, scheduled_archiver, scheduled_announcer, scheduled_flagger, prefix=""):
+    """Return the chains of stages of a run, for pipeline.run_stages, named with `prefix`."""
+    timeout = scheduled_warner.config.get('stage_timeout')
+    # archiving relies on the warnings just posted, so it waits for the warner; everything else is independent
+    return [
+        [pipeline.Stage(prefix + "warner", scheduled_warner.warn, timeout),
+         pipeline.Stage(prefix + "archiver", scheduled_archiver.archive, timeout)],
+        [pipeline.Stage(prefix + "announcer", scheduled_announcer.announce, timeout)],
+        [pipeline.Stage(prefix + "flagger", scheduled_flagger.flag, timeout)],
+    ]
+
+
+def run_workspaces(configs):
+    """
+    Run every stage against each workspace in `configs`, up to `workspace_workers` workspaces at once,
+    with stages named "<workspace>/<stage>"; return the stage results and the first workspace's warner.
+    """
+    global workspace_session
+    workspaces.check(configs)
+    workers = min(config.Config().get('workspace_workers') or 4, len(configs))
+    if workspace_session is None:
+        workspace_session = workspaces.make_session(len(configs), workers)
+    results = {}
+    warners = {}
+
+    def run(cfg):
+        name = cfg.get('slack_name')
+        with metrics.registry.labelled(workspace=name):
+            try:
+                with profiling.profiled("setup"):
+                    stage_executors = executors(cfg, workspace_session)
+            except Exception:
+                logging.getLogger(__name__).error("Couldn't set up the run for %s:\n%s", name, traceback.format_exc())
+                results[name + "/setup"] = {'status': 'failed', 'seconds': 0}
+                return
+            warners[name] = stage_executors[0]
+            results.update(pipeline.run_stages(chains(*stage_executors, prefix=name + "/"),
+                                               logger=stage_executors[0].logger))
+
+    pool = multiprocessing.pool.ThreadPool(workers)
+    try:
+        pool.map(run, configs)
+    finally:
+        pool.close()
+        pool.join()
+    reporters = [warners[cfg.get('slack_name')] for cfg in configs if cfg.get('slack_name') in warners]
+    return results, reporters[0] if reporters else None
 
-logging.basicConfig()
-sched = BlockingScheduler()
 
-@sched.scheduled_job("cron", **schedule_kwargs)
 def destalinate_job():
     print("Destalinating")
-    if "SB_TOKEN" not in os.environ or "API_TOKEN" not in os.environ:
+    configs = config.workspaces()
+    # each of several workspaces has its own tokens, so one missing them fails on its own
+    if not configs and ("SB_TOKEN" not in os.environ or "API_TOKEN" not in os.environ):
         print("ERR: Missing at least one Slack environment variable.")
     else:
-        scheduled_warner = warner.Warner()
-        scheduled_archiver = archiver.Archiver()
-        scheduled_announcer = announcer.Announcer()
-        scheduled_flagger = flagger.Flagger()
-        print("Warning")
-        scheduled_warner.warn()
-        print("Archiving")
-        scheduled_archiver.archive()
-        print("Announcing")
-        scheduled_announcer.announce()
-        print("Flagging")
-        scheduled_flagger.flag()
-        print("OK: destalinated")
+        metrics.registry.reset()
+        if configs:
+            results, reporter = run_workspaces(configs)
+        else:
+            # set DESTALINATOR_PROFILE to "cprofile" or "sample" to profile each stage
+            with profiling.profiled("setup"):
+                stage_executors = executors()
+            reporter = stage_executors[0]
+            results = pipeline.run_stages(chains(*stage_executors), logger=reporter.logger)
+        if reporter is not None:
+            reporter.emit_report()
+        print("Stages: " + pipeline.summarize(results))
+        if all(result['status'] == 'ok' for result in results.values()):
+            print("OK: destalinated")
+        else:
+            print("ERR: not every stage succeeded")
     print("END: destalinate_job")
 
-sched.start()
+
+def trigger():
+    """Return the APScheduler trigger and its arguments for how often to run."""
+    # When testing changes, set the "TEST_SCHEDULE" envvar to run more often
+    if os.getenv("TEST_SCHEDULE"):
+        return "cron", {"hour": "*", "minute": "*/10"}
+    minutes = config.Config().get('schedule_every_minutes')
+    if minutes:
+        return "interval", {"minutes": minutes}
+    return "cron", {"hour": "10"}
+
+
+if __name__ == "__main__":
+    logging.basicConfig()
+    sched = BlockingScheduler()
+    trigger_name, trigger_kwargs = trigger()
+    sched.add_job(destalinate_job, trigger_name, **trigger_kwargs)
+    sched.start()
@@ -0,0 +1,286 @@
+#! /usr/bin/env python
+"""
+Split a warner, archiver or flagger run across shards of the workspace's channels.
+
+Channels are assigned to shards by a hash of their ID, so every process agrees on the
+split without talking to the others.  Either run all the shards from one command
+(`--shards N`, one worker process each), or run one shard per cron instance by setting
+DESTALINATOR_SHARD to "i/N" (0 <= i < N) and DESTALINATOR_SHARD_RUN to an ID for the run
+(the same in every instance, e.g. the date the cron job was scheduled); the instances leave
+their results in DESTALINATOR_SHARD_DIR (default: `shards`, which they must share), and
+whichever finishes last merges them.
+
+A shard that fails is reported and the others' results are merged without it; running it
+again with the same run ID merges its result once it succeeds.
+
+Either way each shard works on its own copy of the state and gets 1/N of `api_rate_limit`.
+The merge applies every shard's changes to the state file, posts one combined warning
+in the general channel and reports the metrics of the whole run.
+"""
+
+import copy
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import traceback
+
+import config
+import dedup
+import metrics
+import state
+
+
+JOBS = ('warner', 'archiver', 'flagger')
+
+
+def shard_of(cid, count):
+    """Return the shard (0 to `count` - 1) channel `cid` belongs in."""
+    return int(hashlib.md5(cid.encode('utf-8')).hexdigest(), 16) % count
+
+
+def in_shard(cid, shard):
+    """Return True if channel `cid` belongs in `shard`, an (index, count) pair."""
+    index, count = shard
+    return shard_of(cid, count) == index
+
+
+def parse(spec):
+    """Parse an "i/N" shard spec into an (index, count) pair."""
+    index, count = [int(x) for x in spec.split('/')]
+    assert 0 <= index < count, "Shard index must be between 0 and {}".format(count - 1)
+    return index, count
+
+
+def from_env():
+    """Return the (index, count) pair in DESTALINATOR_SHARD, if any."""
+    spec = os.getenv("DESTALINATOR_SHARD")
+    return parse(spec) if spec else None
+
+
+def add_argument(parser):
+    """Add a `--shards N` option to an argparse parser."""
+    parser.add_argument("--shards", type=int, default=None,
+                        help="split the channels between this many worker processes")
+
+
+# state changes
+
+def changes(before, after, path=()):
+    """Return the [path, value] pairs to set and the paths to remove to turn dict `before` into `after`."""
+    ret = {'set': [], 'unset': []}
+    for key, value in after.items():
+        old = before.get(key)
+        if isinstance(value, dict) and (isinstance(old, dict) or key not in before):
+            # descend even into new dicts, so shards adding to the same new section don't overwrite each other
+            nested = changes(old or {}, value, path + (key,))
+            ret['set'] += nested['set']
+            ret['unset'] += nested['unset']
+        elif key not in before or old != value:
+            ret['set'].append([list(path + (key,)), value])
+    ret['unset'] += [list(path + (key,)) for key in before if key not in after]
+    return ret
+
+
+def apply_changes(data, delta):
+    """Apply `changes()` output to dict `data`."""
+    for path, value in delta['set']:
+        target = data
+        for key in path[:-1]:
+            target = target.setdefault(key, {})
+        target[path[-1]] = value
+    for path in delta['unset']:
+        target = data
+        for key in path[:-1]:
+            target = target.get(key, {})
+        target.pop(path[-1], None)
+
+
+# running shards
+
+def make_executor(job, **kwargs):
+    if job == 'warner':
+        import warner
+        return warner.Warner(**kwargs)
+    if job == 'archiver':
+        import archiver
+        return archiver.Archiver(**kwargs)
+    import flagger
+    return flagger.Flagger(**kwargs)
+
+
+def run_shard(job, shard, force_warn=False):
+    """
+    Run `job` over the channels in `shard` without saving any state or posting the
+    general warning; return what the merge needs as a JSON-serialisable dict.
+    """
+    metrics.registry.reset()
+    store = state.from_config(config.Config())
+    before = copy.deepcopy(store.data)
+    # the shards' changes are merged into the state file afterwards, so don't write it here
+    store.fname = None
+    ex = make_executor(job, state_injected=store)
+    if ex.slacker.rate_limit:
+        ex.slacker.rate_limit = float(ex.slacker.rate_limit) / shard[1]
+    ex.ds.shard = shard
+
+    warned = []
+    if job == 'warner':
+        warned = ex.ds.warn_all(ex.config.warn_threshold, force_warn, notify=False)
+    elif job == 'archiver':
+        ex.archive()
+    else:
+        ex.flag()
+    return {
+        'shard': list(shard),
+        'warned': warned,
+        'changes': changes(before, store.data),
+        'metrics': metrics.registry.snapshot(),
+    }
+
+
+def _run_shard(args):
+    job, shard, force_warn = args
+    try:
+        return run_shard(job, shard, force_warn)
+    except Exception:
+        return {'shard': list(shard), 'error': traceback.format_exc()}
+
+
+def report_failures(job, failed, logger):
+    """Log the tracebacks of the `failed` shards' results."""
+    for result in failed:
+        logger.error("Shard %s/%s of the %s run failed; its changes aren't merged:\n%s",
+                     result['shard'][0], result['shard'][1], job, result['error'])
+
+
+def merge(job, results):
+    """Merge the results of every shard of a `job` run: save their state changes, post the general warning and report."""
+    results = sorted(results, key=lambda x: x['shard'])
+    store = state.from_config(config.Config())
+    for result in results:
+        apply_changes(store.data, result['changes'])
+    if job == 'flagger':
+        # each shard's Bloom filter only knows its own announcements; rebuild it from all of them
+        log = dedup.AnnouncementLog(store)
+        log.rebuild()
+        log.flush()
+    store.save()
+
+    ex = make_executor(job, state_injected=store)
+    warned = sorted(sum([result['warned'] for result in results], []))
+    if warned and ex.config.general_message_channel:
+        ex.ds.warn_in_general(warned)
+
+    metrics.registry.reset()
+    for result in results:
+        metrics.registry.merge(result['metrics'])
+    ex.logger.info("Merged %s shards of the %s run", len(results), job)
+    ex.emit_report()
+    return ex
+
+
+def run_processes(job, count, force_warn=False):
+    """Run every shard of `job` in its own worker process, then merge their results."""
+    pool = multiprocessing.Pool(count)
+    try:
+        results = pool.map(_run_shard, [(job, (i, count), force_warn) for i in range(count)])
+    finally:
+        pool.close()
+        pool.join()
+    report_failures(job, [x for x in results if 'error' in x], logging.getLogger(__name__))
+    return merge(job, [x for x in results if 'error' not in x])
+
+
+def claim(path):
+    """Create file `path` if no other instance has; return True if this one did."""
+    try:
+        os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        return True
+    except OSError:
+        return False
+
+
+def run_instance(job, shard, run_id, force_warn=False, results_dir=None, logger=None):
+    """
+    Run this cron instance's `shard` of run `run_id` of `job` and leave the result (or the
+    error) in `results_dir`; once every shard of the run has succeeded or failed, merge the
+    results of those that succeeded (exactly once). A failed shard run again later is merged
+    on its own. Exceptions from the shard are raised again once its failure is recorded.
+    """
+    logger = logger or logging.getLogger(__name__)
+    assert run_id, "Set DESTALINATOR_SHARD_RUN to an ID shared by every shard of the run"
+    results_dir = results_dir or os.getenv("DESTALINATOR_SHARD_DIR", "shards")
+    run_dir = os.path.join(results_dir, "{}-{}".format(job, run_id))
+    if not os.path.isdir(run_dir):
+        try:
+            os.makedirs(run_dir)
+        except OSError:
+            pass  # another instance made it first
+
+    fname = os.path.join(run_dir, "{}.json".format(shard[0]))
+    failed_fname = os.path.join(run_dir, "{}.failed".format(shard[0]))
+    error = None
+    try:
+        result = run_shard(job, shard, force_warn)
+    except Exception as e:
+        with open(failed_fname, "w") as fo:
+            fo.write(traceback.format_exc())
+        error = e
+    else:
+        with open(fname + ".tmp", "w") as fo:
+            json.dump(result, fo)
+        os.rename(fname + ".tmp", fname)
+        if os.path.exists(failed_fname):
+            os.remove(failed_fname)
+
+    ex = merge_when_finished(job, shard[1], run_id, run_dir, logger)
+    if (not error and os.path.exists(os.path.join(run_dir, "merged")) and
+            claim(os.path.join(run_dir, "merged-{}".format(shard[0])))):
+        # the rest of the run was merged without this shard, which had failed before
+        logger.info("Merging shard %s/%s of the %s run %s late", shard[0], shard[1], job, run_id)
+        ex = merge(job, [result])
+    if error:
+        raise error
+    return ex
+
+
+def merge_when_finished(job, count, run_id, run_dir, logger):
+    """Merge the shards of the run in `run_dir` that succeeded, if every shard has finished and nobody else has."""
+    finished = [i for i in range(count) if os.path.exists(os.path.join(run_dir, "{}.json".format(i))) or
+                os.path.exists(os.path.join(run_dir, "{}.failed".format(i)))]
+    if len(finished) < count:
+        logger.info("%s of %s shards of the %s run %s done; the last to finish merges them",
+                    len(finished), count, job, run_id)
+        return None
+    if not claim(os.path.join(run_dir, "merged")):
+        return None  # another instance merged (or is merging) the run
+    results = []
+    for i in range(count):
+        fname = os.path.join(run_dir, "{}.json".format(i))
+        if os.path.exists(fname) and claim(os.path.join(run_dir, "merged-{}".format(i))):
+            with open(fname) as fo:
+                results.append(json.load(fo))
+        elif not os.path.exists(fname):
+            with open(os.path.join(run_dir, "{}.failed".format(i))) as fo:
+                logger.error("Shard %s/%s of the %s run %s failed; run it again with DESTALINATOR_SHARD_RUN=%s "
+                             "to merge its changes:\n%s", i, count, job, run_id, run_id, fo.read())
+    return merge(job, results)
+
+
+def run(job, shards=None, force_warn=False):
+    """
+    Run `job` sharded, if `shards` or DESTALINATOR_SHARD asks for it; return the
+    executor that reported the run, or None if the job wasn't (or isn't yet) merged.
+    """
+    assert job in JOBS, "Unknown job {}".format(job)
+    shard = from_env()
+    if shard:
+        return run_instance(job, shard, os.getenv("DESTALINATOR_SHARD_RUN"), force_warn)
+    return run_processes(job, shards, force_warn)
+
+
+def requested(shards):
+    """Return True if the run should be sharded, given the `--shards` option."""
+    return bool(shards and shards > 1) or from_env() is not None
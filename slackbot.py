@@ -1,21 +1,34 @@
 #! /usr/bin/env python2.7
 
+import time
+
 import requests
 
+import profiling
+
 
 class Slackbot(object):
 
-    def __init__(self, slack_name, token):
+    # how many times to retry a message that was rate limited
+    max_retries = 3
+
+    def __init__(self, slack_name, token, url=None, session=None):
+        """
+        url overrides the Slackbot hook URL (e.g. to use a local stand-in)
+        session is a requests.Session to share (by default, a new one)
+        """
         self.slack_name = slack_name
         self.token = token
         assert self.token, "Token should not be blank"
-        self.url = self.sb_url()
+        self.url = url or self.sb_url()
+        self.session = session or requests.Session()
 
     def sb_url(self):
         url = "https://{}.slack.com/".format(self.slack_name)
         url += "services/hooks/slackbot"
         return url
 
+    @profiling.in_phase('posting')
     def say(self, channel, statement):
         """
         channel should not be preceded with '#'
@@ -24,5 +37,10 @@ class Slackbot(object):
         if channel[0] == '#':
             channel = channel[1:]
         nurl = self.url + "?token={}&channel=%23{}".format(self.token, channel)
-        p = requests.post(nurl, data=statement.encode('utf-8'))
+        for attempt in range(self.max_retries + 1):
+            p = self.session.post(nurl, data=statement.encode('utf-8'))
+            # a 5xx may come after the message was posted, so only rate limiting is retried
+            if attempt == self.max_retries or p.status_code != 429:
+                break
+            time.sleep(float(p.headers.get('Retry-After') or 2 ** attempt))
         return p.status_code
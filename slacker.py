@@ -3,42 +3,212 @@
 import json
 import logging
 import re
+import threading
 import time
 
 import requests
 
+import concurrency
 import config
+import decoding
+import metrics
+import profiling
 
 
 class Slacker(object):
 
-    def __init__(self, slack_name, token, logger=None, init=True):
+    # how many times to retry a request that was rate limited or failed on Slack's side
+    max_retries = 3
+
+    # the most the conversations.* API returns per page
+    max_page_size = 999
+
+    # bytes read at a time from responses decoded as they arrive
+    stream_chunk_size = 65536
+
+    # attributes filled in by get_users() and get_channels(), which are fetched the first time they're used
+    user_attributes = ('users_by_id', 'users_by_name', 'restricted_users', 'ultra_restricted_users', 'all_restricted_users')
+    channel_attributes = ('channels_by_id', 'channels_by_name', 'channels', 'channel_member_counts', 'private_channel_ids')
+
+    def __init__(self, slack_name, token, logger=None, init=False, api_url=None, configuration=None, session=None):
         """
         slack name is the short name of the slack (preceding '.slack.com')
         token should be a Slack API Token.
+        if init, the user and channel directories are fetched now rather than when first needed
+        api_url overrides the Slack Web API base URL (e.g. to use a local stand-in)
+        configuration is a config.Config() (by default, the one in configuration.yaml)
+        session is a requests.Session, e.g. shared with the Slackers of other workspaces (by default, a new one)
         """
         self.slack_name = slack_name
         self.token = token
         assert self.token, "Token should not be blank"
         self.logger = logger or logging.getLogger(__name__)
-        self.url = self.api_url()
-        self.config = config.Config()
+        self.url = api_url or self.api_url()
+        self.config = configuration or config.Config()
+        self.session = session or requests.Session()
+        # requests per second this Slacker may make (None: as many as Slack allows)
+        self.rate_limit = self.config.get('api_rate_limit')
+        self.pace_lock = threading.Lock()
+        self.next_request_at = 0
+        # how many requests for each API method may be in flight at once, adapted as Slack responds
+        self.concurrency = concurrency.AdaptiveConcurrency(**(self.config.get('api_concurrency') or {}))
+        self.decode = decoding.get(self.config.get('json_decoder'))
+        # the family of API methods for channels: the legacy channels.* or conversations.*
+        self.api = self.config.get('slack_api', 'channels')
+        assert self.api in ('channels', 'conversations'), "slack_api must be channels or conversations, not {}".format(self.api)
+        self.include_private = bool(self.config.get('include_private_channels'))
+        assert not self.include_private or self.api == 'conversations', "include_private_channels needs slack_api: conversations"
+        # list responses bigger than this many bytes (or of unknown size) are decoded as they arrive
+        self.stream_threshold = self.config.get('stream_threshold_bytes', 262144)
+        # when the user and channel directories were fetched
+        self.directories_fetched = {}
         if init:
             self.get_users()
             self.get_channels()
 
+    def __getattr__(self, name):
+        # only called for attributes that haven't been set yet
+        if name in Slacker.user_attributes:
+            self.get_users()
+        elif name in Slacker.channel_attributes:
+            self.get_channels()
+        else:
+            raise AttributeError(name)
+        if name not in self.__dict__:
+            raise AttributeError(name)
+        return self.__dict__[name]
+
+    def api_method(self, url):
+        return url[len(self.url):].split('?')[0]
+
+    def channel_method(self, name):
+        """Return the API method `name` (e.g. "history") of the configured family, e.g. "conversations.history"."""
+        return "{}.{}".format(self.api, name)
+
+    def api_get(self, url, retry_errors=True):
+        """
+        GET a Slack API `url` and return the decoded JSON payload. Pass retry_errors=False for
+        methods that change something, like archiving a channel (see `request()`).
+        """
+        return self.decode(self.request(self.session.get, url, retry_errors=retry_errors).content)
+
+    def api_post(self, url, data):
+        """POST `data` to a Slack API `url` and return the decoded JSON payload."""
+        return self.decode(self.request(self.session.post, url, retry_errors=False, data=data).content)
+
+    def api_get_items(self, url, key):
+        """
+        GET a Slack API `url` whose payload has a list under `key`; return an iterator over
+        the list's elements and a dict of the payload's other fields, which is complete once
+        the iterator is exhausted. Responses over `stream_threshold` bytes are decoded as
+        they arrive rather than held in memory whole.
+        """
+        method = self.api_method(url)
+        response = self.request(self.session.get, url, stream=True)
+        length = int(response.headers.get('Content-Length') or 0)
+        if length and length <= self.stream_threshold:
+            metrics.registry.incr('api_bytes_received', len(response.content), method=method)
+            payload = self.decode(response.content)
+            return iter(payload.pop(key, None) or []), payload
+        metrics.registry.incr('api_streamed_responses', method=method)
+        stream = decoding.StreamingObject(response.iter_content(self.stream_chunk_size), key)
+
+        def items():
+            try:
+                for item in stream:
+                    yield item
+            finally:
+                metrics.registry.incr('api_bytes_received', stream.bytes_read, method=method)
+                response.close()
+        return items(), stream.fields
+
+    def pace(self):
+        """Wait until making another request would keep us within `rate_limit`."""
+        if not self.rate_limit:
+            return
+        with self.pace_lock:
+            now = time.time()
+            wait = self.next_request_at - now
+            self.next_request_at = max(now, self.next_request_at) + 1.0 / self.rate_limit
+        if wait > 0:
+            time.sleep(wait)
+
+    def request(self, send, url, retry_errors=True, **kwargs):
+        """
+        Send a request with `send` (e.g. self.session.get), retrying up to `max_retries` times
+        when Slack is rate limiting us (HTTP 429, honouring Retry-After) or, if `retry_errors`,
+        failing (HTTP 5xx). Pass retry_errors=False for requests that mustn't be repeated, like
+        posting or deleting a message or archiving a channel: Slack may have carried one out
+        before answering with a 5xx.
+        Waits for a slot under the API method's adaptive concurrency limit first.
+        Returns the last response; with stream=True, its body is left for the caller to read.
+        """
+        method = self.api_method(url)
+        limiter = self.concurrency.limiter(method)
+        for attempt in range(self.max_retries + 1):
+            self.pace()
+            metrics.registry.incr('api_calls', method=method)
+            with limiter.slot():
+                start = time.time()
+                response = send(url, **kwargs)
+                latency = time.time() - start
+            metrics.registry.observe('api_latency_seconds', latency, method=method)
+            limiter.record(response.status_code, latency)
+            metrics.registry.set_gauge('api_concurrency_limit', round(limiter.limit, 2), method=method)
+            if not kwargs.get('stream'):
+                metrics.registry.incr('api_bytes_received', len(response.content), method=method)
+            if response.status_code == 429:
+                metrics.registry.incr('api_throttled', method=method)
+            retry = response.status_code == 429 or (retry_errors and response.status_code >= 500)
+            if attempt == self.max_retries or not retry:
+                return response
+            metrics.registry.incr('api_retries', method=method)
+            if kwargs.get('stream'):
+                response.close()
+            delay = float(response.headers.get('Retry-After') or 2 ** attempt)
+            self.logger.debug("Got HTTP %s from %s; retrying in %s seconds", response.status_code, url.split('?')[0], delay)
+            time.sleep(delay)
+
+    @profiling.in_phase('listing')
     def get_emojis(self):
         url = self.url + "emoji.list?token={}".format(self.token)
-        payload = requests.get(url).json()
+        payload = self.api_get(url)
         return payload
 
     def get_user(self, uid):
         url = self.url + "users.info?token={}&user={}".format(self.token, uid)
-        payload = requests.get(url).json()
+        payload = self.api_get(url)
         return payload
 
+    def get_user_name(self, uid):
+        """
+        return the name of user `uid`, looking up (and remembering) users who
+        joined since the user list was fetched; returns `uid` if there's no such user
+        """
+        name = self.users_by_id.get(uid)
+        if name is None:
+            payload = self.get_user(uid)
+            if not payload.get('ok'):
+                self.logger.debug("Couldn't look up user %s: %s", uid, payload)
+                return uid
+            name = payload['user']['name']
+            self.users_by_id[uid] = name
+            self.users_by_name[name] = uid
+        return name
+
+    def expire_directories(self, max_age):
+        """Forget the user and channel directories fetched over `max_age` seconds ago, so they're fetched again when next used."""
+        now = time.time()
+        for kind, attributes in (('users', Slacker.user_attributes), ('channels', Slacker.channel_attributes)):
+            fetched = self.directories_fetched.get(kind)
+            if fetched is not None and now - fetched >= max_age:
+                for attribute in attributes:
+                    self.__dict__.pop(attribute, None)
+                del self.directories_fetched[kind]
+
     def get_users(self):
         users = self.get_all_user_objects()
+        self.directories_fetched['users'] = time.time()
         self.users_by_id = {x['id']: x['name'] for x in users}
         self.users_by_name = {x['name']: x['id'] for x in users}
         self.restricted_users = [x['id'] for x in users if x.get('is_restricted')]
@@ -58,30 +228,60 @@ class Slacker(object):
             if fail_silently:
                 return "#{}".format(channel_name)
 
-    def get_messages_in_time_range(self, oldest, cid, latest=None):
+    @profiling.in_phase('history fetch')
+    def get_messages_in_time_range(self, oldest, cid, latest=None, keep=None):
+        """
+        return the messages in channel `cid` between `oldest` and `latest` (default: now), oldest first
+        if `keep` is given, only messages for which keep(message) is true are kept, as each page arrives
+        with slack_api: conversations, pages are as large as Slack allows and follow Slack's cursor
+        """
         assert cid in self.channels_by_id, "Unknown channel ID {}".format(cid)
         cname = self.channels_by_id[cid]
         messages = []
+        latest = latest or int(time.time())
+        cursor = None
         done = False
         while not done:
-            murl = self.url + "channels.history?oldest={}&token={}&channel={}".format(oldest, self.token, cid)
-            if latest:
-                murl += "&latest={}".format(latest)
-            else:
-                murl += "&latest={}".format(int(time.time()))
-            payload = requests.get(murl).json()
-            messages += payload['messages']
-            if payload['has_more'] is False:
+            murl = self.url + "{}?oldest={}&token={}&channel={}&latest={}".format(
+                self.channel_method('history'), oldest, self.token, cid, latest)
+            if self.api == 'conversations':
+                murl += "&limit={}".format(self.max_page_size)
+                if cursor:
+                    murl += "&cursor={}".format(cursor)
+            page, payload = self.api_get_items(murl, 'messages')
+            page_oldest = None
+            for message in page:
+                ts = float(message['ts'])
+                page_oldest = ts if page_oldest is None else min(page_oldest, ts)
+                if keep is None or keep(message):
+                    messages.append(message)
+            if self.api == 'conversations':
+                cursor = payload.get('response_metadata', {}).get('next_cursor')
+                done = not (payload.get('has_more') and cursor)
+            elif payload.get('has_more') is False or page_oldest is None:
                 done = True
-                continue
-            ts = [float(x['ts']) for x in messages]
-            earliest = min(ts)
-            latest = earliest
+            else:
+                # pages come newest first, so the next one ends where this one started
+                latest = page_oldest
         messages.sort(key=lambda x: float(x['ts']))
         for message in messages:
             message['channel'] = cname
         return messages
 
+    @profiling.in_phase('history fetch')
+    def get_message(self, cid, ts):
+        """Return the message in channel `cid` with timestamp `ts`, or None if it can't be found."""
+        url_template = self.url + "{}?token={}&channel={}&latest={}&oldest={}&inclusive=1&{}=1"
+        url = url_template.format(self.channel_method('history'), self.token, cid, ts, ts,
+                                  'limit' if self.api == 'conversations' else 'count')
+        payload = self.api_get(url)
+        messages = payload.get('messages') or []
+        if not messages:
+            return None
+        message = messages[0]
+        message['channel'] = self.channels_by_id.get(cid, cid)
+        return message
+
     def replace_id(self, cid):
         """
         Assuming either a #channelid or @personid, replace them with #channelname or @username
@@ -98,9 +298,9 @@ class Slacker(object):
             #  lookup user by userid in users_by_id
             if "|" in stripped:
                 uname_parts = stripped.split("|")
-                uname = self.users_by_id[uname_parts[0]]
+                uname = self.get_user_name(uname_parts[0])
             else:
-                uname = self.users_by_id[stripped]
+                uname = self.get_user_name(stripped)
             if uname:
                 return "@" + uname
         return cid
@@ -124,13 +324,21 @@ class Slacker(object):
         if exclude_archived (default: True), only shows non-archived channels
         """
         channels = self.get_all_channel_objects(exclude_archived=exclude_archived)
+        self.directories_fetched['channels'] = time.time()
         self.channels_by_id = {x['id']: x['name'] for x in channels}
         self.channels_by_name = {x['name']: x['id'] for x in channels}
         self.channels = self.channels_by_name
+        # how many members each channel had when listed, if Slack said
+        self.channel_member_counts = {x['id']: x.get('num_members') for x in channels}
+        self.private_channel_ids = set(x['id'] for x in channels if x.get('is_private'))
 
     def get_channelid(self, channel_name):
         return self.channels_by_name.get(channel_name)
 
+    def is_private(self, channel_name):
+        """Return True if `channel_name` is a private channel (only listed with include_private_channels)."""
+        return self.get_channelid(channel_name) in self.private_channel_ids
+
     def channel_exists(self, channel_name):
         try:
             # strip leading "#" if it exists, as Slack returns all channels without them
@@ -142,10 +350,11 @@ class Slacker(object):
         except KeyError:  # channel not found
             return None
 
+    @profiling.in_phase('posting')
     def delete_message(self, cid, message_timestamp):
         url_template = self.url + "chat.delete?token={}&channel={}&ts={}"
         url = url_template.format(self.token, cid, message_timestamp)
-        ret = requests.get(url).json()
+        ret = self.api_get(url, retry_errors=False)
         if not ret['ok']:
             self.logger.error("Failed to delete message; error: %s", ret)
         return ret['ok']
@@ -154,34 +363,73 @@ class Slacker(object):
         """
         returns an array of member IDs for channel_name
         """
-        return self.get_channel_info(channel_name)['members']
+        return list(self.iter_channel_member_ids(channel_name))
 
-    def channel_has_only_restricted_members(self, channel_name):
+    @profiling.in_phase('listing')
+    def iter_channel_member_ids(self, channel_name, page_size=None):
         """
-        returns True if the channel only has restricted/ultra_restricted
-        members, False otherwise
+        yield the member IDs of channel_name one at a time; with slack_api: conversations they're
+        fetched from conversations.members, `page_size` per request (default: as many as Slack allows),
+        otherwise all at once from channels.info, which needs no more than the legacy scopes
         """
+        if self.api != 'conversations':
+            for mid in self.get_channel_info(channel_name).get('members', []):
+                yield mid
+            return
+        page_size = page_size or self.max_page_size
+        url_template = self.url + "conversations.members?token={}&channel={}&limit={}"
+        url = url_template.format(self.token, self.get_channelid(channel_name), page_size)
+        cursor = None
+        while True:
+            payload = self.api_get(url + ("&cursor={}".format(cursor) if cursor else ""))
+            if payload['ok'] is not True:
+                m = "Attempted to get members of {}, but return was {}"
+                raise RuntimeError(m.format(channel_name, payload))
+            for mid in payload['members']:
+                yield mid
+            cursor = payload.get('response_metadata', {}).get('next_cursor')
+            if not cursor:
+                break
 
-        mids = set(self.get_channel_members_ids(channel_name))
-        self.logger.debug("Current members in %s are %s", channel_name, mids)
-        return mids.intersection(self.all_restricted_users)
+    def channel_has_only_restricted_members(self, channel_name):
+        """
+        returns True if the channel has members and they are all
+        restricted/ultra_restricted, False otherwise
+
+        A channel listed with more members than there are restricted users
+        is answered without a request; otherwise members are fetched a page
+        at a time until the first unrestricted one.
+        """
+        num_members = self.channel_member_counts.get(self.get_channelid(channel_name))
+        if num_members is not None and num_members > len(self.all_restricted_users):
+            metrics.registry.incr('restricted_member_checks', path='member_count')
+            return False
+        metrics.registry.incr('restricted_member_checks', path='members')
+        has_members = False
+        for mid in self.iter_channel_member_ids(channel_name):
+            if mid not in self.all_restricted_users:
+                self.logger.debug("%s has unrestricted member %s", channel_name, mid)
+                return False
+            has_members = True
+        return has_members
 
     def get_channel_member_names(self, channel_name):
         """
-        returns an array of ["@member"] for members of the channel
+        yields "@member" for each member of the channel, fetching members a page at a time
         """
-        members = self.get_channel_members_ids(channel_name)
-        return ["@" + self.users_by_id[x] for x in members]
+        for mid in self.iter_channel_member_ids(channel_name):
+            yield "@" + self.get_user_name(mid)
 
+    @profiling.in_phase('listing')
     def get_channel_info(self, channel_name):
         """
         returns JSON with channel information.  Adds 'age' in seconds to JSON
         """
-        url_template = self.url + "channels.info?token={}&channel={}"
+        url_template = self.url + "{}?token={}&channel={}"
         cid = self.get_channelid(channel_name)
         now = int(time.time())
-        url = url_template.format(self.token, cid)
-        ret = requests.get(url).json()
+        url = url_template.format(self.channel_method('info'), self.token, cid)
+        ret = self.api_get(url)
         if ret['ok'] is not True:
             m = "Attempted to get channel info for {}, but return was {}"
             m = m.format(channel_name, ret)
@@ -191,35 +439,55 @@ class Slacker(object):
         ret['channel']['age'] = age
         return ret['channel']
 
+    @profiling.in_phase('listing')
     def get_all_channel_objects(self, exclude_archived=True):
         """
         return all channels
         if exclude_archived (default: True), only shows non-archived channels
         """
+        return list(self.iter_channel_objects(exclude_archived=exclude_archived))
 
-        url_template = self.url + "channels.list?exclude_archived={}&token={}"
+    def iter_channel_objects(self, exclude_archived=True, page_size=None):
+        """
+        yield channels one at a time, fetching `page_size` channels per request
+        (default: 200, or as many as Slack allows with slack_api: conversations)
+        if exclude_archived (default: True), only shows non-archived channels
+        with include_private_channels, private channels are listed too
+        """
+        url_template = self.url + self.channel_method('list') + "?exclude_archived={}&token={}&limit={}"
         if exclude_archived:
             exclude_archived = 1
         else:
             exclude_archived = 0
-        url = url_template.format(exclude_archived, self.token)
-        request = requests.get(url)
-        payload = request.json()
-        assert 'channels' in payload
-        return payload['channels']
-
+        if self.api == 'conversations':
+            page_size = page_size or self.max_page_size
+            url_template += "&types=" + ("public_channel,private_channel" if self.include_private else "public_channel")
+        cursor = None
+        while True:
+            url = url_template.format(exclude_archived, self.token, page_size or 200)
+            if cursor:
+                url += "&cursor={}".format(cursor)
+            channels, payload = self.api_get_items(url, 'channels')
+            for channel in channels:
+                yield channel
+            cursor = payload.get('response_metadata', {}).get('next_cursor')
+            if not cursor:
+                break
+
+    @profiling.in_phase('listing')
     def get_all_user_objects(self):
         url = self.url + "users.list?token=" + self.token
-        return requests.get(url).json()['members']
+        return self.api_get(url)['members']
 
+    @profiling.in_phase('posting')
     def archive(self, channel_name):
-        url_template = self.url + "channels.archive?token={}&channel={}"
+        url_template = self.url + "{}?token={}&channel={}"
         cid = self.get_channelid(channel_name)
-        url = url_template.format(self.token, cid)
-        request = requests.get(url)
-        payload = request.json()
+        url = url_template.format(self.channel_method('archive'), self.token, cid)
+        payload = self.api_get(url, retry_errors=False)
         return payload
 
+    @profiling.in_phase('posting')
     def post_message(self, channel, message, message_type=None):
         """
         Posts a `message` into a `channel`.
@@ -247,7 +515,6 @@ class Slacker(object):
                 post_data['icon_url'] = bot_avatar_url
 
         if message_type:
-            post_data['attachments'] = json.dumps([{'fallback': message_type}], encoding='utf-8')
+            post_data['attachments'] = json.dumps([{'fallback': message_type}])
 
-        p = requests.post(self.url + "chat.postMessage", data=post_data)
-        return p.json()
+        return self.api_post(self.url + "chat.postMessage", data=post_data)
@@ -0,0 +1,233 @@
+#! /usr/bin/env python
+"""
+Export everything a run reads from Slack into a gzipped JSONL snapshot, and run the
+warner, archiver, announcer, flagger or planner against a snapshot with no network.
+
+    python snapshot.py export workspace.jsonl.gz
+    python snapshot.py run workspace.jsonl.gz warn
+
+A snapshot run sees the workspace as it was when the snapshot was taken, keeps its
+state in memory and only records what it would have posted or archived.
+"""
+
+import argparse
+import gzip
+import io
+import json
+import logging
+import time
+
+import config
+import slackbot
+import slacker
+import state
+
+
+VERSION = 1
+
+
+def write_record(fo, record):
+    fo.write(json.dumps(record, separators=(',', ':')) + "\n")
+
+
+def export(live, fname, days=None, logger=None):
+    """
+    Write a snapshot of the workspace `live` (a Slacker) reads to `fname`: users, emoji,
+    channels with their info, `days` (default: the archive threshold) of history for each
+    channel and the whole history of the control channel.
+    """
+    logger = logger or logging.getLogger(__name__)
+    cfg = config.Config()
+    now = int(time.time())
+    days = days or cfg.archive_threshold
+    oldest = now - days * 86400
+    with io.TextIOWrapper(gzip.open(fname, "wb"), encoding="utf-8") as fo:
+        write_record(fo, {'type': 'meta', 'version': VERSION, 'taken_at': now, 'slack_name': live.slack_name})
+        for user in live.get_all_user_objects():
+            write_record(fo, {'type': 'user', 'user': user})
+        write_record(fo, {'type': 'emoji', 'emoji': live.get_emojis().get('emoji', {})})
+        channels = list(live.iter_channel_objects())
+        live.channels_by_id = {x['id']: x['name'] for x in channels}
+        live.channels_by_name = {x['name']: x['id'] for x in channels}
+        live.channels = live.channels_by_name
+        live.private_channel_ids = set(x['id'] for x in channels if x.get('is_private'))
+        for channel in channels:
+            info = live.get_channel_info(channel['name'])
+            info.pop('age', None)
+            if 'members' not in info:
+                # conversations.info doesn't list members
+                info['members'] = list(live.iter_channel_member_ids(channel['name']))
+            write_record(fo, {'type': 'channel', 'channel': info})
+            since = 0 if channel['name'] == cfg.control_channel else oldest
+            messages = live.get_messages_in_time_range(since, channel['id'], now)
+            write_record(fo, {'type': 'history', 'channel': channel['id'], 'oldest': since, 'latest': now,
+                              'messages': [dict((k, v) for k, v in m.items() if k != 'channel') for m in messages]})
+        logger.info("Wrote a snapshot of %s channels to %s", len(channels), fname)
+
+
+class Snapshot(object):
+    """The contents of a snapshot file."""
+
+    def __init__(self, fname):
+        self.users = []
+        self.emoji = {}
+        self.channels = []
+        self.history = {}
+        self.windows = {}
+        with io.TextIOWrapper(gzip.open(fname, "rb"), encoding="utf-8") as fo:
+            for line in fo:
+                record = json.loads(line)
+                kind = record['type']
+                if kind == 'meta':
+                    assert record['version'] == VERSION, "Unsupported snapshot version {}".format(record['version'])
+                    self.taken_at = record['taken_at']
+                    self.slack_name = record['slack_name']
+                elif kind == 'user':
+                    self.users.append(record['user'])
+                elif kind == 'emoji':
+                    self.emoji = record['emoji']
+                elif kind == 'channel':
+                    self.channels.append(record['channel'])
+                elif kind == 'history':
+                    self.history[record['channel']] = sorted(record['messages'], key=lambda x: float(x['ts']))
+                    self.windows[record['channel']] = (record['oldest'], record['latest'])
+        self.channels_by_id = dict((x['id'], x) for x in self.channels)
+
+
+class SnapshotSlacker(slacker.Slacker):
+    """
+    A Slacker answering from a Snapshot instead of the Slack API.
+    Posts, deletions and archivals are recorded in `self.actions` rather than made.
+    """
+
+    def __init__(self, snapshot, logger=None):
+        self.snapshot = snapshot
+        self.now = snapshot.taken_at
+        self.actions = []
+        super(SnapshotSlacker, self).__init__(snapshot.slack_name, token="snapshot", logger=logger, api_url="snapshot:")
+
+    def request(self, send, url, **kwargs):
+        raise RuntimeError("A snapshot run can't call the Slack API ({})".format(url))
+
+    def get_emojis(self):
+        return {'ok': True, 'emoji': self.snapshot.emoji}
+
+    def get_user(self, uid):
+        for user in self.snapshot.users:
+            if user['id'] == uid:
+                return {'ok': True, 'user': user}
+        return {'ok': False, 'error': 'user_not_found'}
+
+    def get_all_user_objects(self):
+        return self.snapshot.users
+
+    def iter_channel_objects(self, exclude_archived=True, page_size=None):
+        for channel in self.snapshot.channels:
+            if not (exclude_archived and channel.get('is_archived')):
+                yield dict((k, v) for k, v in channel.items() if k != 'members')
+
+    def get_channel_info(self, channel_name):
+        channel = dict(self.snapshot.channels_by_id[self.get_channelid(channel_name)])
+        channel['age'] = self.now - channel['created']
+        return channel
+
+    def get_messages_in_time_range(self, oldest, cid, latest=None, keep=None):
+        assert cid in self.channels_by_id, "Unknown channel ID {}".format(cid)
+        window_oldest = self.snapshot.windows.get(cid, (0, 0))[0]
+        if float(oldest) < window_oldest:
+            self.logger.warning("Snapshot only has history of #%s back to %s, not %s",
+                                self.channels_by_id[cid], window_oldest, oldest)
+        latest = float(latest or self.now)
+        messages = [dict(m) for m in self.snapshot.history.get(cid, [])
+                    if float(oldest) < float(m['ts']) < latest and (keep is None or keep(m))]
+        for message in messages:
+            message['channel'] = self.channels_by_id[cid]
+        return messages
+
+    def iter_channel_member_ids(self, channel_name, page_size=None):
+        return iter(self.snapshot.channels_by_id[self.get_channelid(channel_name)].get('members', []))
+
+    def get_message(self, cid, ts):
+        for message in self.snapshot.history.get(cid, []):
+            if message['ts'] == ts:
+                return dict(message, channel=self.channels_by_id.get(cid, cid))
+        return None
+
+    def delete_message(self, cid, message_timestamp):
+        self.actions.append({'action': 'delete', 'channel': cid, 'ts': message_timestamp})
+        return True
+
+    def archive(self, channel_name):
+        self.actions.append({'action': 'archive', 'channel': channel_name})
+        return {'ok': True}
+
+    def post_message(self, channel, message, message_type=None):
+        self.actions.append({'action': 'post', 'channel': channel.lstrip('#'), 'text': message, 'type': message_type})
+        return {'ok': True}
+
+
+class SnapshotSlackbot(slackbot.Slackbot):
+    """A Slackbot recording what it would have said in `self.actions`."""
+
+    def __init__(self, actions):
+        super(SnapshotSlackbot, self).__init__("snapshot", token="snapshot", url="snapshot:")
+        self.actions = actions
+
+    def say(self, channel, statement):
+        self.actions.append({'action': 'say', 'channel': channel.lstrip('#'), 'text': statement})
+        return 200
+
+
+def make_executor(job, snap, logger=None):
+    """Return the executor for `job` ('warn', 'archive', 'announce', 'flag' or 'plan') wired up to `snap`."""
+    import announcer
+    import archiver
+    import flagger
+    import planner
+    import warner
+    classes = {'warn': warner.Warner, 'archive': archiver.Archiver, 'announce': announcer.Announcer,
+               'flag': flagger.Flagger, 'plan': planner.Planner}
+    snapshot_slacker = SnapshotSlacker(snap, logger=logger)
+    ex = classes[job](slacker_injected=snapshot_slacker, slackbot_injected=SnapshotSlackbot(snapshot_slacker.actions),
+                      state_injected=state.State())
+    # nothing leaves the process, so act as if activated to record everything the job would do
+    ex.destalinator_activated = ex.ds.destalinator_activated = True
+    # evaluate the workspace as it was when the snapshot was taken
+    ex.ds.now = snap.taken_at
+    if hasattr(ex, 'now'):
+        ex.now = snap.taken_at
+    return ex
+
+
+def run(job, snap, logger=None):
+    """Run `job` against Snapshot `snap`; return the executor and what it would have done."""
+    ex = make_executor(job, snap, logger=logger)
+    result = {'warn': lambda: ex.warn(), 'archive': lambda: ex.archive(), 'announce': lambda: ex.announce(),
+              'flag': lambda: ex.flag(), 'plan': lambda: ex.plan()}[job]()
+    return ex, result, ex.slacker.actions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Export a workspace snapshot, or run a job against one offline.')
+    subparsers = parser.add_subparsers(dest="command")
+    export_parser = subparsers.add_parser("export", help="snapshot the workspace")
+    export_parser.add_argument("fname", help="file to write (gzipped JSONL)")
+    export_parser.add_argument("--days", type=int, default=None, help="days of history (default: archive_threshold)")
+    run_parser = subparsers.add_parser("run", help="run a job against a snapshot")
+    run_parser.add_argument("fname", help="snapshot file")
+    run_parser.add_argument("job", choices=["warn", "archive", "announce", "flag", "plan"])
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.command == "export":
+        import executor
+        export(executor.Executor().slacker, args.fname, days=args.days)
+    elif args.command == "run":
+        ex, result, actions = run(args.job, Snapshot(args.fname))
+        if args.job == "plan":
+            print(json.dumps(result, indent=4, sort_keys=True))
+        for action in actions:
+            print(json.dumps(action, sort_keys=True))
+        ex.emit_report()
+    else:
+        parser.print_help()
@@ -0,0 +1,149 @@
+#! /usr/bin/env python
+
+import contextlib
+import copy
+import json
+import logging
+import os
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    # not on Windows, where saves from different processes aren't serialised
+    fcntl = None
+
+
+def merge(target, base, data):
+    """
+    Apply to dict `target` the changes made to dict `base` that turned it into `data`,
+    recursing into nested dicts so changes to different keys of one entry both survive.
+    """
+    for key in base:
+        if key not in data:
+            target.pop(key, None)
+    for key, value in data.items():
+        old = base.get(key)
+        if key in base and old == value:
+            continue
+        if isinstance(value, dict) and isinstance(old, dict) and isinstance(target.get(key), dict):
+            merge(target[key], old, value)
+        else:
+            target[key] = value
+
+
+def replace(target, source):
+    """Make dict `target` equal to `source` in place, keeping the nested dicts others hold references to."""
+    for key in [k for k in target if k not in source]:
+        del target[key]
+    for key, value in source.items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            replace(target[key], value)
+        else:
+            target[key] = value
+
+
+class State(object):
+    """
+    A small JSON-file-backed store for data that should survive between runs.
+
+    Data is kept in named sections (plain dicts).  If no `fname` is given the
+    store lives in memory only and `save()` is a no-op.  One store may be shared
+    by jobs running in different threads, which change sections only while
+    holding `lock`.
+
+    Several processes (such as the ingester and the scheduled jobs) may share a
+    file: `save()` re-reads it under a lock and writes back what the others saved
+    merged with what this store changed since it last read the file.
+    """
+
+    def __init__(self, fname=None, logger=None):
+        self.fname = fname
+        self.logger = logger or logging.getLogger(__name__)
+        self.data = {}
+        self.lock = threading.RLock()
+        # what the file held when this store last read or wrote it; this store's changes are what differs
+        self.base = {}
+        if self.fname and os.path.exists(self.fname):
+            self.load()
+
+    @contextlib.contextmanager
+    def file_lock(self):
+        """Keep other processes from saving the file while this one reads and rewrites it."""
+        if fcntl is None:
+            yield
+            return
+        with open(self.fname + ".lock", "a") as fo:
+            fcntl.flock(fo.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fo.fileno(), fcntl.LOCK_UN)
+
+    def read(self):
+        """Return what the file holds now."""
+        if not os.path.exists(self.fname):
+            return {}
+        try:
+            with open(self.fname, "r") as fo:
+                return json.load(fo)
+        except ValueError:
+            self.logger.warning("Ignoring unreadable state file %s", self.fname)
+            return {}
+
+    def load(self):
+        with self.lock, self.file_lock():
+            self.base = self.read()
+            replace(self.data, copy.deepcopy(self.base))
+
+    def refresh(self):
+        """
+        Pick up what other processes (such as the ingester) have saved since this store last
+        read or wrote the file, keeping this store's unsaved changes; return True if there was
+        anything new. Comparing the contents rather than the file's mtime, which may not change
+        between two writes within its resolution, means no write is missed.
+        """
+        if not self.fname:
+            return False
+        with self.lock, self.file_lock():
+            disk = self.read()
+            if disk == self.base:
+                return False
+            merged = copy.deepcopy(disk)
+            merge(merged, self.base, self.data)
+            self.base = disk
+            replace(self.data, merged)
+            return True
+
+    def section(self, name):
+        """Return the dict for section `name`, creating it if needed."""
+        with self.lock:
+            return self.data.setdefault(name, {})
+
+    def save(self):
+        """
+        Merge this store's changes into the file (atomically, under a lock), if it is backed by
+        a file, and pick up what other processes have saved since this store last read it.
+        """
+        if not self.fname:
+            return
+        with self.lock, self.file_lock():
+            merged = self.read()
+            merge(merged, self.base, self.data)
+            blob = json.dumps(merged, separators=(',', ':'))
+            tmp_fname = self.fname + ".tmp"
+            with open(tmp_fname, "w") as fo:
+                fo.write(blob)
+            os.rename(tmp_fname, self.fname)
+            self.base = json.loads(blob)
+            replace(self.data, json.loads(blob))
+
+
+def filename(config):
+    """Return the state file named in the environment or `config`, if any."""
+    return os.getenv(config.get('state_file_env_varname') or '') or config.get('state_file')
+
+
+def from_config(config, logger=None):
+    """Return a State backed by the file named in the environment or `config`, if any."""
+    return State(filename(config), logger=logger)
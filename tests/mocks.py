@@ -6,15 +6,16 @@ import slacker
 
 
 def mocked_slackbot_object():
-    obj = mock.MagicMock(wraps=slackbot.Slackbot(config.SLACK_NAME, token='token'))
+    obj = mock.MagicMock(wraps=slackbot.Slackbot(config.slack_name(), token='token'))
     obj.say = mock.MagicMock(return_value=True)
     return obj
 
 
 def mocked_slacker_object(channels_list=None, users_list=None, messages_list=None, emoji_list=None):
-    slacker_obj = slacker.Slacker(config.SLACK_NAME, token='token', init=False)
+    slacker_obj = slacker.Slacker(config.slack_name(), token='token', init=False)
 
     slacker_obj.get_all_channel_objects = mock.MagicMock(return_value=channels_list or [])
+    slacker_obj.iter_channel_objects = mock.MagicMock(side_effect=lambda **kwargs: iter(channels_list or []))
     slacker_obj.get_channels()
 
     slacker_obj.get_all_user_objects = mock.MagicMock(return_value=users_list or [])
@@ -0,0 +1,31 @@
+import unittest
+
+import activity
+
+
+class ActivityRuleTestCase(unittest.TestCase):
+    def setUp(self):
+        self.rule = activity.ActivityRule(['bot_message'], ['USLACKBOT'], [':dolphin:', ':skip:'])
+
+    def test_counts_human_and_included_messages(self):
+        self.assertTrue(self.rule({"user": "U1", "text": "Hi"}))
+        self.assertTrue(self.rule({"subtype": "bot_message", "text": "Hi"}))
+        self.assertFalse(self.rule({"subtype": "channel_join", "user": "U1", "text": "joined"}))
+
+    def test_ignores_users_and_markers(self):
+        self.assertFalse(self.rule({"user": "USLACKBOT", "text": "Hi"}))
+        self.assertFalse(self.rule({"user": "U1", "text": "keep this :skip: please"}))
+        self.assertFalse(self.rule({"user": "U1", "text": ""}))
+
+    def test_markers_are_matched_literally(self):
+        rule = activity.ActivityRule([], [], ['(skip)', 'a.b', ''])
+        self.assertFalse(rule({"user": "U1", "text": "please (skip) this"}))
+        self.assertTrue(rule({"user": "U1", "text": "skip axb"}))
+        self.assertFalse(rule({"user": "U1", "text": "ushers a.b"}))
+
+    def test_no_markers(self):
+        rule = activity.ActivityRule([], [], [])
+        self.assertTrue(rule({"user": "U1", "text": ":dolphin:"}))
+
+    def test_attachments_count_despite_markers(self):
+        self.assertTrue(self.rule({"user": "U1", "text": ":dolphin:", "attachments": [{"fallback": "x"}]}))
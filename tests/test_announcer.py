@@ -29,3 +29,66 @@ class AnnouncerAnnounceTest(unittest.TestCase):
                     mock.call(self.announcer.config.announce_channel, MockValidator(channel_message_test(channel))),
                     self.slackbot.say.mock_calls
                 )
+
+    def test_announce_uses_channels_recorded_by_ingester(self):
+        now = int(time.time())
+        self.announcer.state.section('ingestion').update({'started': now - 2 * 86400, 'seen': now})
+        self.announcer.state.section('new_channels')['C0999999'] = {
+            'id': 'C0999999', 'name': 'mensheviks', 'created': now - 60, 'creator': 'U012742', 'purpose': {'value': ''}
+        }
+        self.announcer.slacker.iter_channel_objects.reset_mock()
+        self.announcer.announce()
+        self.assertFalse(self.announcer.slacker.iter_channel_objects.called)
+        self.assertIn(
+            mock.call(self.announcer.config.announce_channel, MockValidator(lambda message: 'mensheviks' in message)),
+            self.slackbot.say.mock_calls
+        )
+
+    def test_announce_records_high_water_mark(self):
+        self.announcer.announce()
+        newest = max(channel['created'] for channel in fixtures.channels)
+        self.assertEqual(self.announcer.state.section('announcer')['high_water_mark'], newest)
+
+    def test_announce_skips_already_announced_channels(self):
+        self.announcer.announce()
+        calls = len(self.slackbot.say.mock_calls)
+        self.announcer.announce()
+        self.assertEqual(len(self.slackbot.say.mock_calls), calls)
+
+    def test_announce_catches_up_after_missed_run(self):
+        now = int(time.time())
+        self.announcer.state.section('announcer')['high_water_mark'] = now - 86400 * 45
+        self.assertIn('leninists', [name for name, creator, purpose in self.announcer.get_new_channels()])
+
+    def test_announce_caps_backlog_per_run(self):
+        now = int(time.time())
+        backlog = [{'id': 'C09{:05d}'.format(i), 'name': 'channel{}'.format(i), 'created': now - 3600 + i,
+                    'creator': 'U012742', 'purpose': {'value': ''}} for i in range(30)]
+        self.announcer.slacker.iter_channel_objects.side_effect = lambda **kwargs: iter(backlog)
+        self.announcer.announce()
+        self.assertEqual(len(self.slackbot.say.mock_calls), 20)
+        self.announcer.announce()
+        self.assertEqual(len(self.slackbot.say.mock_calls), 30)
+
+    def test_announce_skips_private_channels(self):
+        now = int(time.time())
+        self.announcer.slacker.iter_channel_objects.side_effect = lambda **kwargs: iter([
+            {'id': 'G0999999', 'name': 'okhrana', 'created': now - 60, 'creator': 'U012742',
+             'purpose': {'value': ''}, 'is_private': True}])
+        self.announcer.announce()
+        self.assertFalse(self.slackbot.say.called)
+
+    def test_run_that_fails_partway_does_not_announce_again(self):
+        now = int(time.time())
+        backlog = [{'id': 'C09{:05d}'.format(i), 'name': 'channel{}'.format(i), 'created': now - 3600 + i // 2,
+                    'creator': 'U012742', 'purpose': {'value': ''}} for i in range(6)]
+        self.announcer.slacker.iter_channel_objects.side_effect = lambda **kwargs: iter(backlog)
+        self.slackbot.say.side_effect = [None, None, None, RuntimeError("dyno restarted")]
+        self.assertRaises(RuntimeError, self.announcer.announce)
+        # channel3 was created in the same second as channel2, so channel2 waits to be announced with it
+        self.assertEqual(self.announcer.state.section('announcer')['high_water_mark'], backlog[1]['created'])
+        self.slackbot.say.reset_mock()
+        self.slackbot.say.side_effect = None
+        self.announcer.announce()
+        self.assertEqual(len(self.slackbot.say.mock_calls), 4)
+        self.assertIn('channel2', self.slackbot.say.mock_calls[0][1][1])
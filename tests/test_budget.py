@@ -0,0 +1,40 @@
+import unittest
+
+import mock
+
+import budget
+import metrics
+
+
+class BudgetTestCase(unittest.TestCase):
+    def setUp(self):
+        metrics.registry.reset()
+
+    def test_api_calls(self):
+        metrics.registry.incr('api_calls', 5, method='users.list')
+        run_budget = budget.Budget(api_calls=3)
+        metrics.registry.incr('api_calls', 2, method='channels.history')
+        self.assertFalse(run_budget.exhausted())
+        metrics.registry.incr('api_calls', method='channels.info')
+        self.assertTrue(run_budget.exhausted())
+
+    def test_seconds(self):
+        with mock.patch('budget.time.time', return_value=1000.0):
+            run_budget = budget.Budget(seconds=60)
+        with mock.patch('budget.time.time', return_value=1059.0):
+            self.assertFalse(run_budget.exhausted())
+        with mock.patch('budget.time.time', return_value=1060.0):
+            self.assertTrue(run_budget.exhausted())
+
+    def test_from_config(self):
+        self.assertIsNone(budget.from_config({}))
+        self.assertEqual(budget.from_config({'budget_seconds': 30}).seconds, 30)
+
+    def test_only_counts_calls_for_its_workspace(self):
+        with metrics.registry.labelled(workspace='bolsheviks'):
+            run_budget = budget.Budget(api_calls=2)
+            metrics.registry.incr('api_calls', method='channels.history')
+        with metrics.registry.labelled(workspace='mensheviks'):
+            metrics.registry.incr('api_calls', 5, method='channels.history')
+        self.assertEqual(run_budget.used_api_calls(), 1)
+        self.assertFalse(run_budget.exhausted())
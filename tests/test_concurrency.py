@@ -0,0 +1,85 @@
+import threading
+import time
+import unittest
+
+import mock
+
+import concurrency
+import metrics
+import slacker
+
+
+class AdaptiveLimiterTestCase(unittest.TestCase):
+    def setUp(self):
+        self.limiter = concurrency.AdaptiveLimiter(initial=8, minimum=1, maximum=10, latency_target=1.0)
+
+    def test_grows_additively_on_fast_responses(self):
+        for _ in range(8):
+            self.limiter.record(200, 0.1)
+        self.assertTrue(8.9 < self.limiter.limit < 9.1)
+        for _ in range(100):
+            self.limiter.record(200, 0.1)
+        self.assertEqual(self.limiter.limit, 10)
+
+    def test_halves_when_throttled(self):
+        self.limiter.record(429, 0.1)
+        self.assertEqual(self.limiter.limit, 4)
+        self.assertEqual(self.limiter.throttled, 1)
+        for _ in range(5):
+            self.limiter.record(429, 0.1)
+        self.assertEqual(self.limiter.limit, 1)
+
+    def test_shrinks_when_slow(self):
+        self.limiter.record(200, 1.5)
+        self.assertAlmostEqual(self.limiter.limit, 7.2)
+
+    def test_slot_waits_for_a_free_slot(self):
+        limiter = concurrency.AdaptiveLimiter(initial=1)
+        entered = []
+        with limiter.slot():
+            thread = threading.Thread(target=lambda: limiter.slot().__enter__() or entered.append(True))
+            thread.start()
+            time.sleep(0.05)
+            self.assertEqual(entered, [])
+        thread.join(1)
+        self.assertEqual(entered, [True])
+
+
+class SlackerConcurrencyTestCase(unittest.TestCase):
+    def setUp(self):
+        metrics.registry.reset()
+        self.slacker = slacker.Slacker("testing", token="token")
+
+    @mock.patch('slacker.time.sleep')
+    def test_throttling_lowers_the_method_limit(self, sleep):
+        throttled = mock.Mock(status_code=429, content=b"", headers={'Retry-After': '1'})
+        ok = mock.Mock(status_code=200, content=b"{}", headers={})
+        send = mock.Mock(side_effect=[throttled, ok])
+        self.slacker.request(send, self.slacker.url + "users.list?token=token")
+        self.assertEqual(self.slacker.concurrency.limits(), {'users.list': 2.0})
+        self.assertEqual(metrics.registry.gauge('api_concurrency_limit', method='users.list'), 2.0)
+        self.assertEqual(metrics.registry.counter('api_throttled', method='users.list'), 1)
+
+    def test_limit_holds_back_concurrent_requests(self):
+        in_flight = []
+        peak = []
+        lock = threading.Lock()
+
+        def send(url):
+            with lock:
+                in_flight.append(url)
+                peak.append(len(in_flight))
+            time.sleep(0.05)
+            with lock:
+                in_flight.remove(url)
+            return mock.Mock(status_code=200, content=b"{}", headers={})
+
+        url = self.slacker.url + "channels.history?token=token"
+        threads = [threading.Thread(target=self.slacker.request, args=(send, url)) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(len(peak), 4)
+        self.assertEqual(peak[0], 1)
+        self.assertLessEqual(max(peak), 2)
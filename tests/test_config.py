@@ -0,0 +1,38 @@
+import os
+import unittest
+
+import mock
+
+import config
+
+
+class ConfigTestCase(unittest.TestCase):
+    def test_parses_file_once(self):
+        config.Config()
+        with mock.patch('config.yaml.load') as load:
+            first = config.Config()
+            second = config.Config()
+        self.assertFalse(load.called)
+        self.assertEqual(first.warn_threshold, second.warn_threshold)
+
+    def test_instances_have_their_own_settings(self):
+        first = config.Config()
+        first.config['ignore_users'].append('U023BECGF')
+        self.assertNotIn('U023BECGF', config.Config().ignore_users)
+
+    def test_workspaces_override_top_level_settings(self):
+        settings = {'warn_threshold': 30,
+                    'workspaces': [{'slack_name': 'bolsheviks', 'warn_threshold': 7}, {'slack_name': 'mensheviks'}]}
+        with mock.patch('config.load', return_value=settings):
+            first, second = config.workspaces()
+        self.assertEqual((first.get('slack_name'), first.warn_threshold), ('bolsheviks', 7))
+        self.assertEqual((second.get('slack_name'), second.warn_threshold), ('mensheviks', 30))
+
+    def test_slack_name_prefers_environment(self):
+        with mock.patch('config.load', return_value={'slack_name': 'bolsheviks'}) as load:
+            with mock.patch.dict(os.environ, {'SLACK_NAME': 'mensheviks'}):
+                self.assertEqual(config.slack_name(), 'mensheviks')
+            self.assertFalse(load.called)
+            with mock.patch.dict(os.environ):
+                os.environ.pop('SLACK_NAME', None)
+                self.assertEqual(config.slack_name(), 'bolsheviks')
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+import json
+import unittest
+
+import decoding
+
+
+def chunked(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+class GetTestCase(unittest.TestCase):
+    def test_auto_picks_an_installed_decoder(self):
+        self.assertEqual(decoding.get()(b'{"ok": true}'), {'ok': True})
+        self.assertEqual(decoding.get('json')(b'{"ok": true}'), {'ok': True})
+
+    def test_unknown_decoder(self):
+        self.assertRaises(AssertionError, decoding.get, 'nosuchjson')
+
+
+class StreamingObjectTestCase(unittest.TestCase):
+    payload = {
+        'ok': True,
+        'messages': [{'ts': "1500000000.000{}".format(i), 'text': u"Привет, мир {} 🙂".format(i), 'n': 12345.678}
+                     for i in range(50)],
+        'has_more': False,
+        'response_metadata': {'next_cursor': ""},
+    }
+
+    def test_yields_items_whatever_the_chunk_size(self):
+        data = json.dumps(self.payload).encode('utf-8')
+        for size in (1, 7, 64, len(data)):
+            stream = decoding.StreamingObject(chunked(data, size), 'messages')
+            self.assertEqual(list(stream), self.payload['messages'])
+            self.assertEqual(stream.fields, {'ok': True, 'has_more': False, 'response_metadata': {'next_cursor': ""}})
+            self.assertEqual(stream.bytes_read, len(data))
+
+    def test_empty_list_and_missing_key(self):
+        stream = decoding.StreamingObject([b'{"ok": true, "messages": [ ], "has_more": false}'], 'messages')
+        self.assertEqual(list(stream), [])
+        self.assertEqual(stream.fields, {'ok': True, 'has_more': False})
+        stream = decoding.StreamingObject([b'{"ok": false, "error": "channel_not_found"}'], 'messages')
+        self.assertEqual(list(stream), [])
+        self.assertEqual(stream.fields['error'], "channel_not_found")
+
+    def test_truncated_response(self):
+        stream = decoding.StreamingObject([b'{"ok": true, "messages": [{"ts": "1"}, {"ts"'], 'messages')
+        self.assertRaises(ValueError, list, stream)
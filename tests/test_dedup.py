@@ -0,0 +1,76 @@
+import time
+import unittest
+
+import mock
+
+import dedup
+import state
+
+
+class BloomFilterTestCase(unittest.TestCase):
+    def test_contains_added_keys(self):
+        bloom = dedup.BloomFilter(1000, 5)
+        bloom.add("C012839:1498076539.987000:saver")
+        self.assertIn("C012839:1498076539.987000:saver", bloom)
+        self.assertNotIn("C012839:1498076539.987000:other", bloom)
+
+    def test_round_trips_through_encoding(self):
+        bloom = dedup.BloomFilter(1000, 5)
+        bloom.add("key")
+        self.assertIn("key", dedup.BloomFilter.decode(1000, 5, bloom.encode()))
+
+
+class AnnouncementLogTestCase(unittest.TestCase):
+    def setUp(self):
+        self.store = state.State()
+
+    def test_remembers_announcements(self):
+        log = dedup.AnnouncementLog(self.store, capacity=100)
+        self.assertFalse(log.seen("a"))
+        log.add("a")
+        self.assertTrue(log.seen("a"))
+        self.assertFalse(log.seen("b"))
+
+    def test_survives_reload(self):
+        log = dedup.AnnouncementLog(self.store, capacity=100)
+        log.add("a")
+        log.flush()
+        self.assertTrue(dedup.AnnouncementLog(self.store, capacity=100).seen("a"))
+
+    def test_keys_added_after_flush_survive_reload(self):
+        log = dedup.AnnouncementLog(self.store, capacity=100, retention=60)
+        log.add("a")
+        log.flush()
+        log.add("b")
+        self.assertTrue(dedup.AnnouncementLog(self.store, capacity=100, retention=60).seen("b"))
+        # even once it's too old to be kept exactly
+        self.store.section('announced')['recent']['b'] = 0
+        self.assertTrue(dedup.AnnouncementLog(self.store, capacity=100, retention=60).seen("b"))
+
+    def test_expired_keys_are_still_seen(self):
+        log = dedup.AnnouncementLog(self.store, capacity=100, retention=60)
+        log.add("a")
+        self.store.section('announced')['recent']['a'] = time.time() - 120
+        log.flush()
+        log = dedup.AnnouncementLog(self.store, capacity=100, retention=60)
+        self.assertNotIn("a", self.store.section('announced')['recent'])
+        self.assertTrue(log.seen("a"))
+
+    def test_rebuilds_when_over_capacity(self):
+        log = dedup.AnnouncementLog(self.store, capacity=10)
+        for i in range(11):
+            log.add(str(i))
+        self.assertEqual(self.store.section('announced')['count'], 11)
+        self.assertTrue(all(log.seen(str(i)) for i in range(11)))
+
+    def test_rebuilds_rarely_while_every_key_is_recent(self):
+        log = dedup.AnnouncementLog(self.store, capacity=10)
+        rebuild = log.rebuild
+        log.rebuild = mock.MagicMock(side_effect=rebuild)
+        for i in range(200):
+            log.add(str(i))
+        self.assertLessEqual(len(log.rebuild.mock_calls), 5)
+        self.assertTrue(all(log.seen(str(i)) for i in range(200)))
+        self.assertFalse(log.seen("200"))
+        log.flush()
+        self.assertTrue(dedup.AnnouncementLog(self.store, capacity=10).seen("199"))
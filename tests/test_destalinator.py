@@ -7,6 +7,7 @@ import unittest
 import destalinator
 import slacker
 import slackbot
+import state
 
 
 sample_slack_messages = [
@@ -372,6 +373,47 @@ class DestalinatorStaleTestCase(unittest.TestCase):
         self.assertFalse(self.destalinator.stale('stalinists', 30))
 
 
+class DestalinatorActivityIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.slacker = SlackerMock("testing", "token")
+        self.slackbot = slackbot.Slackbot("testing", "token")
+
+    @mock.patch('tests.test_destalinator.SlackerMock')
+    def test_answers_from_index_without_fetching(self, mock_slacker):
+        self.destalinator = destalinator.Destalinator(mock_slacker, self.slackbot, activated=True)
+        mock_slacker.get_channelid.return_value = "C102843"
+        mock_slacker.get_channel_info.return_value = {'age': 90 * 86400}
+        now = self.destalinator.now
+        self.destalinator.get_activity_index()["C102843"] = {'last': now - 45 * 86400, 'floor': now - 60 * 86400, 'synced': now}
+        self.assertTrue(self.destalinator.stale('stalinists', 30))
+        self.assertFalse(self.destalinator.stale('stalinists', 60))
+        self.assertFalse(mock_slacker.get_messages_in_time_range.called)
+
+    @mock.patch('tests.test_destalinator.SlackerMock')
+    def test_syncs_only_new_history(self, mock_slacker):
+        self.destalinator = destalinator.Destalinator(mock_slacker, self.slackbot, activated=True)
+        mock_slacker.get_channelid.return_value = "C102843"
+        mock_slacker.get_channel_info.return_value = {'age': 90 * 86400}
+        now = self.destalinator.now
+        synced = now - 86400
+        self.destalinator.get_activity_index()["C102843"] = {'last': now - 45 * 86400, 'floor': now - 60 * 86400, 'synced': synced}
+        mock_slacker.get_messages_in_time_range.return_value = [{"user": "U2147483697", "text": "Hi", "ts": str(now - 3600)}]
+        self.assertFalse(self.destalinator.stale('stalinists', 30))
+        mock_slacker.get_messages_in_time_range.assert_called_once_with(synced, "C102843", now, keep=mock.ANY)
+        self.assertEqual(self.destalinator.get_activity_index()["C102843"]['last'], now - 3600)
+
+    @mock.patch('tests.test_destalinator.SlackerMock')
+    def test_extends_window_for_longer_threshold(self, mock_slacker):
+        self.destalinator = destalinator.Destalinator(mock_slacker, self.slackbot, activated=True)
+        mock_slacker.get_channelid.return_value = "C102843"
+        mock_slacker.get_channel_info.return_value = {'age': 90 * 86400}
+        now = self.destalinator.now
+        self.destalinator.get_activity_index()["C102843"] = {'last': None, 'floor': now - 30 * 86400, 'synced': now}
+        mock_slacker.get_messages_in_time_range.return_value = [{"user": "U2147483697", "text": "Hi", "ts": str(now - 40 * 86400)}]
+        self.assertFalse(self.destalinator.stale('stalinists', 60))
+        mock_slacker.get_messages_in_time_range.assert_called_once_with(now - 60 * 86400, "C102843", now - 30 * 86400, keep=mock.ANY)
+
+
 class DestalinatorArchiveTestCase(unittest.TestCase):
     def setUp(self):
         self.slacker = SlackerMock("testing", "token")
@@ -418,6 +460,18 @@ class DestalinatorArchiveTestCase(unittest.TestCase):
             mock_slacker.post_message.mock_calls
         )
 
+    @mock.patch('tests.test_destalinator.SlackerMock')
+    def test_announces_members_in_chunks(self, mock_slacker):
+        self.destalinator = destalinator.Destalinator(mock_slacker, self.slackbot, activated=True)
+        self.destalinator.roster_chunk_size = 2
+        mock_slacker.post_message.return_value = {}
+        mock_slacker.archive.return_value = {'ok': True}
+        mock_slacker.get_channel_member_names.return_value = iter(['@e', '@d', '@c', '@b', '@a'])
+        self.destalinator.archive("stalinists")
+        rosters = [c[1][1] for c in mock_slacker.post_message.mock_calls if c[2].get('message_type') == 'channel_archive_members']
+        self.assertEqual(rosters, ["Members at archiving are @e, @d", "More members at archiving: @c, @b",
+                                   "More members at archiving: @a"])
+
     @mock.patch('tests.test_destalinator.SlackerMock')
     def test_calls_archive_method(self, mock_slacker):
         self.destalinator = destalinator.Destalinator(mock_slacker, self.slackbot, activated=True)
@@ -562,6 +616,188 @@ class DestalinatorWarnTestCase(unittest.TestCase):
         self.destalinator.warn("stalinists", 30)
         self.assertFalse(mock_slacker.post_message.called)
 
+    @mock.patch('tests.test_destalinator.SlackerMock')
+    def test_records_warning_in_index(self, mock_slacker):
+        self.destalinator = destalinator.Destalinator(mock_slacker, self.slackbot, activated=True)
+        mock_slacker.channel_has_only_restricted_members.return_value = False
+        mock_slacker.get_channelid.return_value = "C102843"
+        mock_slacker.get_messages_in_time_range.return_value = sample_slack_messages
+        self.destalinator.warn("stalinists", 30)
+        self.assertEqual(self.destalinator.state.section('warnings')["C102843"], self.destalinator.now)
+
+    @mock.patch('tests.test_destalinator.SlackerMock')
+    def test_does_not_warn_when_warning_index_has_recent_warning(self, mock_slacker):
+        self.destalinator = destalinator.Destalinator(mock_slacker, self.slackbot, activated=True)
+        mock_slacker.channel_has_only_restricted_members.return_value = False
+        mock_slacker.get_channelid.return_value = "C102843"
+        self.destalinator.state.section('warnings')["C102843"] = self.destalinator.now - 86400
+        self.assertFalse(self.destalinator.warn("stalinists", 30))
+        self.assertFalse(mock_slacker.get_messages_in_time_range.called)
+        self.assertFalse(mock_slacker.post_message.called)
+
+    @mock.patch('tests.test_destalinator.SlackerMock')
+    def test_warns_when_indexed_warning_is_outside_window(self, mock_slacker):
+        self.destalinator = destalinator.Destalinator(mock_slacker, self.slackbot, activated=True)
+        mock_slacker.channel_has_only_restricted_members.return_value = False
+        mock_slacker.get_channelid.return_value = "C102843"
+        self.destalinator.state.section('warnings')["C102843"] = self.destalinator.now - 86400 * 31
+        self.assertTrue(self.destalinator.warn("stalinists", 30))
+        self.assertTrue(mock_slacker.post_message.called)
+
+    def test_general_warning_leaves_out_private_channels(self):
+        self.destalinator = destalinator.Destalinator(self.slacker, self.slackbot, activated=True)
+        self.slacker.channels_by_name = {'leninists': 'C012839', 'okhrana': 'G000001'}
+        self.slacker.private_channel_ids = set(['G000001'])
+        self.destalinator.post_marked_up_message = mock.MagicMock()
+        self.destalinator.warn_in_general(['leninists', 'okhrana'])
+        message = self.destalinator.post_marked_up_message.call_args[0][1]
+        self.assertIn('#leninists', message)
+        self.assertNotIn('okhrana', message)
+        self.destalinator.post_marked_up_message.reset_mock()
+        self.destalinator.warn_in_general(['okhrana'])
+        self.assertFalse(self.destalinator.post_marked_up_message.called)
+
+
+class DestalinatorPlanTestCase(unittest.TestCase):
+    def setUp(self):
+        self.slacker = SlackerMock("testing", "token")
+        self.slacker.channels_by_name = {'admin': 'C000001', 'leninists': 'C012839', 'mensheviks': 'C044444',
+                                         'stalinists': 'C102843', 'trotskyists': 'C0184982'}
+        self.slacker.channels_by_id = {v: k for k, v in self.slacker.channels_by_name.items()}
+        self.slacker.private_channel_ids = set()
+        self.slacker.channel_has_only_restricted_members = mock.MagicMock(return_value=False)
+        self.slacker.get_channel_info = mock.MagicMock(return_value={'age': 90 * 86400})
+        self.slacker.get_messages_in_time_range = mock.MagicMock(return_value=[])
+        self.slacker.post_message = mock.MagicMock(return_value={})
+        self.slacker.archive = mock.MagicMock(return_value={'ok': True})
+        self.slacker.get_channel_member_names = mock.MagicMock(return_value=[])
+        self.slackbot = slackbot.Slackbot("testing", "token")
+        self.destalinator = destalinator.Destalinator(self.slacker, self.slackbot, activated=True)
+        now = self.destalinator.now
+        index = self.destalinator.get_activity_index()
+        index['C012839'] = {'last': now - 86400, 'floor': now - 60 * 86400, 'synced': now}
+        index['C044444'] = {'last': now - 40 * 86400, 'floor': now - 60 * 86400, 'synced': now}
+        index['C102843'] = {'last': None, 'floor': now - 60 * 86400, 'synced': now}
+        index['C0184982'] = {'last': now - 40 * 86400, 'floor': now - 60 * 86400, 'synced': now}
+        self.destalinator.state.section('warnings')['C0184982'] = now - 86400
+
+    def test_plans_every_channel_without_posting(self):
+        plan = self.destalinator.plan_all(30, 60)
+        actions = {x['channel']: (x['action'], x['reason']) for x in plan['actions']}
+        self.assertEqual(actions, {
+            'admin': ('skip', "in ignore_channels"),
+            'leninists': ('skip', "active in the last 30 days"),
+            'mensheviks': ('warn', "no activity in 30 days"),
+            'stalinists': ('archive', "no activity in 60 days"),
+            'trotskyists': ('skip', "already warned in the last 30 days"),
+        })
+        self.assertEqual(plan['actions'][2]['last_activity'], self.destalinator.now - 40 * 86400)
+        self.assertFalse(self.slacker.post_message.called)
+        self.assertFalse(self.slacker.archive.called)
+
+    def test_applies_plan(self):
+        plan = self.destalinator.plan_all(30, 60)
+        self.assertEqual(self.destalinator.apply_plan(plan), ['mensheviks'])
+        self.slacker.post_message.assert_any_call('mensheviks', self.destalinator.warning_text, message_type='channel_warning')
+        self.slacker.archive.assert_called_once_with('stalinists')
+        self.assertEqual(self.destalinator.state.section('warnings')['C044444'], self.destalinator.now)
+
+    def test_apply_skips_channels_that_are_gone(self):
+        plan = self.destalinator.plan_all(30, 60)
+        del self.slacker.channels_by_name['stalinists']
+        self.destalinator.apply_plan(plan)
+        self.assertFalse(self.slacker.archive.called)
+
+
+class DestalinatorBudgetTestCase(unittest.TestCase):
+    def setUp(self):
+        self.slacker = SlackerMock("testing", "token")
+        self.slacker.channels_by_name = {'anarchists': 'C1', 'bolsheviks': 'C2', 'leninists': 'C3', 'stalinists': 'C4'}
+        self.slacker.channels_by_id = {v: k for k, v in self.slacker.channels_by_name.items()}
+        self.destalinator = destalinator.Destalinator(self.slacker, slackbot.Slackbot("testing", "token"), activated=False)
+
+    def test_alphabetical_without_activity_data(self):
+        self.assertEqual(self.destalinator.prioritized_channel_names(), ['anarchists', 'bolsheviks', 'leninists', 'stalinists'])
+
+    def test_most_likely_stale_first(self):
+        now = self.destalinator.now
+        index = self.destalinator.get_activity_index()
+        index['C1'] = {'last': now - 86400, 'floor': now - 60 * 86400, 'synced': now}
+        index['C2'] = {'last': now - 20 * 86400, 'floor': now - 60 * 86400, 'synced': now}
+        index['C4'] = {'last': None, 'floor': now - 60 * 86400, 'synced': now}
+        self.assertEqual(self.destalinator.prioritized_channel_names(), ['leninists', 'stalinists', 'bolsheviks', 'anarchists'])
+
+    def test_stops_when_budget_is_used_up(self):
+        run_budget = mock.MagicMock()
+        run_budget.exhausted.side_effect = [False, False, True]
+        self.assertEqual(list(self.destalinator.channels_within_budget(run_budget)), ['anarchists', 'bolsheviks'])
+        self.assertEqual(list(self.destalinator.channels_within_budget(None)), ['anarchists', 'bolsheviks', 'leninists', 'stalinists'])
+
+
+class DestalinatorCheckpointTestCase(unittest.TestCase):
+    def setUp(self):
+        self.slacker = SlackerMock("testing", "token")
+        self.slacker.channels_by_name = {'leninists': 'C012839', 'mensheviks': 'C044444', 'stalinists': 'C102843'}
+        self.slacker.channels_by_id = {v: k for k, v in self.slacker.channels_by_name.items()}
+        self.slacker.post_message = mock.MagicMock(return_value={})
+        self.slackbot = slackbot.Slackbot("testing", "token")
+        self.store = state.State()
+
+    def make_destalinator(self):
+        ds = destalinator.Destalinator(self.slacker, self.slackbot, activated=True, state_store=self.store)
+        ds.warn = mock.MagicMock(return_value=True)
+        # stale() is mocked, so there's no history to fetch ahead of it
+        ds.history_prefetch = 1
+        return ds
+
+    def test_resumes_interrupted_run(self):
+        first = self.make_destalinator()
+        first.stale = mock.MagicMock(side_effect=[True, RuntimeError("dyno restarted")])
+        self.assertRaises(RuntimeError, first.warn_all, 30)
+        self.assertEqual(self.store.section('checkpoints')['warn']['done'], {'leninists': 'warned'})
+
+        second = self.make_destalinator()
+        second.stale = mock.MagicMock(return_value=True)
+        second.warn_in_general = mock.MagicMock()
+        self.assertEqual(second.warn_all(30), ['leninists', 'mensheviks', 'stalinists'])
+        self.assertEqual(second.stale.mock_calls, [mock.call('mensheviks', 30), mock.call('stalinists', 30)])
+        second.warn_in_general.assert_called_once_with(['leninists', 'mensheviks', 'stalinists'])
+        self.assertNotIn('warn', self.store.section('checkpoints'))
+
+    def test_starts_over_after_old_checkpoint(self):
+        ds = self.make_destalinator()
+        self.store.section('checkpoints')['archive'] = {'started': ds.now - 86400, 'done': {'leninists': 'active'}, 'warned': []}
+        ds.stale = mock.MagicMock(return_value=False)
+        ds.safe_archive_all(60)
+        self.assertEqual(len(ds.stale.mock_calls), 3)
+
+    def test_saves_each_warning_as_soon_as_it_is_posted(self):
+        ds = destalinator.Destalinator(self.slacker, self.slackbot, activated=True, state_store=self.store)
+        ds.history_prefetch = 1
+        ds.stale = mock.MagicMock(return_value=True)
+        ds.slacker.channel_has_only_restricted_members = mock.MagicMock(return_value=False)
+        ds.get_prior_warning = mock.MagicMock(return_value=None)
+        ds.warn_in_general = mock.MagicMock()
+        saved = []
+        self.store.save = mock.MagicMock(side_effect=lambda: saved.append(
+            (len(self.store.section('warnings')), len(self.store.section('checkpoints').get('warn', {}).get('done', {})))))
+        self.assertEqual(len(ds.warn_all(30)), 3)
+        # the warning index, then the checkpoint, as soon as each warning is posted
+        self.assertEqual(saved, [(1, 0), (1, 1), (2, 1), (2, 2), (3, 2), (3, 3), (3, 0)])
+
+    def test_dry_run_does_not_record_reconciled_warnings(self):
+        ds = destalinator.Destalinator(self.slacker, self.slackbot, activated=False, state_store=self.store)
+        ds.find_warning_in_history = mock.MagicMock(return_value=None)
+        self.assertIsNone(ds.get_prior_warning('leninists', 30))
+        self.assertEqual(self.store.section('warnings'), {})
+
+    def test_batches_saves_of_channels_left_alone(self):
+        ds = self.make_destalinator()
+        ds.stale = mock.MagicMock(return_value=False)
+        self.store.save = mock.MagicMock()
+        self.assertEqual(ds.warn_all(30), [])
+        self.assertEqual(len(self.store.save.mock_calls), 1)
+
 
 if __name__ == '__main__':
     unittest.main()
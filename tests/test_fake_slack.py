@@ -0,0 +1,236 @@
+import contextlib
+import threading
+import time
+import unittest
+
+import destalinator
+import metrics
+import slackbot
+import slacker
+import state
+from benchmarks import fake_slack
+from benchmarks import workspace
+
+
+class FakeSlackTestCase(unittest.TestCase):
+    def setUp(self):
+        self.workspace = workspace.generate(channels=10, users=10, messages_per_channel=250)
+        self.fake = fake_slack.FakeSlack(self.workspace, retry_after=0)
+        self.slacker = slacker.Slacker("testing", token="token", api_url=self.fake.url)
+        self.slackbot = slackbot.Slackbot("testing", token="token", url=self.fake.slackbot_url)
+        self.channel = self.workspace.channels[-1]
+
+    def tearDown(self):
+        self.fake.stop()
+
+    def test_lists_channels_and_users(self):
+        self.assertEqual(sorted(self.slacker.channels_by_name), sorted(c['name'] for c in self.workspace.channels))
+        self.assertEqual(len(self.slacker.users_by_id), 10)
+
+    def test_fetches_directories_when_first_needed(self):
+        self.fake.reset_counters()
+        lazy = slacker.Slacker("testing", token="token", api_url=self.fake.url)
+        self.assertEqual(sum(self.fake.calls.values()), 0)
+        self.assertEqual(lazy.get_channelid(self.channel['name']), self.channel['id'])
+        self.assertEqual(lazy.get_channelid(self.channel['name']), self.channel['id'])
+        self.assertEqual(dict(self.fake.calls), {'channels.list': 1})
+
+    def test_pages_through_history(self):
+        self.fake.reset_counters()
+        messages = self.slacker.get_messages_in_time_range(0, self.channel['id'])
+        self.assertEqual([m['ts'] for m in messages], [m['ts'] for m in self.workspace.history[self.channel['id']]])
+        self.assertEqual(self.fake.calls['channels.history'], 3)
+
+    def test_streams_large_history_pages(self):
+        metrics.registry.reset()
+        self.slacker.stream_threshold = 0
+        self.slacker.stream_chunk_size = 512
+        messages = self.slacker.get_messages_in_time_range(0, self.channel['id'])
+        self.assertEqual([m['ts'] for m in messages], [m['ts'] for m in self.workspace.history[self.channel['id']]])
+        self.assertEqual(metrics.registry.counter('api_streamed_responses', method='channels.history'), 3)
+
+    def test_filters_history_as_it_pages(self):
+        def keep(message):
+            return message.get('subtype') is None
+        messages = self.slacker.get_messages_in_time_range(0, self.channel['id'], keep=keep)
+        expected = [m['ts'] for m in self.workspace.history[self.channel['id']] if keep(m)]
+        self.assertEqual([m['ts'] for m in messages], expected)
+
+    def restrict(self, restricted_ids, channel, members, listed_count=None):
+        for user in self.workspace.users:
+            user['is_restricted'] = user['id'] in restricted_ids
+        self.workspace.members[channel['id']] = members
+        channel['num_members'] = listed_count
+
+    def test_only_restricted_members(self):
+        restricted = [u['id'] for u in self.workspace.users[:3]]
+        unrestricted = self.workspace.users[5]['id']
+        first, second = self.workspace.channels[0], self.workspace.channels[1]
+        self.restrict(restricted, first, restricted, listed_count=3)
+        self.restrict(restricted, second, [unrestricted] + restricted)
+        checker = slacker.Slacker("testing", token="token", api_url=self.fake.url)
+        checker.api = 'conversations'
+        self.fake.reset_counters()
+        self.assertTrue(checker.channel_has_only_restricted_members(first['name']))
+        self.assertFalse(checker.channel_has_only_restricted_members(second['name']))
+        # one page each: the second stops at its first, unrestricted, member
+        self.assertEqual(self.fake.calls['conversations.members'], 2)
+
+    def test_legacy_api_gets_members_from_channel_info(self):
+        self.fake.reset_counters()
+        members = list(self.slacker.iter_channel_member_ids(self.channel['name']))
+        self.assertEqual(members, list(self.workspace.members[self.channel['id']]))
+        self.assertEqual(self.fake.calls['channels.info'], 1)
+        self.assertEqual(self.fake.calls['conversations.members'], 0)
+
+    def test_restricted_members_check_uses_listed_count(self):
+        channel = self.workspace.channels[0]
+        self.restrict([self.workspace.users[0]['id']], channel, [u['id'] for u in self.workspace.users[:4]], listed_count=4)
+        checker = slacker.Slacker("testing", token="token", api_url=self.fake.url)
+        self.assertFalse(checker.channel_has_only_restricted_members(channel['name']))
+        self.assertEqual(self.fake.calls['conversations.members'], 0)
+
+    def test_members_are_paginated(self):
+        self.slacker.api = 'conversations'
+        members = list(self.slacker.iter_channel_member_ids(self.channel['name'], page_size=2))
+        self.assertEqual(members, list(self.workspace.members[self.channel['id']]))
+
+    def test_resolves_users_who_joined_since_listing(self):
+        self.slacker.get_users()  # list users before the newcomer joins
+        self.workspace.users.append({"id": "U99999999", "name": "newcomer"})
+        self.workspace.members[self.channel['id']] = ["U99999999", self.workspace.users[0]['id']]
+        self.fake.reset_counters()
+        names = list(self.slacker.get_channel_member_names(self.channel['name']))
+        self.assertEqual(names, ["@newcomer", "@" + self.workspace.users[0]['name']])
+        self.assertEqual(self.slacker.get_user_name("U99999999"), "newcomer")
+        self.assertEqual(self.slacker.get_user_name("U00000000X"), "U00000000X")
+        self.assertEqual(self.fake.calls['users.info'], 2)
+
+    def test_posts_messages(self):
+        self.slacker.post_message(self.channel['name'], "Hello", message_type='channel_warning')
+        self.assertEqual(self.slackbot.say(self.channel['name'], "Hi"), 200)
+        texts = [m['text'] for m in self.workspace.history[self.channel['id']][-2:]]
+        self.assertEqual(texts, ["Hello", "Hi"])
+        self.assertEqual(self.workspace.history[self.channel['id']][-2]['attachments'], [{'fallback': 'channel_warning'}])
+
+    def test_archives_channels(self):
+        self.assertTrue(self.slacker.archive(self.channel['name'])['ok'])
+        self.assertNotIn(self.channel['name'], [c['name'] for c in self.slacker.get_all_channel_objects()])
+
+    def test_slacker_retries_throttled_and_failed_requests(self):
+        self.fake.inject('channels.info', 429)
+        self.fake.inject('channels.info', 500)
+        self.assertEqual(self.slacker.get_channel_info(self.channel['name'])['id'], self.channel['id'])
+        self.assertEqual(self.fake.calls['channels.info'], 3)
+
+    def test_slackbot_retries_throttled_requests(self):
+        self.fake.inject('slackbot', 429, times=2)
+        self.assertEqual(self.slackbot.say(self.channel['name'], "Hi"), 200)
+        self.assertEqual(self.fake.calls['slackbot'], 3)
+
+    def test_posts_are_not_retried_after_server_errors(self):
+        self.fake.inject('chat.postMessage', 503)
+        self.fake.inject('slackbot', 500)
+        self.slacker.post_message(self.channel['name'], "Hi")
+        self.assertEqual(self.slackbot.say(self.channel['name'], "Hi"), 500)
+        self.assertEqual(self.fake.calls['chat.postMessage'], 1)
+        self.assertEqual(self.fake.calls['slackbot'], 1)
+
+    def test_archives_and_deletes_are_not_retried_after_server_errors(self):
+        self.fake.inject('channels.archive', 503)
+        self.fake.inject('chat.delete', 503)
+        self.slacker.archive(self.channel['name'])
+        self.slacker.delete_message(self.channel['id'], "1.000000")
+        self.assertEqual(self.fake.calls['channels.archive'], 1)
+        self.assertEqual(self.fake.calls['chat.delete'], 1)
+
+    def test_applies_rate_limit(self):
+        self.fake.rate_limit = 1
+        self.fake.retry_after = 1
+        start = time.time()
+        self.slacker.get_emojis()
+        self.slacker.get_emojis()
+        self.assertEqual(self.fake.throttled['emoji.list'] > 0, time.time() - start >= 1)
+
+    def test_slacker_requests_are_instrumented(self):
+        metrics.registry.reset()
+        self.fake.inject('emoji.list', 429)
+        self.slacker.get_emojis()
+        self.assertEqual(metrics.registry.counter('api_calls', method='emoji.list'), 2)
+        self.assertEqual(metrics.registry.counter('api_retries', method='emoji.list'), 1)
+        self.assertGreater(metrics.registry.counter('api_bytes_received', method='emoji.list'), 0)
+
+    def test_warner_fetches_history_concurrently_within_the_limit(self):
+        self.fake.latency = 0.02
+        limiter = self.slacker.concurrency.limiter('channels.history')
+        limiter.maximum = 3
+        lock = threading.Lock()
+        in_flight = [0, 0]
+        slot = limiter.slot
+
+        def counted_slot():
+            with slot():
+                with lock:
+                    in_flight[0] += 1
+                    in_flight[1] = max(in_flight)
+                time.sleep(0.01)
+                try:
+                    yield
+                finally:
+                    with lock:
+                        in_flight[0] -= 1
+        limiter.slot = contextlib.contextmanager(counted_slot)
+        ds = destalinator.Destalinator(self.slacker, self.slackbot, activated=False, state_store=state.State())
+        ds.warn_all(30, notify=False)
+        self.assertTrue(1 < in_flight[1] <= 3, in_flight[1])
+
+
+class ConversationsBackendTestCase(unittest.TestCase):
+    def setUp(self):
+        self.workspace = workspace.generate(channels=20, users=10, messages_per_channel=1500, private_fraction=0.3)
+        self.fake = fake_slack.FakeSlack(self.workspace, retry_after=0)
+        self.slacker = slacker.Slacker("testing", token="token", api_url=self.fake.url)
+        self.slacker.api = 'conversations'
+        self.private = [c for c in self.workspace.channels if c['is_private']]
+        self.channel = self.workspace.channels[-1]
+
+    def tearDown(self):
+        self.fake.stop()
+
+    def test_pages_through_history_by_cursor(self):
+        messages = self.slacker.get_messages_in_time_range(0, self.channel['id'])
+        self.assertEqual([m['ts'] for m in messages], [m['ts'] for m in self.workspace.history[self.channel['id']]])
+        self.assertEqual(self.fake.calls['conversations.history'], 2)
+        self.assertEqual(self.fake.calls['channels.history'], 0)
+
+    def test_lists_private_channels_only_when_asked(self):
+        self.assertTrue(self.private)
+        public = sorted(c['name'] for c in self.workspace.channels if not c['is_private'])
+        self.assertEqual(sorted(c['name'] for c in self.slacker.iter_channel_objects()), public)
+        self.slacker.include_private = True
+        self.slacker.get_channels()
+        self.assertEqual(sorted(self.slacker.channels_by_name), sorted(c['name'] for c in self.workspace.channels))
+        self.assertTrue(self.slacker.is_private(self.private[0]['name']))
+        self.assertFalse(self.slacker.is_private(public[0]))
+        self.assertEqual(self.fake.calls['conversations.list'], 2)
+
+    def test_info_message_and_archive(self):
+        self.slacker.include_private = True
+        channel = self.private[0]
+        self.assertEqual(self.slacker.get_channel_info(channel['name'])['id'], channel['id'])
+        ts = self.workspace.history[channel['id']][10]['ts']
+        self.assertEqual(self.slacker.get_message(channel['id'], ts)['ts'], ts)
+        self.assertTrue(self.slacker.archive(channel['name'])['ok'])
+        self.assertEqual(set(self.fake.calls) & set(['channels.info', 'channels.history', 'channels.archive']), set())
+
+
+class FakeSlackSubprocessTestCase(unittest.TestCase):
+    def test_serves_and_counts_from_a_child_process(self):
+        fake = fake_slack.Subprocess(dict(channels=5, users=5, messages_per_channel=5))
+        try:
+            checker = slacker.Slacker("testing", token="token", api_url=fake.url)
+            self.assertGreaterEqual(len(checker.channels_by_name), 5)
+            self.assertEqual(fake.counters()['calls'], {'channels.list': 1})
+        finally:
+            fake.stop()
+        self.assertFalse(fake.process.is_alive())
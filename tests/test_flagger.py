@@ -1,8 +1,13 @@
+import json
+import logging
 import os
+import time
 import unittest
 import mock
 
+import config
 import flagger
+import warm
 import tests.fixtures as fixtures
 import tests.mocks as mocks
 
@@ -20,3 +25,105 @@ class FlaggerFlagTest(unittest.TestCase):
     def test_flag_posts_interesting_messages(self):
         self.flagger.flag()
         self.assertGreater(len(self.slackbot.say.mock_calls), 0)
+
+    def test_flag_never_announces_private_channels(self):
+        self.flagger.slacker.private_channel_ids = set(self.flagger.slacker.channels_by_id)
+        self.flagger.flag()
+        self.assertEqual(len(self.slackbot.say.mock_calls), 0)
+
+    def test_report_is_logged_at_info_despite_quiet_flagger_logger(self):
+        self.assertEqual(self.flagger.logger.level, logging.ERROR)
+        with mock.patch.object(self.flagger.ds.logger, 'info') as info:
+            self.flagger.emit_report()
+        reports = [c[1][1] for c in info.mock_calls if c[1][0] == "Run report: %s"]
+        self.assertEqual(len(reports), 1)
+        self.assertIn('counters', json.loads(reports[0]))
+
+    def test_flag_does_not_repeat_announcements(self):
+        self.flagger.flag()
+        calls = len(self.slackbot.say.mock_calls)
+        self.flagger.flag()
+        self.assertEqual(len(self.slackbot.say.mock_calls), calls)
+
+
+class FlaggerHandleEventTest(unittest.TestCase):
+    def setUp(self):
+        slacker_obj = mocks.mocked_slacker_object(channels_list=fixtures.channels,
+                                                  users_list=fixtures.users,
+                                                  messages_list=fixtures.messages,
+                                                  emoji_list=fixtures.emoji)
+        self.item = {"type": "message", "channel": "C0184982", "ts": "{:.6f}".format(time.time())}
+        # as fetched when the first reaction event arrives
+        self.message = dict(fixtures.messages[3], ts=self.item["ts"], reactions=[{"name": "floppy_disk", "count": 1}])
+        slacker_obj.get_message = mock.MagicMock(return_value=self.message)
+        self.slackbot = mocks.mocked_slackbot_object()
+        with mock.patch.dict(os.environ, {'DESTALINATOR_ACTIVATED': 'true'}):
+            self.flagger = flagger.Flagger(slacker_injected=slacker_obj, slackbot_injected=self.slackbot)
+
+    def reaction(self, event_type, name="floppy_disk"):
+        return {"type": event_type, "reaction": name, "item": self.item}
+
+    def test_announces_when_threshold_is_crossed(self):
+        self.flagger.consume([self.reaction("reaction_added")])
+        self.assertEqual(len(self.slackbot.say.mock_calls), 0)
+        self.flagger.consume([self.reaction("reaction_added")])
+        self.assertEqual(len(self.slackbot.say.mock_calls), 1)
+
+    def test_announces_once_per_rule(self):
+        self.flagger.consume([self.reaction("reaction_added"),
+                              self.reaction("reaction_added"),
+                              self.reaction("reaction_removed"),
+                              self.reaction("reaction_added"),
+                              self.reaction("reaction_added")])
+        self.assertEqual(len(self.slackbot.say.mock_calls), 1)
+
+    def test_never_announces_private_channels(self):
+        self.flagger.slacker.private_channel_ids = set([self.item["channel"]])
+        self.flagger.consume([self.reaction("reaction_added"), self.reaction("reaction_added")])
+        self.assertEqual(len(self.slackbot.say.mock_calls), 0)
+
+    def test_counts_reactions_from_before_the_first_event(self):
+        self.message['reactions'] = [{"name": "floppy_disk", "count": 3}]
+        self.flagger.consume([self.reaction("reaction_added")])
+        self.assertEqual(len(self.slackbot.say.mock_calls), 1)
+
+    def test_aliases_count_as_in_flag_runs(self):
+        self.flagger.slacker.get_emojis.return_value = {"ok": True, "emoji": {
+            "floppy_disk": "http://example.com/example.png", "save": "alias:floppy_disk", "diskette": "alias:floppy_disk"}}
+        self.message['reactions'] = [{"name": "save", "count": 1}]
+        self.flagger.consume([self.reaction("reaction_added", "save"), self.reaction("reaction_added", "diskette")])
+        message = dict(self.message, reactions=[{"name": "save", "count": 1}, {"name": "diskette", "count": 1}])
+        self.assertEqual(bool(self.flagger.message_destination(message)), len(self.slackbot.say.mock_calls) == 1)
+        self.assertEqual(len(self.slackbot.say.mock_calls), 1)
+
+    def test_ignores_emoji_without_rules(self):
+        self.flagger.consume([self.reaction("reaction_added", "dolphin"), self.reaction("reaction_added", "dolphin")])
+        self.assertEqual(self.flagger.state.section('reaction_counters'), {})
+        self.assertEqual(len(self.slackbot.say.mock_calls), 0)
+
+
+class FlaggerWarmTest(unittest.TestCase):
+    def setUp(self):
+        self.slacker = mocks.mocked_slacker_object(channels_list=fixtures.channels,
+                                                   users_list=fixtures.users,
+                                                   messages_list=fixtures.messages,
+                                                   emoji_list=fixtures.emoji)
+        self.slackbot = mocks.mocked_slackbot_object()
+        self.cache = warm.Cache(warm.DEFAULT_TTLS)
+
+    def run_flagger(self, now=None):
+        with mock.patch.dict(os.environ, {'DESTALINATOR_ACTIVATED': 'true'}), \
+                mock.patch('time.time', return_value=now or time.time()):
+            flagger.Flagger(slacker_injected=self.slacker, slackbot_injected=self.slackbot,
+                            warm_injected=self.cache).flag()
+
+    def test_later_runs_reuse_emoji_and_control_history(self):
+        first = int(time.time())
+        self.run_flagger(now=first)
+        self.run_flagger(now=first + 600)
+        cid = self.slacker.get_channelid(config.Config().control_channel)
+        oldest = [c[1][0] for c in self.slacker.get_messages_in_time_range.mock_calls if c[1][1] == cid]
+        self.assertEqual(len(self.slacker.get_emojis.mock_calls), 1)
+        # the whole control channel is read once; the second run only asks for what was posted since the first
+        self.assertEqual(oldest.count(0), 1)
+        self.assertIn(first, oldest)
@@ -0,0 +1,121 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import mock
+
+import ingester
+import state
+import tests.fixtures as fixtures
+import tests.mocks as mocks
+
+
+class IngesterTestCase(unittest.TestCase):
+    def setUp(self):
+        slacker_obj = mocks.mocked_slacker_object(channels_list=fixtures.channels, users_list=fixtures.users)
+        self.ingester = ingester.Ingester(slacker_injected=slacker_obj, slackbot_injected=mocks.mocked_slackbot_object())
+        self.now = time.time()
+
+    def test_message_updates_last_activity(self):
+        self.ingester.ingest([
+            {"type": "message", "channel": "C0184982", "user": "U012742", "text": "Hi", "ts": str(self.now - 60)},
+            {"type": "message", "channel": "C0184982", "user": "U012742", "text": "Hi", "ts": str(self.now)},
+        ])
+        self.assertEqual(self.ingester.ds.get_activity_index()["C0184982"]['last'], self.now)
+
+    def test_ignored_message_is_not_activity(self):
+        self.ingester.ingest([
+            {"type": "message", "channel": "C0184982", "user": "USLACKBOT", "text": "Hi", "ts": str(self.now)},
+        ])
+        self.assertNotIn("C0184982", self.ingester.ds.get_activity_index())
+
+    def test_reactions_are_counted(self):
+        item = {"type": "message", "channel": "C0184982", "ts": str(self.now)}
+        self.ingester.ingest([
+            {"type": "reaction_added", "reaction": "floppy_disk", "item": item},
+            {"type": "reaction_added", "reaction": "floppy_disk", "item": item},
+            {"type": "reaction_added", "reaction": "dolphin", "item": item},
+            {"type": "reaction_removed", "reaction": "dolphin", "item": item},
+        ])
+        key = "C0184982:{}".format(self.now)
+        self.assertEqual(self.ingester.state.section('reactions')[key], {"floppy_disk": 2})
+
+    def test_old_reaction_counts_are_pruned(self):
+        old_key = "C0184982:{}".format(self.now - 2 * 86400)
+        new_key = "C0184982:{}".format(self.now)
+        for section in ('reactions', 'reaction_counters'):
+            self.ingester.state.section(section).update({old_key: {"floppy_disk": 1}, new_key: {"floppy_disk": 1}})
+        self.ingester.save()
+        for section in ('reactions', 'reaction_counters'):
+            self.assertEqual(list(self.ingester.state.section(section)), [new_key])
+
+    def test_saves_live_flagger(self):
+        self.ingester.flagger = mock.MagicMock()
+        self.ingester.ingest([])
+        self.ingester.flagger.save.assert_called_once_with()
+
+    def test_new_channels_are_recorded(self):
+        self.ingester.ingest([
+            {"type": "channel_created",
+             "channel": {"id": "C0999999", "name": "mensheviks", "created": int(self.now), "creator": "U012742"}},
+        ])
+        self.assertEqual(self.ingester.state.section('new_channels')["C0999999"]['name'], "mensheviks")
+
+    def test_replays_jsonl_file(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            fname = os.path.join(tmpdir, "events.jsonl")
+            with open(fname, "w") as fo:
+                fo.write(json.dumps({"type": "message", "channel": "C0184982", "user": "U012742",
+                                     "text": "Hi", "ts": str(self.now)}) + "\n")
+            self.ingester.replay(fname)
+        finally:
+            shutil.rmtree(tmpdir)
+        self.assertIn("C0184982", self.ingester.ds.get_activity_index())
+
+
+class IngesterCoversTestCase(unittest.TestCase):
+    def test_covers_when_listening_since_before(self):
+        store = state.State()
+        store.section('ingestion').update({'started': 100, 'seen': 1000})
+        self.assertTrue(ingester.covers(store, 200, now=1000))
+        self.assertFalse(ingester.covers(store, 50, now=1000))
+        self.assertFalse(ingester.covers(store, 200, now=1000 + ingester.INGESTION_MAX_LAG + 1))
+
+    def make_listener(self):
+        slacker_obj = mocks.mocked_slacker_object(channels_list=fixtures.channels, users_list=fixtures.users)
+        return ingester.Ingester(slacker_injected=slacker_obj, slackbot_injected=mocks.mocked_slackbot_object())
+
+    def test_restart_after_outage_does_not_cover_it(self):
+        listener = self.make_listener()
+        now = time.time()
+        listener.state.section('ingestion').update({'started': now - 7 * 86400, 'seen': now - 5 * 3600})
+        listener.heartbeat(now)
+        listener.ingest([{"type": "message", "channel": "C0184982", "user": "U012742", "text": "Hi", "ts": str(now)}])
+        self.assertFalse(ingester.covers(listener.state, now - 86400, now))
+        self.assertTrue(ingester.covers(listener.state, now, now))
+
+    def test_quiet_workspace_is_covered_while_listening(self):
+        listener = self.make_listener()
+        now = time.time()
+        listener.heartbeat(now - 2 * 86400)
+        # no events for a day and a half, but the receiver kept listening
+        for beat in range(int(now - 2 * 86400), int(now), ingester.HEARTBEAT_INTERVAL):
+            listener.heartbeat(beat)
+        listener.handle({"type": "message", "channel": "C0184982", "user": "U012742", "text": "Hi", "ts": str(now)},
+                        received=now)
+        self.assertTrue(ingester.covers(listener.state, now - 86400, now))
+
+    def test_redelivered_events_are_counted_once(self):
+        listener = self.make_listener()
+        item = {"type": "message", "channel": "C0184982", "ts": str(time.time())}
+        body = json.dumps({"type": "event_callback", "event_id": "Ev0123",
+                           "event": {"type": "reaction_added", "reaction": "floppy_disk", "item": item}}).encode('utf-8')
+        for retry in range(2):
+            environ = {'CONTENT_LENGTH': str(len(body)), 'wsgi.input': io.BytesIO(body), 'HTTP_X_SLACK_RETRY_NUM': str(retry)}
+            listener.application(environ, mock.MagicMock())
+        self.assertEqual(listener.state.section('reactions')["C0184982:{}".format(item['ts'])], {"floppy_disk": 1})
@@ -0,0 +1,87 @@
+import json
+import unittest
+
+import metrics
+
+
+class MetricsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.metrics = metrics.Metrics()
+
+    def test_counts_by_label(self):
+        self.metrics.incr('api_calls', method='channels.history')
+        self.metrics.incr('api_calls', method='channels.history')
+        self.metrics.incr('api_calls', method='channels.info')
+        self.assertEqual(self.metrics.counter('api_calls', method='channels.history'), 2)
+        self.assertEqual(self.metrics.counter('api_calls', method='channels.info'), 1)
+
+    def test_histogram_buckets_are_cumulative(self):
+        for value in (0.001, 0.02, 0.02, 20):
+            self.metrics.observe('api_latency_seconds', value, method='channels.list')
+        buckets = self.metrics.report()['histograms']['api_latency_seconds'][0]['buckets']
+        self.assertEqual(buckets['0.005'], 1)
+        self.assertEqual(buckets['0.025'], 3)
+        self.assertEqual(buckets['10.0'], 3)
+        self.assertEqual(buckets['+Inf'], 4)
+
+    def test_cache_hit_rates(self):
+        self.metrics.incr('cache_hits', cache='messages')
+        self.metrics.incr('cache_misses', cache='messages', value=3)
+        self.assertEqual(self.metrics.report()['cache_hit_rates'], {'messages': 0.25})
+
+    def test_report_is_json(self):
+        self.metrics.incr('api_calls', method='users.list')
+        self.metrics.observe_channel('leninists', 0.5)
+        report = json.loads(self.metrics.to_json())
+        self.assertEqual(report['channel_evaluation_seconds'], {'leninists': 0.5})
+
+    def test_prometheus_format(self):
+        self.metrics.incr('api_calls', method='users.list')
+        self.metrics.observe('stale_seconds', 0.2)
+        text = self.metrics.to_prometheus()
+        self.assertIn('destalinator_api_calls_total{method="users.list"} 1', text)
+        self.assertIn('destalinator_stale_seconds_bucket{le="0.25"} 1', text)
+        self.assertIn('destalinator_stale_seconds_count 1', text)
+
+    def test_gauges_keep_the_latest_value(self):
+        self.metrics.set_gauge('api_concurrency_limit', 4, method='users.list')
+        self.metrics.set_gauge('api_concurrency_limit', 2, method='users.list')
+        self.assertEqual(self.metrics.gauge('api_concurrency_limit', method='users.list'), 2)
+        self.assertIn('destalinator_api_concurrency_limit{method="users.list"} 2', self.metrics.to_prometheus())
+
+    def test_labelled_adds_labels_in_this_thread(self):
+        with self.metrics.labelled(workspace='bolsheviks'):
+            self.metrics.incr('api_calls', method='users.list')
+            self.metrics.observe_channel('general', 0.5)
+        self.metrics.incr('api_calls', method='users.list')
+        self.assertEqual(self.metrics.counter('api_calls', method='users.list', workspace='bolsheviks'), 1)
+        self.assertEqual(self.metrics.total('api_calls', workspace='bolsheviks'), 1)
+        self.assertEqual(self.metrics.total('api_calls'), 2)
+        self.assertEqual(self.metrics.report()['channel_evaluation_seconds'], {'bolsheviks/general': 0.5})
+
+    def test_snapshot_merges_into_another_registry(self):
+        self.metrics.incr('api_calls', method='users.list')
+        self.metrics.observe('api_latency_seconds', 0.02, method='users.list')
+        self.metrics.observe_channel('stalinists', 1.5)
+        merged = metrics.Metrics()
+        merged.incr('api_calls', method='users.list')
+        merged.merge(json.loads(json.dumps(self.metrics.snapshot())))
+        self.assertEqual(merged.counter('api_calls', method='users.list'), 2)
+        self.assertEqual(merged.report()['histograms']['api_latency_seconds'][0]['buckets']['0.025'], 1)
+        self.assertEqual(merged.report()['channel_evaluation_seconds'], {'stalinists': 1.5})
+
+
+class TimedDecoratorTestCase(unittest.TestCase):
+    def setUp(self):
+        metrics.registry.reset()
+
+    def test_observes_calls_and_channels(self):
+        class Evaluator(object):
+            @metrics.timed('evaluate_seconds', per_channel=True)
+            def evaluate(self, channel_name):
+                return channel_name
+
+        self.assertEqual(Evaluator().evaluate('stalinists'), 'stalinists')
+        report = metrics.registry.report()
+        self.assertEqual(report['histograms']['evaluate_seconds'][0]['count'], 1)
+        self.assertIn('stalinists', report['channel_evaluation_seconds'])
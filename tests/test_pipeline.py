@@ -0,0 +1,91 @@
+import threading
+import time
+import unittest
+
+import budget
+import metrics
+import pipeline
+
+
+class PipelineTestCase(unittest.TestCase):
+    def setUp(self):
+        self.events = []
+        self.lock = threading.Lock()
+
+    def stage(self, name, seconds=0, fail=False, timeout=None):
+        def func():
+            time.sleep(seconds)
+            with self.lock:
+                self.events.append(name)
+            if fail:
+                raise RuntimeError("{} broke".format(name))
+        return pipeline.Stage(name, func, timeout)
+
+    def test_chains_run_concurrently(self):
+        start = time.time()
+        results = pipeline.run_stages([[self.stage("a", 0.3)], [self.stage("b", 0.3)], [self.stage("c", 0.3)]])
+        self.assertLess(time.time() - start, 0.8)
+        self.assertEqual(set(results), {"a", "b", "c"})
+        self.assertTrue(all(result['status'] == 'ok' for result in results.values()))
+
+    def test_stages_in_a_chain_run_in_order(self):
+        pipeline.run_stages([[self.stage("warner", 0.2), self.stage("archiver")], [self.stage("announcer")]])
+        self.assertLess(self.events.index("warner"), self.events.index("archiver"))
+        self.assertEqual(self.events[0], "announcer")
+
+    def test_failure_skips_rest_of_chain_only(self):
+        results = pipeline.run_stages([[self.stage("warner", fail=True), self.stage("archiver")],
+                                       [self.stage("flagger")]])
+        self.assertEqual(results["warner"]['status'], 'failed')
+        self.assertIn("warner broke", results["warner"]['error'])
+        self.assertEqual(results["archiver"]['status'], 'skipped')
+        self.assertEqual(results["flagger"]['status'], 'ok')
+        self.assertNotIn("archiver", self.events)
+
+    def test_timeout(self):
+        results = pipeline.run_stages([[self.stage("warner", 1, timeout=0.1), self.stage("archiver")]])
+        self.assertEqual(results["warner"]['status'], 'timed out')
+        self.assertLess(results["warner"]['seconds'], 0.5)
+        self.assertEqual(results["archiver"]['status'], 'skipped')
+
+    def test_timed_out_stage_is_not_started_again_while_still_running(self):
+        release = threading.Event()
+        runs = []
+
+        def func():
+            runs.append(1)
+            release.wait(5)
+        stuck = pipeline.Stage("stuck", func, timeout=0.05)
+        self.assertEqual(pipeline.run_stages([[stuck]])["stuck"]['status'], 'timed out')
+        results = pipeline.run_stages([[stuck, self.stage("archiver")]])
+        self.assertEqual(results["stuck"]['status'], 'still running')
+        self.assertEqual(results["archiver"]['status'], 'skipped')
+        self.assertEqual(len(runs), 1)
+        release.set()
+        pipeline.running["stuck"].join(1)
+        self.assertEqual(pipeline.run_stages([[stuck]])["stuck"]['status'], 'ok')
+        self.assertEqual(len(runs), 2)
+
+    def test_concurrent_stages_have_their_own_budgets(self):
+        metrics.registry.reset()
+        used = {}
+        both_called = threading.Event()
+
+        def stage(name, calls):
+            def func():
+                run_budget = budget.Budget(api_calls=5)
+                metrics.registry.incr('api_calls', calls, method='channels.history')
+                with self.lock:
+                    self.events.append(name)
+                    if len(self.events) == 2:
+                        both_called.set()
+                both_called.wait(5)
+                used[name] = run_budget.used_api_calls()
+            return pipeline.Stage(name, func)
+
+        pipeline.run_stages([[stage("flagger", 50)], [stage("warner", 2)]])
+        self.assertEqual(used, {"flagger": 50, "warner": 2})
+
+    def test_summarize(self):
+        results = {"b": {'status': 'ok', 'seconds': 1.5}, "a": {'status': 'skipped', 'seconds': 0}}
+        self.assertEqual(pipeline.summarize(results), "a skipped (0s), b ok (1.5s)")
@@ -0,0 +1,25 @@
+import time
+import unittest
+
+import mock
+
+import planner
+import tests.fixtures as fixtures
+import tests.mocks as mocks
+
+
+class PlannerApplyTest(unittest.TestCase):
+    def setUp(self):
+        slacker_obj = mocks.mocked_slacker_object(channels_list=fixtures.channels, users_list=fixtures.users)
+        self.planner = planner.Planner(slacker_injected=slacker_obj, slackbot_injected=mocks.mocked_slackbot_object())
+        self.planner.ds.apply_plan = mock.MagicMock(return_value=[])
+
+    def test_applies_fresh_plan(self):
+        plan = {'created': time.time() - 3600, 'actions': []}
+        self.assertEqual(self.planner.apply(plan, max_age=86400), [])
+        self.planner.ds.apply_plan.assert_called_once_with(plan)
+
+    def test_refuses_stale_plan(self):
+        plan = {'created': time.time() - 2 * 86400, 'actions': []}
+        self.assertIsNone(self.planner.apply(plan, max_age=86400))
+        self.assertFalse(self.planner.ds.apply_plan.called)
@@ -0,0 +1,74 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import profiling
+
+
+class ProfilingTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def work(self):
+        with profiling.phase('history fetch'):
+            time.sleep(0.05)
+        with profiling.phase('evaluation'):
+            sum(range(100000))
+
+    def outputs(self, suffix):
+        return [os.path.join(self.tmpdir, f) for f in os.listdir(self.tmpdir) if f.endswith(suffix)]
+
+    def test_does_nothing_without_mode(self):
+        with profiling.profiled("warner", output_dir=self.tmpdir) as profiler:
+            self.work()
+        self.assertIsNone(profiler)
+        self.assertEqual(os.listdir(self.tmpdir), [])
+
+    def test_cprofile_mode_writes_pstats_and_phases(self):
+        with profiling.profiled("warner", "cprofile", output_dir=self.tmpdir):
+            self.work()
+        self.assertEqual(len(self.outputs(".pstats")), 1)
+        with open(self.outputs(".phases.json")[0]) as fo:
+            phases = json.load(fo)
+        self.assertGreaterEqual(phases['history fetch'], 0.05)
+        self.assertIn('evaluation', phases)
+
+    def test_sample_mode_tags_stacks_by_phase(self):
+        with profiling.profiled("warner", "sample", output_dir=self.tmpdir):
+            self.work()
+        with open(self.outputs(".collapsed")[0]) as fo:
+            stacks = fo.read()
+        self.assertIn("[history fetch];", stacks)
+
+    def test_in_phase_decorator(self):
+        @profiling.in_phase('posting')
+        def post():
+            return profiling.current_phase(profiling.threading.current_thread().ident)
+
+        self.assertEqual(post(), 'other')
+        with profiling.profiled("warner", "cprofile", output_dir=self.tmpdir):
+            self.assertEqual(post(), 'posting')
+
+    def test_jobs_profiled_at_once_keep_their_phases_apart(self):
+        profilers = {}
+
+        def job(name, phase):
+            with profiling.profiled(name, "cprofile", output_dir=self.tmpdir) as profiler:
+                profilers[name] = profiler
+                for i in range(5):
+                    with profiling.phase(phase):
+                        time.sleep(0.01)
+        threads = [profiling.threading.Thread(target=job, args=("warner", 'history fetch')),
+                   profiling.threading.Thread(target=job, args=("flagger", 'posting'))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(list(profilers['warner'].phase_times), ['history fetch'])
+        self.assertEqual(list(profilers['flagger'].phase_times), ['posting'])
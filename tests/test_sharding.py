@@ -0,0 +1,144 @@
+import copy
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+import destalinator
+import metrics
+import sharding
+import slackbot
+import state
+import tests.mocks as mocks
+
+
+class ShardOfTestCase(unittest.TestCase):
+    def test_is_deterministic_and_partitions(self):
+        cids = ["C{:08d}".format(i) for i in range(1000)]
+        shards = [[cid for cid in cids if sharding.in_shard(cid, (i, 4))] for i in range(4)]
+        self.assertEqual(sorted(sum(shards, [])), cids)
+        self.assertTrue(all(150 < len(shard) < 350 for shard in shards))
+        self.assertEqual(sharding.shard_of("C012839", 4), sharding.shard_of("C012839", 4))
+
+    def test_parse(self):
+        self.assertEqual(sharding.parse("1/3"), (1, 3))
+        self.assertRaises(AssertionError, sharding.parse, "3/3")
+
+
+class ChangesTestCase(unittest.TestCase):
+    def test_round_trip(self):
+        before = {'warnings': {'C1': 1, 'C2': 2}, 'activity': {'C1': {'last': 1, 'floor': 0}}}
+        after = copy.deepcopy(before)
+        after['warnings']['C3'] = 3
+        del after['warnings']['C2']
+        after['activity']['C1']['last'] = 5
+        after['created'] = {'C3': 10}
+        delta = sharding.changes(before, after)
+        self.assertEqual(len(delta['set']), 3)
+        data = copy.deepcopy(before)
+        sharding.apply_changes(data, delta)
+        self.assertEqual(data, after)
+
+    def test_shards_touching_different_channels_merge(self):
+        base = {'warnings': {'C1': 1}}
+        one = {'warnings': {'C1': 1, 'C2': 2}}
+        two = {'warnings': {'C3': 3}}
+        data = copy.deepcopy(base)
+        sharding.apply_changes(data, sharding.changes(base, one))
+        sharding.apply_changes(data, sharding.changes(base, two))
+        self.assertEqual(data, {'warnings': {'C2': 2, 'C3': 3}})
+
+
+class MergeTestCase(unittest.TestCase):
+    def setUp(self):
+        self.store = state.State()
+        self.ex = mock.MagicMock()
+        self.ex.config.general_message_channel = "general"
+
+    def result(self, index, warned, warnings):
+        shard_metrics = metrics.Metrics()
+        shard_metrics.incr('api_calls', 2, method='channels.history')
+        return {'shard': [index, 2], 'warned': warned,
+                'changes': sharding.changes({}, {'warnings': warnings}),
+                'metrics': shard_metrics.snapshot()}
+
+    @mock.patch('sharding.make_executor')
+    @mock.patch('sharding.state.from_config')
+    def test_merges_state_general_warning_and_metrics(self, from_config, make_executor):
+        from_config.return_value = self.store
+        make_executor.return_value = self.ex
+        sharding.merge('warner', [self.result(1, ['stalinists'], {'C2': 2}), self.result(0, ['leninists'], {'C1': 1})])
+        self.assertEqual(self.store.section('warnings'), {'C1': 1, 'C2': 2})
+        self.ex.ds.warn_in_general.assert_called_once_with(['leninists', 'stalinists'])
+        self.assertEqual(metrics.registry.counter('api_calls', method='channels.history'), 4)
+        self.assertTrue(self.ex.emit_report.called)
+
+    @mock.patch('sharding.make_executor')
+    @mock.patch('sharding.state.from_config')
+    def test_no_general_warning_without_warned_channels(self, from_config, make_executor):
+        from_config.return_value = self.store
+        make_executor.return_value = self.ex
+        sharding.merge('archiver', [self.result(0, [], {}), self.result(1, [], {})])
+        self.assertFalse(self.ex.ds.warn_in_general.called)
+
+
+@mock.patch('sharding.merge')
+@mock.patch('sharding.run_shard')
+class RunInstanceTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def run_instance(self, index, run_id="run-1"):
+        return sharding.run_instance('warner', (index, 2), run_id, results_dir=self.tmpdir)
+
+    def test_last_shard_of_the_run_merges(self, run_shard, merge):
+        run_shard.side_effect = lambda job, shard, force_warn: {'shard': list(shard)}
+        self.run_instance(0)
+        self.assertFalse(merge.called)
+        self.run_instance(1)
+        merge.assert_called_once_with('warner', [{'shard': [0, 2]}, {'shard': [1, 2]}])
+
+    def test_runs_are_kept_apart_by_id(self, run_shard, merge):
+        run_shard.side_effect = lambda job, shard, force_warn: {'shard': list(shard)}
+        self.run_instance(0, "run-1")
+        self.run_instance(1, "run-2")
+        self.assertFalse(merge.called)
+        self.run_instance(1, "run-1")
+        self.assertEqual(merge.call_count, 1)
+
+    def test_needs_run_id(self, run_shard, merge):
+        self.assertRaises(AssertionError, self.run_instance, 0, None)
+        self.assertFalse(run_shard.called)
+
+    def test_failed_shard_does_not_block_merge_and_is_merged_when_rerun(self, run_shard, merge):
+        run_shard.side_effect = ValueError("Slack is down")
+        self.assertRaises(ValueError, self.run_instance, 0)
+        self.assertTrue(os.path.exists(os.path.join(self.tmpdir, "warner-run-1", "0.failed")))
+        run_shard.side_effect = lambda job, shard, force_warn: {'shard': list(shard)}
+        self.run_instance(1)
+        merge.assert_called_once_with('warner', [{'shard': [1, 2]}])
+
+        self.run_instance(0)
+        merge.assert_called_with('warner', [{'shard': [0, 2]}])
+        self.assertEqual(merge.call_count, 2)
+        self.run_instance(0)
+        self.assertEqual(merge.call_count, 2)
+
+
+class DestalinatorShardTestCase(unittest.TestCase):
+    def test_channel_names_only_covers_shard(self):
+        channels = [{'id': "C{:04d}".format(i), 'name': "channel-{}".format(i)} for i in range(20)]
+        ds = destalinator.Destalinator(mocks.mocked_slacker_object(channels_list=channels),
+                                       slackbot.Slackbot("testing", "token"), activated=False)
+        everything = ds.channel_names()
+        self.assertEqual(everything, sorted(c['name'] for c in channels))
+        covered = []
+        for i in range(3):
+            ds.shard = (i, 3)
+            covered += ds.channel_names()
+        self.assertEqual(sorted(covered), everything)
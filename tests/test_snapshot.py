@@ -0,0 +1,45 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import snapshot
+import slacker
+from benchmarks import fake_slack
+from benchmarks import workspace
+
+
+class SnapshotTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.fname = os.path.join(self.tmpdir, "workspace.jsonl.gz")
+        self.workspace = workspace.generate(channels=30, users=10, messages_per_channel=20)
+        self.fake = fake_slack.FakeSlack(self.workspace)
+        snapshot.export(slacker.Slacker("testing", token="token", api_url=self.fake.url), self.fname)
+        self.fake.reset_counters()
+
+    def tearDown(self):
+        self.fake.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def test_round_trips_workspace(self):
+        snap = snapshot.Snapshot(self.fname)
+        self.assertEqual(len(snap.users), 10)
+        self.assertEqual(sorted(c['id'] for c in snap.channels),
+                         sorted(c['id'] for c in self.workspace.channels if not c['is_archived']))
+        channel = snap.channels[0]
+        self.assertEqual(channel['members'], list(self.workspace.members[channel['id']]))
+
+    def test_runs_without_network(self):
+        snap = snapshot.Snapshot(self.fname)
+        ex, _, actions = snapshot.run('warn', snap)
+        self.assertEqual(sum(self.fake.calls.values()), 0)
+        warned = [a['channel'] for a in actions if a['action'] == 'post' and a['type'] == 'channel_warning']
+        self.assertTrue(warned)
+        self.assertTrue(all(ex.ds.stale(name, ex.config.warn_threshold) for name in warned))
+
+    def test_plans_same_as_live_run(self):
+        snap = snapshot.Snapshot(self.fname)
+        _, plan, actions = snapshot.run('plan', snap)
+        self.assertEqual(actions, [])
+        self.assertEqual(len(plan['actions']), len(snap.channels))
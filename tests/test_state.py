@@ -0,0 +1,110 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import state
+
+
+class StateTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.fname = os.path.join(self.tmpdir, "state.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_in_memory_state_does_not_write(self):
+        store = state.State()
+        store.section('warnings')['C012839'] = 1
+        store.save()
+        self.assertEqual(os.listdir(self.tmpdir), [])
+
+    def test_round_trips_through_file(self):
+        store = state.State(self.fname)
+        store.section('warnings')['C012839'] = 1498076539.0
+        store.save()
+        self.assertEqual(state.State(self.fname).section('warnings'), {'C012839': 1498076539.0})
+
+    def test_ignores_unreadable_file(self):
+        with open(self.fname, "w") as fo:
+            fo.write("{not json")
+        self.assertEqual(state.State(self.fname).data, {})
+
+    def test_concurrent_writers_share_one_store(self):
+        store = state.State(self.fname)
+
+        def write(section):
+            for i in range(200):
+                with store.lock:
+                    store.section(section)[str(i)] = i
+                store.save()
+        threads = [threading.Thread(target=write, args=(name,)) for name in ('warnings', 'announced')]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        saved = state.State(self.fname)
+        self.assertEqual(len(saved.section('warnings')), 200)
+        self.assertEqual(len(saved.section('announced')), 200)
+
+    def test_saves_from_two_processes_are_merged(self):
+        jobs = state.State(self.fname)
+        listener = state.State(self.fname)
+        listener.section('activity')['C012839'] = {'last': 1.0, 'floor': 0, 'synced': 1.0}
+        listener.save()
+        jobs.section('warnings')['C012839'] = 2.0
+        jobs.section('activity')['C012840'] = {'last': None, 'floor': 0, 'synced': 2.0}
+        jobs.save()
+        listener.section('activity')['C012839']['last'] = 3.0
+        listener.save()
+        saved = state.State(self.fname)
+        self.assertEqual(saved.section('warnings'), {'C012839': 2.0})
+        self.assertEqual(sorted(saved.section('activity')), ['C012839', 'C012840'])
+        self.assertEqual(saved.section('activity')['C012839']['last'], 3.0)
+        # each store also picks up the other's changes when it saves
+        self.assertEqual(listener.section('warnings'), {'C012839': 2.0})
+
+    def test_deletions_are_merged(self):
+        jobs = state.State(self.fname)
+        jobs.section('warnings').update({'C012839': 1.0, 'C012840': 2.0})
+        jobs.save()
+        listener = state.State(self.fname)
+        warnings = listener.section('warnings')
+        del warnings['C012839']
+        listener.save()
+        jobs.section('created')['C012840'] = 3
+        jobs.save()
+        self.assertEqual(state.State(self.fname).section('warnings'), {'C012840': 2.0})
+        # sections handed out before the save are the ones updated
+        self.assertIs(listener.section('warnings'), warnings)
+
+    def test_refresh_picks_up_writes_elsewhere(self):
+        store = state.State(self.fname)
+        store.section('warnings')['C012839'] = 1
+        store.save()
+        self.assertFalse(store.refresh())
+        other = state.State(self.fname)
+        other.section('warnings')['C012840'] = 2
+        other.save()
+        # even if the file's mtime hasn't changed
+        os.utime(self.fname, (0, 0))
+        self.assertTrue(store.refresh())
+        self.assertEqual(store.section('warnings'), {'C012839': 1, 'C012840': 2})
+
+    def test_refresh_keeps_unsaved_changes(self):
+        store = state.State(self.fname)
+        store.section('warnings')['C012839'] = 1
+        store.save()
+        warnings = store.section('warnings')
+        warnings['C012841'] = 3
+        del warnings['C012839']
+        other = state.State(self.fname)
+        other.section('warnings')['C012840'] = 2
+        other.save()
+        store.refresh()
+        self.assertEqual(store.section('warnings'), {'C012840': 2, 'C012841': 3})
+        self.assertIs(store.section('warnings'), warnings)
+        store.save()
+        self.assertEqual(state.State(self.fname).section('warnings'), {'C012840': 2, 'C012841': 3})
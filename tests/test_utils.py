@@ -13,3 +13,9 @@ class UtilsGetLocalFileContentTestCase(unittest.TestCase):
     def test_ascii_file_content(self):
         content = utils.get_local_file_content("tests/content_ascii.txt")
         self.assertIn(u"'", content)
+
+
+class UtilsChunksTestCase(unittest.TestCase):
+    def test_chunks(self):
+        self.assertEqual(list(utils.chunks(iter(range(5)), 2)), [[0, 1], [2, 3], [4]])
+        self.assertEqual(list(utils.chunks([], 2)), [])
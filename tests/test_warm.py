@@ -0,0 +1,124 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+import config
+import metrics
+import scheduler
+import state
+import warm
+import tests.mocks as mocks
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class CacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        self.cache = warm.Cache({'emoji': 60, 'history': 60}, clock=self.clock)
+        self.load = mock.MagicMock(side_effect=lambda: self.load.call_count)
+
+    def test_reuses_values_until_they_expire(self):
+        self.assertEqual(self.cache.get('emoji', self.load), 1)
+        self.clock.now += 59
+        self.assertEqual(self.cache.get('emoji', self.load), 1)
+        self.clock.now += 1
+        self.assertEqual(self.cache.get('emoji', self.load), 2)
+
+    def test_reloads_when_the_version_changes(self):
+        self.cache.get('emoji', self.load, version=1)
+        self.assertEqual(self.cache.get('emoji', self.load, version=2), 2)
+        self.assertEqual(self.cache.get('emoji', self.load, version=2), 2)
+
+    def test_kinds_without_a_ttl_always_reload(self):
+        self.cache.get('flag_rules', self.load)
+        self.assertEqual(self.cache.get('flag_rules', self.load), 2)
+
+    def test_counts_hits_and_misses(self):
+        metrics.registry.reset()
+        self.cache.get('emoji', self.load)
+        self.cache.get('emoji', self.load)
+        self.assertEqual(metrics.registry.hit_rate('warm_emoji'), 0.5)
+
+    def test_history_fetches_only_new_messages(self):
+        slacker = mock.MagicMock()
+        slacker.get_messages_in_time_range.side_effect = [[{'ts': '20.0'}, {'ts': '10.0'}], [{'ts': '30.0'}]]
+        self.assertEqual(self.cache.history(slacker, 'C1', 25), [{'ts': '10.0'}, {'ts': '20.0'}])
+        self.assertEqual(self.cache.history(slacker, 'C1', 35), [{'ts': '10.0'}, {'ts': '20.0'}, {'ts': '30.0'}])
+        self.assertEqual([c[1] for c in slacker.get_messages_in_time_range.mock_calls], [(0, 'C1', 25), (25, 'C1', 35)])
+
+    def test_history_is_refetched_once_expired(self):
+        slacker = mock.MagicMock()
+        slacker.get_messages_in_time_range.return_value = []
+        self.cache.history(slacker, 'C1', 25)
+        self.clock.now += 60
+        self.cache.history(slacker, 'C1', 35)
+        self.assertEqual(slacker.get_messages_in_time_range.mock_calls[-1][1], (0, 'C1', 35))
+
+
+class ContextTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.fname = os.path.join(self.tmpdir, "state.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_refresh_expires_directories_and_rereads_state(self):
+        ex = mock.MagicMock(slacker=mocks.mocked_slacker_object(), state=state.State(self.fname),
+                            warm=warm.Cache({'directory': 0}))
+        context = warm.Context(ex)
+        other = state.State(self.fname)
+        other.section('activity')['C1'] = {'last': 1}
+        other.save()
+        context.refresh()
+        self.assertNotIn('channels_by_name', context.slacker.__dict__)
+        self.assertEqual(context.state.section('activity'), {'C1': {'last': 1}})
+
+    def test_scheduler_reuses_its_context_between_runs(self):
+        env = {'SB_TOKEN': 'token', 'API_TOKEN': 'token', 'DESTALINATOR_STATE_FILE': self.fname}
+        with mock.patch.dict(os.environ, env), mock.patch('pipeline.run_stages', return_value={}) as run_stages, \
+                mock.patch('executor.Executor.emit_report'), mock.patch.dict(scheduler.warm_contexts, clear=True):
+            scheduler.destalinate_job()
+            first = scheduler.warm_contexts[None]
+            scheduler.destalinate_job()
+            self.assertIs(scheduler.warm_contexts[None], first)
+        executors = [stage.func.__self__ for call in run_stages.mock_calls for chain in call[1][0] for stage in chain]
+        self.assertEqual(len(executors), 8)
+        self.assertEqual(set(ex.slacker for ex in executors), set([first.slacker]))
+        self.assertEqual(set(ex.warm for ex in executors), set([first.cache]))
+
+    def test_scheduler_runs_every_workspace_with_its_own_context(self):
+        other = os.path.join(self.tmpdir, "other.json")
+        configs = [config.Config(overrides={'slack_name': 'bolsheviks', 'state_file': self.fname}),
+                   config.Config(overrides={'slack_name': 'mensheviks', 'state_file': other})]
+        runs = []
+
+        def run_stages(chains, logger=None):
+            names = [stage.name for chain in chains for stage in chain]
+            runs.append((metrics.registry.context_labels().get('workspace'), names))
+            return dict((name, {'status': 'ok', 'seconds': 0}) for name in names)
+        env = {'SB_TOKEN': 'token', 'API_TOKEN': 'token'}
+        with mock.patch.dict(os.environ, env), mock.patch('config.workspaces', return_value=configs), \
+                mock.patch('pipeline.run_stages', side_effect=run_stages), \
+                mock.patch('executor.Executor.emit_report'), mock.patch.dict(scheduler.warm_contexts, clear=True), \
+                mock.patch.object(scheduler, 'workspace_session', None):
+            scheduler.destalinate_job()
+            contexts = dict(scheduler.warm_contexts)
+            scheduler.destalinate_job()
+            self.assertEqual(scheduler.warm_contexts, contexts)
+        self.assertEqual(sorted(contexts), ['bolsheviks', 'mensheviks'])
+        self.assertIsNot(contexts['bolsheviks'].slacker, contexts['mensheviks'].slacker)
+        self.assertEqual(contexts['mensheviks'].state.fname, other)
+        self.assertEqual(sorted(runs)[0], ('bolsheviks', ['bolsheviks/warner', 'bolsheviks/archiver',
+                                                          'bolsheviks/announcer', 'bolsheviks/flagger']))
+        self.assertEqual(len(runs), 4)
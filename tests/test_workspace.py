@@ -0,0 +1,24 @@
+import unittest
+
+from benchmarks import workspace
+
+
+class GenerateWorkspaceTestCase(unittest.TestCase):
+    def test_generates_requested_sizes(self):
+        ws = workspace.generate(channels=20, users=10, messages_per_channel=5)
+        # configuration.yaml's general, announce, control and log channels are always present
+        self.assertEqual(len(ws.channels), 24)
+        self.assertEqual(len(ws.users), 10)
+        self.assertTrue(all(len(ws.history[c['id']]) == 5 for c in ws.channels if c['name'].startswith('channel-')))
+
+    def test_is_reproducible(self):
+        first = workspace.generate(channels=20, seed=3, now=1500000000)
+        second = workspace.generate(channels=20, seed=3, now=1500000000)
+        self.assertEqual(first.channels, second.channels)
+        self.assertEqual(first.history, second.history)
+
+    def test_history_is_oldest_first(self):
+        ws = workspace.generate(channels=5, messages_per_channel=20)
+        for messages in ws.history.values():
+            timestamps = [float(m['ts']) for m in messages]
+            self.assertEqual(timestamps, sorted(timestamps))
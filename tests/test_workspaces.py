@@ -0,0 +1,56 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+import config
+import metrics
+import workspaces
+from benchmarks import fake_slack
+from benchmarks import workspace
+
+
+class WorkspacesTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.fakes = [fake_slack.FakeSlack(workspace.generate(channels=10, users=5, messages_per_channel=5, seed=i))
+                      for i in range(2)]
+        self.env = {'DESTALINATOR_ACTIVATED': 'true', 'DESTALINATOR_STATE_FILE': ''}
+        self.configs = []
+        for i, fake in enumerate(self.fakes):
+            self.env['API_TOKEN_{}'.format(i)] = self.env['SB_TOKEN_{}'.format(i)] = 'token'
+            self.configs.append(config.Config(overrides={
+                'slack_name': 'workspace{}'.format(i), 'api_url': fake.url, 'slackbot_url': fake.slackbot_url,
+                'api_token_env_varname': 'API_TOKEN_{}'.format(i), 'slackbot_api_token_env_varname': 'SB_TOKEN_{}'.format(i),
+                'state_file': os.path.join(self.tmpdir, 'state{}.json'.format(i)),
+            }))
+
+    def tearDown(self):
+        for fake in self.fakes:
+            fake.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def run_job(self, job):
+        with mock.patch.dict(os.environ, self.env), mock.patch('config.workspaces', return_value=self.configs):
+            return workspaces.run(job, workers=2)
+
+    def test_runs_every_workspace_with_its_own_state_and_metrics(self):
+        results = self.run_job('warner')
+        self.assertEqual([(x['workspace'], x['status']) for x in results], [('workspace0', 'ok'), ('workspace1', 'ok')])
+        for i, fake in enumerate(self.fakes):
+            self.assertGreater(fake.calls['channels.history'], 0)
+            self.assertGreater(fake.calls['chat.postMessage'], 0)
+            self.assertTrue(os.path.exists(os.path.join(self.tmpdir, 'state{}.json'.format(i))))
+            self.assertEqual(metrics.registry.total('api_calls', workspace='workspace{}'.format(i)), sum(fake.calls.values()))
+
+    def test_a_failing_workspace_doesnt_stop_the_others(self):
+        self.configs[0].config['api_url'] = "http://127.0.0.1:1/api/"
+        results = self.run_job('archiver')
+        self.assertEqual([x['status'] for x in results], ['failed', 'ok'])
+        self.assertIn('ConnectionError', results[0]['error'])
+
+    def test_workspaces_may_not_share_a_state_file(self):
+        self.configs[1].config['state_file'] = self.configs[0].config['state_file']
+        self.assertRaises(AssertionError, self.run_job, 'warner')
@@ -24,6 +24,18 @@ class SlackHandler(logging.Handler):
         self.slackbot.say(self.log_channel, record.getMessage())
 
 
+def chunks(iterable, size):
+    """Yield lists of up to `size` consecutive items from `iterable`, without reading more than that ahead."""
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
 def get_local_file_content(file_name):
     """Read the contents of `file_name` into a unicode string, return the unicode string."""
     f = codecs.open(file_name, encoding='utf-8')
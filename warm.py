@@ -0,0 +1,116 @@
+#! /usr/bin/env python
+"""
+What a long-lived process such as scheduler.py keeps warm between runs: the emoji
+equivalence classes, the compiled flag rules, the tail of the control channel's
+history and (through the shared Slacker and State) the user and channel directories
+and the per-channel activity index. Each kind of value is refetched once it is older
+than its TTL, in seconds (see `warm_ttls` in configuration.yaml).
+
+A one-off run gets a Cache whose TTLs are all 0, so it fetches everything as before.
+"""
+
+import threading
+import time
+
+import metrics
+
+
+# flag rules name their output channels, so they're refreshed with the channel directory; the
+# control channel's history only picks up new messages until it expires, so edited or deleted
+# rules apply until then and it expires with the rules
+DEFAULT_TTLS = {'directory': 3600, 'emoji': 3600, 'flag_rules': 3600, 'history': 3600}
+
+
+class Cache(object):
+    """Values kept between runs, each reused until it is older than the TTL for its kind."""
+
+    def __init__(self, ttls=None, default_ttl=0, clock=time.time):
+        """ttls maps the kind of value (the part of its key before any ':') to its TTL"""
+        self.ttls = ttls or {}
+        self.default_ttl = default_ttl
+        self.clock = clock
+        self.entries = {}
+        self.lock = threading.RLock()
+
+    def ttl(self, key):
+        return self.ttls.get(key.split(':')[0], self.default_ttl)
+
+    def count(self, key, hit):
+        if self.ttl(key):
+            metrics.registry.incr('cache_hits' if hit else 'cache_misses', cache='warm_' + key.split(':')[0])
+
+    def fresh(self, key, version=None):
+        """Return the entry for `key` if it is younger than its TTL and was made from `version`."""
+        entry = self.entries.get(key)
+        if entry and self.clock() - entry['at'] < self.ttl(key) and entry['version'] == version:
+            return entry
+        return None
+
+    def get(self, key, load, version=None):
+        """
+        Return the value for `key`, calling load() for a new one if it has expired or was
+        made from something other than `version` (e.g. the messages rules were parsed from)
+        """
+        with self.lock:
+            entry = self.fresh(key, version)
+            self.count(key, entry is not None)
+            if entry:
+                return entry['value']
+            value = load()
+            self.entries[key] = {'at': self.clock(), 'version': version, 'value': value}
+            return value
+
+    def forget(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def history(self, slacker, cid, latest):
+        """
+        Return every message in channel `cid` before `latest`, oldest first. Within the
+        'history' TTL only the messages posted since the previous call are fetched, so this
+        suits channels whose messages are added but not edited, like the control channel.
+        """
+        key = 'history:' + cid
+        with self.lock:
+            entry = self.fresh(key)
+            self.count(key, entry is not None)
+            if entry is None or latest < entry['value']['synced']:
+                messages = slacker.get_messages_in_time_range(0, cid, latest)
+                entry = {'at': self.clock(), 'version': None,
+                         'value': {'messages': sorted(messages, key=lambda m: float(m['ts'])), 'synced': latest}}
+                self.entries[key] = entry
+            else:
+                tail = entry['value']
+                if latest > tail['synced']:
+                    new = slacker.get_messages_in_time_range(tail['synced'], cid, latest)
+                    tail['messages'] = tail['messages'] + sorted(new, key=lambda m: float(m['ts']))
+                    tail['synced'] = latest
+            return list(entry['value']['messages'])
+
+
+def from_config(config):
+    """Return a Cache with the TTLs in `config`'s `warm_ttls` (and the defaults for the rest)."""
+    ttls = dict(DEFAULT_TTLS)
+    ttls.update(config.get('warm_ttls') or {})
+    return Cache(ttls)
+
+
+class Context(object):
+    """The Slacker, Slackbot, State and Cache a long-lived process shares between its runs."""
+
+    def __init__(self, ex):
+        """ex is the first run's executor, whose Slacker, Slackbot, State and Cache later runs reuse"""
+        self.slacker = ex.slacker
+        self.slackbot = ex.slackbot
+        self.state = ex.state
+        self.cache = ex.warm
+
+    def refresh(self):
+        """Before a run: drop directories older than their TTL and pick up others' writes to the state file."""
+        self.slacker.expire_directories(self.cache.ttl('directory'))
+        self.state.refresh()
+
+    def injected(self):
+        """Return the keyword arguments handing all of this to an executor."""
+        return {'slacker_injected': self.slacker, 'slackbot_injected': self.slackbot,
+                'state_injected': self.state, 'warm_injected': self.cache}
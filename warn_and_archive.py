@@ -8,3 +8,4 @@ if __name__ == "__main__":
     warn_and_archive_archiver = archiver.Archiver()
     warn_and_archive_warner.warn()
     warn_and_archive_archiver.archive()
+    warn_and_archive_archiver.emit_report()
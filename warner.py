@@ -1,8 +1,10 @@
 #! /usr/bin/env python
 
-import sys
+import argparse
 
 import executor
+import profiling
+import sharding
 
 
 class Warner(executor.Executor):
@@ -11,8 +13,16 @@ class Warner(executor.Executor):
         self.ds.warn_all(self.config.warn_threshold, force_warn)
 
 if __name__ == "__main__":
-    warner = Warner()
-    force_warn = False
-    if len(sys.argv) == 2 and sys.argv[1] == "force":
-        force_warn = True
-    warner.warn(force_warn=force_warn)
+    parser = argparse.ArgumentParser(description='Warn channels that have been stale for a while.')
+    parser.add_argument("force", nargs="?", choices=["force"], help="warn even channels already warned")
+    profiling.add_argument(parser)
+    sharding.add_argument(parser)
+    args = parser.parse_args()
+
+    if sharding.requested(args.shards):
+        sharding.run("warner", args.shards, force_warn=args.force == "force")
+    else:
+        with profiling.profiled("warner", args.profile):
+            warner = Warner()
+            warner.warn(force_warn=args.force == "force")
+        warner.emit_report()
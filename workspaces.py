@@ -0,0 +1,141 @@
+#! /usr/bin/env python
+"""
+Run the warner, archiver, announcer or flagger against several Slack workspaces from one process.
+
+List the workspaces under `workspaces` in configuration.yaml. Each entry's settings replace
+the top-level ones for that workspace: it needs a `slack_name`, and usually its own token
+environment variables and state file.
+
+    python workspaces.py warn
+
+scheduler.py runs every job against each of them the same way whenever `workspaces` is set.
+
+Up to `workspace_workers` workspaces run at once on one thread pool and share one HTTP
+connection pool, while each keeps its own Slacker (so its own rate limit, concurrency
+limits and user and channel directories), state and budget. Everything measured for a
+workspace carries a `workspace` label.
+"""
+
+import argparse
+import logging
+import multiprocessing.pool
+import time
+import traceback
+
+import requests
+
+import config
+import metrics
+import state
+
+
+JOBS = ('warner', 'archiver', 'announcer', 'flagger')
+
+
+def make_executor(job, **kwargs):
+    if job == 'warner':
+        import warner
+        return warner.Warner(**kwargs)
+    if job == 'archiver':
+        import archiver
+        return archiver.Archiver(**kwargs)
+    if job == 'announcer':
+        import announcer
+        return announcer.Announcer(**kwargs)
+    import flagger
+    return flagger.Flagger(**kwargs)
+
+
+def check(configs):
+    """Check no two workspaces have the same name or would write the same state file."""
+    names = set()
+    state_files = {}
+    for cfg in configs:
+        name = cfg.get('slack_name')
+        assert name not in names, "Workspace {} is listed twice".format(name)
+        names.add(name)
+        fname = state.filename(cfg)
+        if fname:
+            assert fname not in state_files, "Workspaces {} and {} would share the state file {}".format(
+                state_files[fname], name, fname)
+            state_files[fname] = name
+
+
+def make_session(workspaces, workers):
+    """Return a requests.Session keeping connections open to each workspace, for `workers` threads."""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=max(workspaces, 10), pool_maxsize=max(workers, 10))
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def run_workspace(job, cfg, session, force_warn=False, logger=None):
+    """Run `job` for the workspace configured by `cfg`; return its outcome, like a pipeline stage's."""
+    logger = logger or logging.getLogger(__name__)
+    name = cfg.get('slack_name')
+    start = time.time()
+    result = {'workspace': name}
+    with metrics.registry.labelled(workspace=name):
+        try:
+            ex = make_executor(job, config_injected=cfg, session=session)
+            if job == 'warner':
+                ex.warn(force_warn=force_warn)
+            elif job == 'archiver':
+                ex.archive()
+            elif job == 'announcer':
+                ex.announce()
+            else:
+                ex.flag()
+            result['status'] = 'ok'
+            result['executor'] = ex
+        except Exception as e:
+            result['status'] = 'failed'
+            result['error'] = "{}: {}".format(e.__class__.__name__, e)
+            logger.error("The %s run for %s failed:\n%s", job, name, traceback.format_exc())
+    result['seconds'] = round(time.time() - start, 3)
+    result['api_calls'] = metrics.registry.total('api_calls', workspace=name)
+    return result
+
+
+def run(job, workers=None, force_warn=False, logger=None):
+    """
+    Run `job` for every workspace in the configuration, `workers` (default: `workspace_workers`,
+    or 4) at a time; report the metrics of the whole run and return each workspace's outcome.
+    """
+    assert job in JOBS, "Unknown job {}".format(job)
+    logger = logger or logging.getLogger(__name__)
+    configs = config.workspaces()
+    assert configs, "No workspaces are listed under `workspaces` in the configuration"
+    check(configs)
+    workers = min(workers or config.Config().get('workspace_workers') or 4, len(configs))
+    session = make_session(len(configs), workers)
+
+    metrics.registry.reset()
+    pool = multiprocessing.pool.ThreadPool(workers)
+    try:
+        results = pool.map(lambda cfg: run_workspace(job, cfg, session, force_warn, logger), configs)
+    finally:
+        pool.close()
+        pool.join()
+
+    for result in results:
+        logger.info("%s: %s %s in %ss with %s API calls", result['workspace'], job, result['status'],
+                    result['seconds'], result['api_calls'])
+    reporters = [result.pop('executor') for result in results if 'executor' in result]
+    if reporters:
+        reporters[0].emit_report()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Run a job against every workspace in the configuration.')
+    parser.add_argument("job", choices=["warn", "archive", "announce", "flag"])
+    parser.add_argument("force", nargs="?", choices=["force"], help="warn even channels already warned")
+    parser.add_argument("--workers", type=int, default=None, help="workspaces to run at once")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    job = {'warn': 'warner', 'archive': 'archiver', 'announce': 'announcer', 'flag': 'flagger'}[args.job]
+    outcomes = run(job, workers=args.workers, force_warn=args.force == "force")
+    print(", ".join("{} {} ({}s)".format(x['workspace'], x['status'], x['seconds']) for x in outcomes))